@@ -0,0 +1,6 @@
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Live samples of exited workers are dropped, see store.metrics
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,179 @@
+"""
+Like counts kept in Redis, so showing them on a page of objects costs one
+HMGET instead of a COUNT per object.
+
+Each content type has one hash, `likes:counts:<content type id>`, holding one
+field per object id with its number of likes. Counters are moved by
+LikedItem.objects.like/unlike once the row change is committed and marked
+dirty; flush (run periodically by likes.tasks.flush_like_counts) copies the
+dirty ones to LikeCount. reconcile recounts LikedItem and corrects whatever
+drifted, e.g. after Redis lost keys.
+
+A counter missing from Redis is seeded from LikedItem with HSETNX. like and
+unlike seed before writing their row, so an increment always lands on a
+seeded counter and a seed can't count a like twice.
+"""
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Count
+
+
+KEY = "likes:counts:{content_type_id}"
+DIRTY_KEY = "likes:dirty"
+
+
+def get_redis():
+    from django_redis import get_redis_connection
+
+    return get_redis_connection(getattr(settings, "LIKES_CACHE_ALIAS", "default"))
+
+
+def key(content_type_id):
+    return KEY.format(content_type_id=content_type_id)
+
+
+def count_likes(content_type_id, object_ids=None):
+    """
+    Returns {object id: number of likes} counted from LikedItem, objects
+    without likes are left out.
+    """
+
+    from .models import LikedItem
+
+    queryset = LikedItem.objects.filter(content_type_id=content_type_id)
+    if object_ids is not None:
+        queryset = queryset.filter(object_id__in=object_ids)
+    return dict(
+        queryset.order_by()
+        .values("object_id")
+        .annotate(count=Count("id"))
+        .values_list("object_id", "count")
+    )
+
+
+def seed(content_type_id, object_ids):
+    """
+    Returns {object id: number of likes} for the given objects, seeding the
+    counters missing from Redis with one query.
+    """
+
+    object_ids = list(dict.fromkeys(int(pk) for pk in object_ids))
+    if not object_ids:
+        return {}
+
+    redis = get_redis()
+    values = redis.hmget(key(content_type_id), object_ids)
+    counts = {
+        pk: int(value) for pk, value in zip(object_ids, values) if value is not None
+    }
+    missing = [pk for pk in object_ids if pk not in counts]
+    if not missing:
+        return counts
+
+    likes = count_likes(content_type_id, missing)
+    with redis.pipeline() as pipeline:
+        for pk in missing:
+            pipeline.hsetnx(key(content_type_id), pk, likes.get(pk, 0))
+        for pk in missing:
+            pipeline.hget(key(content_type_id), pk)
+        results = pipeline.execute()[len(missing) :]
+    # Another process may have seeded (and moved) the counter in between
+    counts.update((pk, int(value)) for pk, value in zip(missing, results))
+    return counts
+
+
+def add(content_type_id, object_id, delta):
+    with get_redis().pipeline() as pipeline:
+        pipeline.hincrby(key(content_type_id), object_id, delta)
+        pipeline.sadd(DIRTY_KEY, f"{content_type_id}:{object_id}")
+        count, _ = pipeline.execute()
+    return count
+
+
+def write_counts(counts):
+    """
+    Upserts {(content type id, object id): count} into LikeCount.
+    """
+
+    from .models import LikeCount
+
+    # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target
+    features = connections[router.db_for_write(LikeCount)].features
+    LikeCount.objects.bulk_create(
+        [
+            LikeCount(content_type_id=content_type_id, object_id=object_id, count=count)
+            for (content_type_id, object_id), count in counts.items()
+        ],
+        update_conflicts=True,
+        unique_fields=(
+            ["content_type", "object_id"]
+            if features.supports_update_conflicts_with_target
+            else None
+        ),
+        update_fields=["count"],
+    )
+
+
+def flush(batch_size=500):
+    """
+    Copies the counters changed since the last flush to LikeCount and returns
+    how many were written.
+    """
+
+    redis = get_redis()
+    flushed = 0
+    while True:
+        members = redis.spop(DIRTY_KEY, batch_size)
+        if not members:
+            return flushed
+
+        pairs = [tuple(map(int, member.split(b":"))) for member in members]
+        with redis.pipeline() as pipeline:
+            for content_type_id, object_id in pairs:
+                pipeline.hget(key(content_type_id), object_id)
+            values = pipeline.execute()
+
+        try:
+            write_counts(
+                {
+                    pair: max(int(value), 0)
+                    for pair, value in zip(pairs, values)
+                    if value is not None
+                }
+            )
+        except Exception:
+            # Marked dirty again, for the next flush
+            redis.sadd(DIRTY_KEY, *members)
+            raise
+        flushed += len(pairs)
+
+
+def reconcile(content_type_id):
+    """
+    Recounts the likes of a content type, corrects the Redis counters and
+    LikeCount rows that drifted and returns the number of corrected counters.
+
+    Likes committed while this runs may be overwritten, so it's meant for
+    quiet hours (see likes.tasks.reconcile_like_counts).
+    """
+
+    from .models import LikeCount
+
+    likes = count_likes(content_type_id)
+    redis = get_redis()
+    cached = {
+        int(pk): int(value) for pk, value in redis.hgetall(key(content_type_id)).items()
+    }
+    drifted = {
+        pk: likes.get(pk, 0)
+        for pk in cached.keys() | likes.keys()
+        if cached.get(pk) != likes.get(pk, 0)
+    }
+    if drifted:
+        redis.hset(key(content_type_id), mapping=drifted)
+
+    stored = LikeCount.objects.filter(content_type_id=content_type_id)
+    stored.exclude(object_id__in=list(likes)).delete()
+    write_counts({(content_type_id, pk): count for pk, count in likes.items()})
+    return len(drifted)
@@ -1,13 +1,92 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 # from django.contrib.auth.models import User
 from django.conf import settings
 
+from . import counters
+
+
+class LikedItemManager(models.Manager):
+    def like(self, user, obj):
+        """
+        Likes `obj` on behalf of `user`. Returns False if it was already
+        liked, so repeating the call is harmless.
+        """
+
+        content_type = ContentType.objects.get_for_model(obj)
+        # The counter has to exist before the row does, see counters.seed
+        counters.seed(content_type.id, [obj.pk])
+        try:
+            with transaction.atomic():
+                self.create(user=user, content_type=content_type, object_id=obj.pk)
+        except IntegrityError:
+            return False
+
+        transaction.on_commit(lambda: counters.add(content_type.id, obj.pk, 1))
+        return True
+
+    def unlike(self, user, obj):
+        """
+        Takes back the like of `user` on `obj`. Returns False if there was
+        none.
+        """
+
+        content_type = ContentType.objects.get_for_model(obj)
+        counters.seed(content_type.id, [obj.pk])
+        deleted, _ = self.filter(
+            user=user, content_type=content_type, object_id=obj.pk
+        ).delete()
+        if not deleted:
+            return False
+
+        transaction.on_commit(lambda: counters.add(content_type.id, obj.pk, -1))
+        return True
+
+    def counts_for(self, obj_type, obj_ids):
+        """
+        Returns {object id: number of likes} for the given objects, read from
+        the Redis counters.
+        """
+
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return counters.seed(content_type.id, obj_ids)
+
 
 class LikedItem(models.Model):
+    objects = LikedItemManager()
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "content_type", "object_id"], name="unique_like"
+            )
+        ]
+        indexes = [
+            # Likes of given objects (counting, see counters)
+            models.Index(fields=["content_type", "object_id"]),
+        ]
+
+
+class LikeCount(models.Model):
+    """
+    SQL copy of the Redis like counters, written by counters.flush and
+    counters.reconcile. LikedItem stays the source of truth.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_type", "object_id"], name="unique_like_count"
+            )
+        ]
@@ -0,0 +1,32 @@
+from celery import shared_task
+
+from . import counters
+from .models import LikedItem, LikeCount
+
+
+@shared_task
+def flush_like_counts():
+    """
+    Writes the like counters changed in Redis to LikeCount.
+    """
+
+    return counters.flush()
+
+
+@shared_task
+def reconcile_like_counts():
+    """
+    Recounts the likes of every content type and repairs drifted counters.
+    """
+
+    content_type_ids = set(
+        LikedItem.objects.order_by()
+        .values_list("content_type_id", flat=True)
+        .distinct()
+    )
+    content_type_ids.update(
+        LikeCount.objects.order_by()
+        .values_list("content_type_id", flat=True)
+        .distinct()
+    )
+    return sum(counters.reconcile(pk) for pk in sorted(content_type_ids))
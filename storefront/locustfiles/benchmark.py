@@ -0,0 +1,165 @@
+"""
+Headless run of the Locust scenarios with a regression gate.
+
+    python locustfiles/benchmark.py --users 20 --run-time 60 \
+        --output results.json --baseline locustfiles/baseline.json
+
+Writes p50/p95/p99 (ms), requests per second and failures per scenario to
+--output and compares them with --baseline. Exits with 1 when a scenario
+regressed past --threshold, e.g. its p95 grew by more than 20%. A missing
+baseline is written from the run (so is any baseline with
+--update-baseline).
+
+Only local hosts are accepted: the numbers are meant to compare code
+changes on one machine, not networks.
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from urllib.parse import urlsplit
+
+# Importing locust patches the standard library for gevent
+import gevent
+from locust.env import Environment
+
+
+LOCAL_HOSTS = ["localhost", "127.0.0.1", "::1"]
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+# Percentiles this close to the baseline are noise, whatever the threshold
+MIN_DELTA_MS = 5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--spawn-rate", type=float, default=5)
+    parser.add_argument("--run-time", type=int, default=60, help="Seconds")
+    parser.add_argument(
+        "--warm-up", type=int, default=10, help="Seconds left out of the stats"
+    )
+    parser.add_argument("--data", help="Defaults to locustfiles/data.json")
+    parser.add_argument("--output", default="results.json")
+    parser.add_argument(
+        "--baseline", default=str(Path(__file__).with_name("baseline.json"))
+    )
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--update-baseline", action="store_true")
+    return parser.parse_args()
+
+
+def run(args):
+    if args.data:
+        os.environ["LOADTEST_DATA"] = args.data
+    # Imported late so the data file can be chosen
+    from scenarios import Admin, Customer, Shopper
+
+    environment = Environment(user_classes=[Shopper, Customer, Admin], host=args.host)
+    runner = environment.create_local_runner()
+    runner.start(args.users, spawn_rate=args.spawn_rate)
+    gevent.spawn_later(args.warm_up, environment.stats.reset_all)
+    gevent.spawn_later(args.warm_up + args.run_time, runner.quit)
+    runner.greenlet.join()
+
+    scenarios = {}
+    for entry in environment.stats.entries.values():
+        scenarios[entry.name] = {
+            "requests": entry.num_requests,
+            "failures": entry.num_failures,
+            "rps": round(entry.num_requests / args.run_time, 2),
+            **{
+                name: entry.get_response_time_percentile(percentile)
+                for name, percentile in PERCENTILES.items()
+            },
+        }
+    return {
+        "users": args.users,
+        "run_time": args.run_time,
+        "scenarios": dict(sorted(scenarios.items())),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns (regressions, warnings) as lists of messages.
+    """
+
+    regressions, warnings = [], []
+    if (results["users"], results["run_time"]) != (
+        baseline["users"],
+        baseline["run_time"],
+    ):
+        warnings.append(
+            f"The baseline ran {baseline['users']} users for "
+            f"{baseline['run_time']}s, requests per second aren't comparable"
+        )
+
+    for name, base in baseline["scenarios"].items():
+        current = results["scenarios"].get(name)
+        if current is None:
+            warnings.append(f"{name}: not exercised in this run")
+            continue
+
+        for percentile in PERCENTILES:
+            limit = max(
+                base[percentile] * (1 + threshold), base[percentile] + MIN_DELTA_MS
+            )
+            if current[percentile] > limit:
+                regressions.append(
+                    f"{name}: {percentile} is {current[percentile]}ms, "
+                    f"baseline {base[percentile]}ms"
+                )
+
+        if current["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(
+                f"{name}: {current['rps']} requests/s, baseline {base['rps']}"
+            )
+
+        failure_rate = current["failures"] / max(current["requests"], 1)
+        base_failure_rate = base["failures"] / max(base["requests"], 1)
+        if failure_rate > base_failure_rate + 0.01:
+            regressions.append(
+                f"{name}: {failure_rate:.1%} of the requests failed, "
+                f"baseline {base_failure_rate:.1%}"
+            )
+
+    return regressions, warnings
+
+
+def main():
+    args = parse_args()
+    if urlsplit(args.host).hostname not in LOCAL_HOSTS:
+        sys.exit(f"{args.host} isn't local, run the server on this machine")
+
+    results = run(args)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    for name, stats in results["scenarios"].items():
+        print(
+            f"{name:<24} {stats['rps']:>8.2f} req/s  p50 {stats['p50']:>5}ms  "
+            f"p95 {stats['p95']:>5}ms  p99 {stats['p99']:>5}ms  "
+            f"{stats['failures']} failures"
+        )
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline or not baseline_path.exists():
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"Wrote the baseline to {baseline_path}")
+        return
+
+    regressions, warnings = compare(
+        results, json.loads(baseline_path.read_text()), args.threshold
+    )
+    for message in warnings:
+        print(f"Warning: {message}")
+    for message in regressions:
+        print(f"Regression: {message}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Ids and credentials the scenarios sample from, written by
+
+    python manage.py prepare_load_test
+
+so every request targets a row that exists in the local database.
+"""
+
+import json
+import os
+import random
+from pathlib import Path
+
+
+DATA_FILE = os.environ.get("LOADTEST_DATA", Path(__file__).with_name("data.json"))
+
+
+class LoadTestData:
+    def __init__(self, path=DATA_FILE):
+        try:
+            data = json.loads(Path(path).read_text())
+        except FileNotFoundError:
+            raise SystemExit(
+                f"{path} is missing, run `python manage.py prepare_load_test` first"
+            )
+
+        self.products = data["products"]
+        self.collections = data["collections"]
+        self.search_terms = data["search_terms"]
+        self.tags = data["tags"]
+        self.customers = data["customers"]
+        self.admin = data["admin"]
+
+    def product_id(self):
+        return random.choice(self.products)
+
+    def product_ids(self, count):
+        return random.sample(self.products, min(count, len(self.products)))
+
+    def collection_id(self):
+        return random.choice(self.collections)
+
+    def search_term(self):
+        return random.choice(self.search_terms)
+
+    def customer(self):
+        return random.choice(self.customers)
@@ -0,0 +1,152 @@
+"""
+Load test scenarios for the storefront API.
+
+    python manage.py seed_db
+    python manage.py prepare_load_test
+    python manage.py runserver --noreload
+    locust -f locustfiles/scenarios.py --host http://127.0.0.1:8000
+
+Requests are named after their scenario ("products: search", "orders:
+checkout", ...), which is what benchmark.py reports and compares.
+"""
+
+import random
+
+from locust import HttpUser, between, task
+
+from data import LoadTestData
+
+
+data = LoadTestData()
+
+
+class Shopper(HttpUser):
+    """
+    Anonymous visitor searching, filtering and reading products.
+    """
+
+    weight = 6
+    wait_time = between(1, 3)
+
+    @task(3)
+    def search(self):
+        self.client.get(
+            "/store/products/",
+            params={"search": data.search_term()},
+            name="products: search",
+        )
+
+    @task(3)
+    def filter(self):
+        self.client.get(
+            "/store/products/",
+            params={
+                "collection_id": data.collection_id(),
+                "unit_price__lt": random.choice([10, 25, 50, 100]),
+                "ordering": random.choice(["unit_price", "-unit_price"]),
+            },
+            name="products: filter",
+        )
+
+    @task(1)
+    def filter_by_tag(self):
+        if data.tags:
+            self.client.get(
+                "/store/products/",
+                params={"tags": random.choice(data.tags), "include": "tags"},
+                name="products: tags",
+            )
+
+    @task(2)
+    def browse(self):
+        self.client.get("/store/products/", name="products: list")
+
+    @task(4)
+    def view_product(self):
+        self.client.get(
+            f"/store/products/{data.product_id()}/", name="products: detail"
+        )
+
+
+class Customer(HttpUser):
+    """
+    Signed in customer building carts, checking out and reading their
+    orders.
+    """
+
+    weight = 3
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        response = self.client.post(
+            "/auth/jwt/create/", json=data.customer(), name="auth: login"
+        )
+        self.client.headers["Authorization"] = f"JWT {response.json()['access']}"
+
+    def build_cart(self):
+        cart_id = self.client.post("/store/carts/", name="carts: create").json()["id"]
+        for product_id in data.product_ids(random.randint(1, 4)):
+            self.client.post(
+                f"/store/carts/{cart_id}/items/",
+                json={"product_id": product_id, "quantity": random.randint(1, 3)},
+                name="carts: add item",
+            )
+        return cart_id
+
+    @task(3)
+    def fill_cart(self):
+        cart_id = self.build_cart()
+        self.client.get(f"/store/carts/{cart_id}/", name="carts: detail")
+
+    @task(1)
+    def checkout(self):
+        cart_id = self.build_cart()
+        self.client.post(
+            "/store/orders/", json={"cart_id": cart_id}, name="orders: checkout"
+        )
+
+    @task(2)
+    def order_history(self):
+        self.client.get("/store/orders/", name="orders: history")
+        self.client.get("/store/customers/me/", name="customers: me")
+
+
+class Admin(HttpUser):
+    """
+    Staff member going through the admin change lists.
+    """
+
+    weight = 1
+    wait_time = between(2, 5)
+
+    def on_start(self):
+        self.client.get("/admin/login/", name="admin: login")
+        self.client.post(
+            "/admin/login/",
+            data={
+                **data.admin,
+                "csrfmiddlewaretoken": self.client.cookies.get("csrftoken", ""),
+                "next": "/admin/",
+            },
+            name="admin: login",
+        )
+
+    @task(2)
+    def orders(self):
+        self.client.get("/admin/store/order/", name="admin: orders")
+
+    @task(2)
+    def customers(self):
+        self.client.get(
+            "/admin/store/customer/",
+            params={"membership__exact": random.choice("BSG")},
+            name="admin: customers",
+        )
+
+    @task(1)
+    def products(self):
+        self.client.get(
+            "/admin/store/product/",
+            params={"collection__id__exact": data.collection_id()},
+            name="admin: products",
+        )
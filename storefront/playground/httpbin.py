@@ -0,0 +1,172 @@
+"""
+Calls to httpbin for HelloView, without tying up a worker while it answers.
+
+    HTTPBIN = {
+        "URL": "https://httpbin.org/delay/2",
+        "TIMEOUT": 5,
+        "MAX_CONNECTIONS": 20,
+        "CACHE_TTL": 60,
+        "FAILURE_THRESHOLD": 5,
+        "RESET_TIMEOUT": 30,
+    }
+
+fetch() returns the JSON body of URL. Responses are cached for CACHE_TTL
+seconds and concurrent callers missing the cache share one in-flight
+request. After FAILURE_THRESHOLD failed requests in a row (errors, timeouts
+and non-2xx responses) the circuit opens: calls fail with CircuitOpenError
+without going upstream for RESET_TIMEOUT seconds, then one call is let
+through and its outcome closes or reopens the circuit.
+
+Each event loop gets its own pooled httpx.AsyncClient. Serve the project
+through storefront/asgi.py to share it between requests:
+
+    gunicorn storefront.asgi:application -k uvicorn.workers.UvicornWorker
+
+Under WSGI (runserver) every request runs in a new event loop, so it gets a
+new client and waits alone.
+
+Under ASGI the middleware in settings.common is async-capable (WhiteNoise
+through storefront.middleware), so HelloView is awaited on the event loop.
+The profiling middleware added by settings.dev (silk and the debug toolbar)
+is sync-only: with it, Django runs each request past it in a thread.
+"""
+
+import asyncio
+import logging
+import time
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+from django.core.cache import cache
+
+import httpx
+
+
+DEFAULTS = {
+    "URL": "https://httpbin.org/delay/2",
+    "TIMEOUT": 5,
+    "MAX_CONNECTIONS": 20,
+    "CACHE_TTL": 60,
+    "FAILURE_THRESHOLD": 5,
+    "RESET_TIMEOUT": 30,
+}
+
+CACHE_KEY = "playground:httpbin:{url}"
+
+logger = logging.getLogger(__name__)
+
+# Per event loop: the client, and the requests in flight by URL
+clients = WeakKeyDictionary()
+in_flight = WeakKeyDictionary()
+# Per URL, shared by the event loops of the process
+breakers = {}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trying = False
+
+    def allow(self):
+        """
+        Returns whether a call may go upstream, letting one through when the
+        circuit has been open for reset_timeout.
+        """
+
+        if self.opened_at is None:
+            return True
+        if self.trying or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.trying = True
+        return True
+
+    def succeeded(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trying = False
+
+    def failed(self):
+        self.failures += 1
+        if self.trying or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trying = False
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "HTTPBIN", {})}
+
+
+def get_client(config):
+    loop = asyncio.get_running_loop()
+    if loop not in clients:
+        clients[loop] = httpx.AsyncClient(
+            timeout=config["TIMEOUT"],
+            limits=httpx.Limits(max_connections=config["MAX_CONNECTIONS"]),
+        )
+    return clients[loop]
+
+
+async def close_client():
+    client = clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def get_breaker(url, config):
+    if url not in breakers:
+        breakers[url] = CircuitBreaker(
+            config["FAILURE_THRESHOLD"], config["RESET_TIMEOUT"]
+        )
+    return breakers[url]
+
+
+async def call(url, config):
+    breaker = get_breaker(url, config)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Not calling {url}, it's failing")
+
+    try:
+        response = await get_client(config).get(url)
+        response.raise_for_status()
+        data = response.json()
+    except (httpx.HTTPError, ValueError) as error:
+        breaker.failed()
+        raise UpstreamError(f"Calling {url} failed: {error!r}") from error
+
+    breaker.succeeded()
+    try:
+        await cache.aset(CACHE_KEY.format(url=url), data, config["CACHE_TTL"])
+    except Exception:
+        logger.warning("Caching the response of %s failed", url, exc_info=True)
+    return data
+
+
+async def fetch():
+    config = get_config()
+    url = config["URL"]
+    # The cache only saves calls, the page doesn't depend on it (e.g. Redis)
+    try:
+        data = await cache.aget(CACHE_KEY.format(url=url))
+    except Exception:
+        logger.warning("Reading the cached response failed", exc_info=True)
+        data = None
+    if data is not None:
+        return data
+
+    calls = in_flight.setdefault(asyncio.get_running_loop(), {})
+    if url not in calls:
+        calls[url] = asyncio.ensure_future(call(url, config))
+        calls[url].add_done_callback(lambda _: calls.pop(url, None))
+    # A caller going away doesn't cancel the request of the others
+    return await asyncio.shield(calls[url])
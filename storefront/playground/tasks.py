@@ -1,11 +1,162 @@
-from time import sleep
+import logging
+from time import time
+from uuid import uuid4
+
 from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
 from storefront.celery import celery
 
+logger = logging.getLogger(__name__)  # playground.tasks
+
+SUBJECT = "Storefront"
+CHUNK_SIZE = 500
+
+# Held while a notification run is in flight so overlapping beat ticks skip.
+# The timeout only matters if a worker dies before releasing it.
+LOCK_KEY = "playground:notify_customers:lock"
+LOCK_TIMEOUT = 60 * 60
+RUN_KEY = "playground:notify_customers:{run_id}:{name}"
+
+# Deletes the lock only if the run still holds it, in one step
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 
 @shared_task  # RECOMMENDED APPROACH
 def notify_customers(message):
-    print("Sending 10k emails...")
-    print(message)
-    sleep(10)
-    print("Emails were successfully sent!")
+    """
+    Emails every customer, fanned out into chunks of CHUNK_SIZE emails sent
+    by send_notifications.
+    """
+
+    run_id = uuid4().hex
+    if not cache.add(LOCK_KEY, run_id, timeout=LOCK_TIMEOUT):
+        logger.info("Skipping notify_customers, a run is already in progress")
+        return
+
+    cache.set_many(
+        {
+            run_key(run_id, "started"): time(),
+            run_key(run_id, "sent"): 0,
+            # The dispatcher holds one reference until every chunk is queued
+            run_key(run_id, "pending"): 1,
+        },
+        timeout=LOCK_TIMEOUT,
+    )
+
+    try:
+        chunk = []
+        for email in iter_customer_emails():
+            chunk.append(email)
+            if len(chunk) == CHUNK_SIZE:
+                dispatch(run_id, message, chunk)
+                chunk = []
+        if chunk:
+            dispatch(run_id, message, chunk)
+    finally:
+        finish_chunk(run_id)
+
+
+def iter_customer_emails():
+    return (
+        get_user_model()
+        .objects.filter(customer__isnull=False)
+        .exclude(email="")
+        .order_by("id")
+        .values_list("email", flat=True)
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def dispatch(run_id, message, emails):
+    incr_run(run_id, "pending")
+    send_notifications.delay(run_id, message, emails)
+
+
+@shared_task
+def send_notifications(run_id, message, emails):
+    """
+    Sends one chunk of notifications over a single SMTP connection.
+    """
+
+    try:
+        messages = [
+            EmailMessage(SUBJECT, message, settings.DEFAULT_FROM_EMAIL, [email])
+            for email in emails
+        ]
+        with get_connection() as connection:
+            sent = connection.send_messages(messages) or 0
+        incr_run(run_id, "sent", sent)
+        return sent
+    finally:
+        finish_chunk(run_id)
+
+
+def finish_chunk(run_id):
+    """
+    Drops one reference to the run; the last one reports the throughput and
+    releases the lock.
+    """
+
+    pending = incr_run(run_id, "pending", -1)
+    if pending is None:
+        logger.warning(
+            "notify_customers run %s outlived its keys, its stats are lost", run_id
+        )
+        release_lock(run_id)
+        return
+    if pending > 0:
+        return
+
+    values = cache.get_many([run_key(run_id, "started"), run_key(run_id, "sent")])
+    sent = values.get(run_key(run_id, "sent"), 0)
+    elapsed = time() - values.get(run_key(run_id, "started"), time())
+    rate = sent / elapsed if elapsed else 0
+    logger.info("Sent %s emails in %.2fs (%.1f emails per second)", sent, elapsed, rate)
+
+    release_lock(run_id)
+    cache.delete_many(
+        [run_key(run_id, name) for name in ["started", "sent", "pending"]]
+    )
+
+
+def run_key(run_id, name):
+    return RUN_KEY.format(run_id=run_id, name=name)
+
+
+def incr_run(run_id, name, delta=1):
+    """
+    Moves a counter of the run and returns its value, or None once the keys
+    of the run expired (after LOCK_TIMEOUT).
+    """
+
+    try:
+        return cache.incr(run_key(run_id, name), delta)
+    except ValueError:
+        return None
+
+
+def release_lock(run_id):
+    """
+    Releases the lock if `run_id` still holds it: it may have expired and been
+    taken by the next run.
+    """
+
+    # django_redis: compare and delete in a script, otherwise another run
+    # could take the lock between the two
+    if hasattr(cache, "client"):
+        cache.client.get_client(write=True).eval(
+            RELEASE_LOCK_SCRIPT,
+            1,
+            cache.client.make_key(LOCK_KEY),
+            cache.client.encode(run_id),
+        )
+    elif cache.get(LOCK_KEY) == run_id:
+        cache.delete(LOCK_KEY)
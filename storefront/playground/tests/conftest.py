@@ -0,0 +1,9 @@
+import pytest
+
+from storefront.celery import celery
+
+
+@pytest.fixture(autouse=True)
+def celery_eager():
+    # Run tasks in the test process instead of sending them to the broker
+    celery.conf.task_always_eager = True
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.cache import cache
+
+from playground import httpbin
+
+import pytest
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits += 1
+        time.sleep(self.server.delay)
+        body = json.dumps({"url": self.path}).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(settings):
+    """
+    Local server standing in for httpbin, answering `status` after `delay`
+    seconds and counting its requests in `hits`.
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.hits, server.delay, server.status = 0, 0, 200
+    threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    ).start()
+
+    settings.HTTPBIN = {
+        **httpbin.DEFAULTS,
+        "URL": f"http://127.0.0.1:{server.server_port}/delay",
+        "TIMEOUT": 1,
+        "FAILURE_THRESHOLD": 2,
+    }
+    cache.clear()
+    httpbin.breakers.clear()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(*calls):
+    async def main():
+        try:
+            return await asyncio.gather(*calls)
+        finally:
+            await httpbin.close_client()
+
+    return asyncio.run(main())
+
+
+class DownCache:
+    """
+    Stands in for the cache while its server (e.g. Redis) is unreachable
+    """
+
+    async def aget(self, *args, **kwargs):
+        raise ConnectionError("Cache is down")
+
+    async def aset(self, *args, **kwargs):
+        raise ConnectionError("Cache is down")
+
+
+class TestFetch:
+    def test_responses_are_cached(self, upstream):
+        assert run(httpbin.fetch()) == [{"url": "/delay"}]
+        assert run(httpbin.fetch()) == [{"url": "/delay"}]
+
+        assert upstream.hits == 1
+
+    def test_concurrent_callers_share_one_request(self, upstream):
+        upstream.delay = 0.2
+
+        results = run(*[httpbin.fetch() for _ in range(5)])
+
+        assert results == [{"url": "/delay"}] * 5
+        assert upstream.hits == 1
+
+    def test_if_upstream_is_too_slow_raises_upstream_error(self, upstream, settings):
+        settings.HTTPBIN["TIMEOUT"] = 0.1
+        upstream.delay = 0.3
+
+        with pytest.raises(httpbin.UpstreamError):
+            run(httpbin.fetch())
+
+    def test_if_upstream_keeps_failing_circuit_opens(self, upstream):
+        upstream.status = 500
+
+        for _ in range(2):
+            with pytest.raises(httpbin.UpstreamError):
+                run(httpbin.fetch())
+        with pytest.raises(httpbin.CircuitOpenError):
+            run(httpbin.fetch())
+
+        assert upstream.hits == 2
+
+    def test_circuit_closes_after_a_successful_trial(self, upstream, settings):
+        settings.HTTPBIN["RESET_TIMEOUT"] = 0.1
+        upstream.status = 500
+        for _ in range(2):
+            with pytest.raises(httpbin.UpstreamError):
+                run(httpbin.fetch())
+
+        time.sleep(0.1)
+        upstream.status = 200
+
+        assert run(httpbin.fetch()) == [{"url": "/delay"}]
+        assert upstream.hits == 3
+
+
+class TestHelloView:
+    @pytest.mark.django_db
+    def test_renders_the_page(self, client, upstream):
+        response = client.get("/playground/hello/")
+
+        assert response.status_code == 200
+        assert b"Hello Kumail" in response.content
+        assert upstream.hits == 1
+
+    @pytest.mark.django_db
+    def test_if_upstream_fails_still_renders_the_page(self, client, upstream):
+        upstream.status = 503
+
+        response = client.get("/playground/hello/")
+
+        assert response.status_code == 200
+        assert b"Hello Kumail" in response.content
+
+    @pytest.mark.django_db
+    def test_if_cache_is_down_still_calls_upstream(self, client, upstream, monkeypatch):
+        monkeypatch.setattr(httpbin, "cache", DownCache())
+
+        response = client.get("/playground/hello/")
+
+        assert response.status_code == 200
+        assert upstream.hits == 1
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+
+from model_bakery import baker
+
+from playground import tasks
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def locmem_email(settings):
+    settings.EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+    cache.delete(tasks.LOCK_KEY)
+
+
+class TestNotifyCustomers:
+    @pytest.mark.django_db
+    def test_every_customer_is_emailed_in_chunks(self, monkeypatch):
+        monkeypatch.setattr(tasks, "CHUNK_SIZE", 2)
+        users = baker.make(settings.AUTH_USER_MODEL, _quantity=5)
+        connections = []
+        get_connection = tasks.get_connection
+
+        def track_connections(*args, **kwargs):
+            connections.append(get_connection(*args, **kwargs))
+            return connections[-1]
+
+        monkeypatch.setattr(tasks, "get_connection", track_connections)
+
+        tasks.notify_customers("Hello World")
+
+        assert sorted(message.to[0] for message in mail.outbox) == sorted(
+            user.email for user in users
+        )
+        # One connection per chunk of 2
+        assert len(connections) == 3
+        assert mail.outbox[0].body == "Hello World"
+        assert cache.get(tasks.LOCK_KEY) is None
+
+    @pytest.mark.django_db
+    def test_if_a_run_is_in_progress_nothing_is_sent(self):
+        baker.make(settings.AUTH_USER_MODEL)
+        cache.set(tasks.LOCK_KEY, "another-run")
+
+        tasks.notify_customers("Hello World")
+
+        assert mail.outbox == []
+        assert cache.get(tasks.LOCK_KEY) == "another-run"
+
+    @pytest.mark.django_db
+    def test_if_run_keys_expired_chunks_still_send(self):
+        user = baker.make(settings.AUTH_USER_MODEL)
+        # The lock and run keys expired, and the next run took the lock
+        cache.set(tasks.LOCK_KEY, "next-run")
+
+        sent = tasks.send_notifications.delay("expired-run", "Hello", [user.email])
+
+        assert sent.get() == 1
+        assert len(mail.outbox) == 1
+        assert cache.get(tasks.LOCK_KEY) == "next-run"
@@ -1,5 +1,6 @@
 from django.contrib import admin, messages
-from django.db.models.aggregates import Count
+from django.core.files.storage import default_storage
+from django.db.models import Q
 from django.urls import reverse
 from django.utils.html import format_html, urlencode
 
@@ -23,6 +24,12 @@ class ProductImageInline(admin.TabularInline):
     readonly_fields = ["thumbnail"]
 
     def thumbnail(self, instance):
+        # Prefer the generated thumbnail over the full-size original
+        thumbnail = instance.renditions.get("thumbnail", {}).get("jpeg")
+        if thumbnail:
+            return format_html(
+                "<img src='{}' class='thumbnail' />", default_storage.url(thumbnail)
+            )
         if instance.image.name != "":
             return format_html(f"<img src='{instance.image.url}' class='thumbnail' />")
         return ""
@@ -65,26 +72,66 @@ class ProductAdmin(admin.ModelAdmin):
         }
 
 
+class OrdersCountFilter(admin.SimpleListFilter):
+    title = "orders"
+    parameter_name = "orders"
+
+    def lookups(self, request, model_admin):
+        return [("0", "None"), ("1-4", "1 to 4"), ("5+", "5 or more")]
+
+    def queryset(self, request, queryset):
+        if self.value() == "0":
+            return queryset.filter(Q(stats__isnull=True) | Q(stats__orders_count=0))
+        if self.value() == "1-4":
+            return queryset.filter(stats__orders_count__range=(1, 4))
+        if self.value() == "5+":
+            return queryset.filter(stats__orders_count__gte=5)
+
+
 @admin.register(models.Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ["first_name", "last_name", "membership", "orders"]
+    list_display = [
+        "first_name",
+        "last_name",
+        "membership",
+        "orders",
+        "lifetime_spend",
+        "last_order_at",
+    ]
     list_editable = ["membership"]
-    list_select_related = ["user"]
+    list_filter = ["membership", OrdersCountFilter, "stats__last_order_at"]
+    # Reads the precomputed stats instead of aggregating the orders
+    list_select_related = ["user", "stats"]
     list_per_page = 10
     ordering = ["user__first_name", "user__last_name"]
     search_fields = ["first_name__istartswith", "last_name__istartswith"]
 
-    @admin.display(ordering="orders")
+    @admin.display(ordering="stats__orders_count")
     def orders(self, customer):
         url = (
             reverse("admin:store_order_changelist")
             + "?"
             + urlencode({"customer__id": str(customer.id)})
         )
-        return format_html("<a href='{}'>{} Orders</a>", url, customer.orders)
+        return format_html(
+            "<a href='{}'>{} Orders</a>", url, get_stats(customer).orders_count
+        )
+
+    @admin.display(ordering="stats__lifetime_spend")
+    def lifetime_spend(self, customer):
+        return get_stats(customer).lifetime_spend
+
+    @admin.display(ordering="stats__last_order_at")
+    def last_order_at(self, customer):
+        return get_stats(customer).last_order_at
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(orders=Count("order"))
+
+def get_stats(customer):
+    # Customers without orders since the stats were introduced have no row
+    try:
+        return customer.stats
+    except models.CustomerStats.DoesNotExist:
+        return models.CustomerStats(customer=customer)
 
 
 class OrderItemInline(admin.StackedInline):
@@ -115,8 +162,13 @@ class CollectionAdmin(admin.ModelAdmin):
         )
         return format_html("<a href='{}'>{}</a>", url, collection.products_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(products_count=Count("product"))
+
+@admin.register(models.OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ["id", "event", "created_at", "attempts", "dispatched_at"]
+    list_filter = ["event", "dispatched_at"]
+    list_per_page = 50
+    readonly_fields = ["created_at"]
 
 
 admin.site.register(models.Collection, CollectionAdmin)
@@ -0,0 +1,150 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import urlencode
+
+from . import metrics
+
+
+# Every cached product list is keyed on the version of the catalogue scope it
+# was built from. Writes bump the version instead of deleting keys, so stale
+# entries simply stop being addressed and age out with the cache TIMEOUT.
+ALL_COLLECTIONS = "all"
+
+VERSION_KEY = "store:catalogue:version:{scope}"
+STATS_KEY = "store:catalogue:stats:{name}"
+PRODUCT_LIST_KEY = "store:products:list:{version}:{digest}"
+
+# Query parameters that change the content of /store/products/
+PRODUCT_LIST_PARAMS = [
+    "collection_id",
+    "unit_price__gt",
+    "unit_price__lt",
+    "search",
+    "tags",
+    "include",
+    "ordering",
+    "cursor",
+    "count",
+]
+
+HIT = "hits"
+MISS = "misses"
+# Conditional GETs answered with a 304, see store.conditional
+NOT_MODIFIED = "not_modified"
+STATS = [HIT, MISS, NOT_MODIFIED]
+
+
+def is_enabled():
+    return getattr(settings, "CATALOGUE_CACHE_ENABLED", True)
+
+
+def collection_scope(collection_id):
+    return f"collection:{collection_id}"
+
+
+def get_version(scope):
+    """
+    Returns the current version counter of a catalogue scope.
+
+    Missing counters (never bumped or evicted) are seeded with a timestamp so a
+    fresh counter can never collide with a version used before the eviction.
+    """
+
+    key = VERSION_KEY.format(scope=scope)
+    return cache.get_or_set(key, time.time_ns, timeout=None)
+
+
+def bump_versions(*collection_ids):
+    """
+    Invalidates the cached lists of the given collections and of the
+    unfiltered catalogue.
+    """
+
+    scopes = {ALL_COLLECTIONS}
+    scopes.update(collection_scope(pk) for pk in collection_ids if pk is not None)
+
+    for scope in scopes:
+        key = VERSION_KEY.format(scope=scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_versions_on_commit(*collection_ids, using=None):
+    """
+    Bumps the versions once the current transaction commits (right away
+    outside of one). Bumping earlier lets a reader cache the rows it can
+    still see, from before the write, under the new version.
+    """
+
+    # The write is committed by then, a cache error shouldn't fail it: the
+    # stale lists age out with the cache TIMEOUT
+    transaction.on_commit(
+        lambda: bump_versions(*collection_ids), using=using, robust=True
+    )
+
+
+def normalize_query(query_params):
+    """
+    Returns the product list query parameters in a canonical form, dropping
+    anything that doesn't affect the response.
+    """
+
+    return sorted(
+        (name, query_params[name].strip())
+        for name in PRODUCT_LIST_PARAMS
+        if query_params.get(name, "").strip()
+    )
+
+
+def product_list_key(request):
+    params = normalize_query(request.query_params)
+
+    collection_id = dict(params).get("collection_id", "")
+    if collection_id.isdigit():
+        scope = collection_scope(int(collection_id))
+    else:
+        scope = ALL_COLLECTIONS
+
+    # Pagination links are absolute, so the host is part of the key
+    raw = f"{request.get_host()}?{urlencode(params)}"
+    digest = hashlib.md5(raw.encode()).hexdigest()
+
+    return PRODUCT_LIST_KEY.format(version=get_version(scope), digest=digest)
+
+
+def get_product_list(key):
+    data = cache.get(key)
+    record(HIT if data is not None else MISS)
+    return data
+
+
+def set_product_list(key, data):
+    # The key must be the one computed before running the query: if a write
+    # bumped the version in between, the result lands under the old version
+    # and is never served.
+    cache.set(key, data)
+
+
+def record(name):
+    metrics.CACHE_REQUESTS.labels(name).inc()
+    key = STATS_KEY.format(name=name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_stats():
+    keys = {name: STATS_KEY.format(name=name) for name in STATS}
+    values = cache.get_many(keys.values())
+    return {name: values.get(key, 0) for name, key in keys.items()}
+
+
+def reset_stats():
+    cache.delete_many([STATS_KEY.format(name=name) for name in STATS])
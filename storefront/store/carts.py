@@ -0,0 +1,432 @@
+"""
+Cart storage backends.
+
+CartViewSet, CartItemViewSet and CreateOrderSerializer read and write carts
+through the backend selected by the CART_STORE setting:
+
+    CART_STORE = {
+        "BACKEND": "store.carts.RedisCartStore",
+        "OPTIONS": {"CACHE_ALIAS": "default", "TIMEOUT": 7 * 24 * 60 * 60},
+    }
+
+Both backends return Cart/CartItem instances with `items` and `product`
+already loaded, so the cart serializers work the same with either of them.
+"""
+
+from datetime import datetime
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Cart, CartItem, Product
+
+
+DEFAULT_CART_STORE = "store.carts.DatabaseCartStore"
+
+
+def get_cart_store():
+    config = getattr(settings, "CART_STORE", {})
+    backend = import_string(config.get("BACKEND", DEFAULT_CART_STORE))
+    return backend(**config.get("OPTIONS", {}))
+
+
+def attach_items(cart, items):
+    """
+    Stores `items` as the prefetched `cart.items`, the same way
+    prefetch_related does.
+    """
+
+    queryset = CartItem.objects.none()
+    queryset._result_cache = items
+    queryset._prefetch_done = True
+    cart._prefetched_objects_cache = {"items": queryset}
+    return cart
+
+
+class BaseCartStore:
+    """
+    Item ids are only meaningful to the backend that issued them. Lookups
+    raise Cart.DoesNotExist / CartItem.DoesNotExist, add_item raises
+    Product.DoesNotExist for unknown products.
+    """
+
+    def create(self):
+        raise NotImplementedError
+
+    def get(self, cart_id):
+        raise NotImplementedError
+
+    def delete(self, cart_id):
+        raise NotImplementedError
+
+    def get_items(self, cart_id):
+        return list(self.get(cart_id).items.all())
+
+    def get_item(self, cart_id, item_id):
+        raise NotImplementedError
+
+    def add_item(self, cart_id, product_id, quantity):
+        raise NotImplementedError
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        raise NotImplementedError
+
+    def remove_item(self, cart_id, item_id):
+        raise NotImplementedError
+
+    def apply_operations(self, cart_id, operations):
+        """
+        Applies {"operation": "add"|"set"|"remove", "product_id", "quantity"}
+        operations, in order and all or nothing. Products are expected to be
+        validated already.
+        """
+
+        raise NotImplementedError
+
+    def flush(self, batch_size=100):
+        """
+        Writes pending changes to the database and returns the number of carts
+        written.
+        """
+
+        return 0
+
+
+def resolve_quantities(quantities, operations):
+    """
+    Returns the quantities per product after applying `operations` to
+    `quantities`, with None for removed products.
+    """
+
+    quantities = dict(quantities)
+    for operation in operations:
+        product_id = operation["product_id"]
+        if operation["operation"] == "add":
+            current = quantities.get(product_id) or 0
+            quantities[product_id] = current + operation["quantity"]
+        elif operation["operation"] == "set":
+            quantities[product_id] = operation["quantity"]
+        else:
+            quantities[product_id] = None
+    return quantities
+
+
+class DatabaseCartStore(BaseCartStore):
+    """
+    Keeps carts in the Cart and CartItem tables.
+    """
+
+    def create(self):
+        return attach_items(Cart.objects.create(), [])
+
+    def get(self, cart_id):
+        return Cart.objects.prefetch_related("items__product").get(pk=cart_id)
+
+    def delete(self, cart_id):
+        deleted, _ = Cart.objects.filter(pk=cart_id).delete()
+        if not deleted:
+            raise Cart.DoesNotExist
+
+    def get_items(self, cart_id):
+        return list(CartItem.objects.select_related("product").filter(cart_id=cart_id))
+
+    def get_item(self, cart_id, item_id):
+        return CartItem.objects.select_related("product").get(
+            cart_id=cart_id, pk=item_id
+        )
+
+    def add_item(self, cart_id, product_id, quantity):
+        return CartItem.objects.add_quantity(cart_id, product_id, quantity)
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        cart_item = self.get_item(cart_id, item_id)
+        cart_item.quantity = quantity
+        cart_item.save()
+        return cart_item
+
+    def remove_item(self, cart_id, item_id):
+        deleted, _ = CartItem.objects.filter(cart_id=cart_id, pk=item_id).delete()
+        if not deleted:
+            raise CartItem.DoesNotExist
+
+    def apply_operations(self, cart_id, operations):
+        product_ids = {operation["product_id"] for operation in operations}
+
+        with transaction.atomic():
+            # Locking the cart serializes batches on the same cart
+            locked = Cart.objects.select_for_update().filter(pk=cart_id)
+            if not locked.values_list("pk", flat=True):
+                raise Cart.DoesNotExist
+
+            items = {
+                item.product_id: item
+                for item in CartItem.objects.filter(
+                    cart_id=cart_id, product_id__in=product_ids
+                )
+            }
+            quantities = resolve_quantities(
+                {product_id: item.quantity for product_id, item in items.items()},
+                operations,
+            )
+
+            created, updated, deleted = [], [], []
+            for product_id, quantity in quantities.items():
+                item = items.get(product_id)
+                if quantity is None:
+                    if item is not None:
+                        deleted.append(item.id)
+                elif item is None:
+                    created.append(
+                        CartItem(
+                            cart_id=cart_id, product_id=product_id, quantity=quantity
+                        )
+                    )
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    updated.append(item)
+
+            CartItem.objects.bulk_create(created)
+            CartItem.objects.bulk_update(updated, ["quantity"])
+            if deleted:
+                CartItem.objects.filter(pk__in=deleted).delete()
+
+
+class RedisCartStore(BaseCartStore):
+    """
+    Keeps live carts in Redis hashes and writes them to the database behind
+    the scenes (see flush), so abandoned carts never cost a SQL write.
+
+    Each cart is one hash, `store:cart:<id>`, holding `created_at` and one
+    `item:<product_id>` field per item with the quantity as value. The
+    product id doubles as the item id.
+    """
+
+    KEY = "store:cart:{id}"
+    DIRTY_KEY = "store:carts:dirty"
+    CREATED_AT = "created_at"
+    ITEM_PREFIX = "item:"
+
+    def __init__(self, CACHE_ALIAS="default", TIMEOUT=7 * 24 * 60 * 60):
+        from django_redis import get_redis_connection
+
+        self.redis = get_redis_connection(CACHE_ALIAS)
+        self.timeout = TIMEOUT
+
+    def key(self, cart_id):
+        return self.KEY.format(id=UUID(str(cart_id)))
+
+    def item_field(self, product_id):
+        return f"{self.ITEM_PREFIX}{product_id}"
+
+    def touch(self, pipeline, cart_id):
+        pipeline.expire(self.key(cart_id), self.timeout)
+        pipeline.sadd(self.DIRTY_KEY, str(UUID(str(cart_id))))
+
+    def create(self):
+        cart = Cart(id=uuid4(), created_at=timezone.now())
+        with self.redis.pipeline() as pipeline:
+            pipeline.hset(
+                self.key(cart.id), self.CREATED_AT, cart.created_at.isoformat()
+            )
+            self.touch(pipeline, cart.id)
+            pipeline.execute()
+        return attach_items(cart, [])
+
+    def get(self, cart_id):
+        values = self.load(cart_id)
+        created_at = values.pop(self.CREATED_AT, None)
+        cart = Cart(
+            id=UUID(str(cart_id)),
+            created_at=datetime.fromisoformat(created_at) if created_at else None,
+        )
+        return attach_items(cart, self.build_items(cart.id, self.quantities(values)))
+
+    def quantities(self, values):
+        return {
+            int(field[len(self.ITEM_PREFIX) :]): int(quantity)
+            for field, quantity in values.items()
+            if field.startswith(self.ITEM_PREFIX)
+        }
+
+    def load(self, cart_id):
+        """
+        Returns the raw hash of a cart, reading it back from the database if
+        it only lives there (e.g. it expired from Redis after a flush).
+        """
+
+        values = self.redis.hgetall(self.key(cart_id))
+        if values:
+            return {field.decode(): value.decode() for field, value in values.items()}
+
+        cart = Cart.objects.prefetch_related("items").filter(pk=cart_id).first()
+        if cart is None:
+            raise Cart.DoesNotExist
+
+        values = {self.CREATED_AT: cart.created_at.isoformat()}
+        for item in cart.items.all():
+            values[self.item_field(item.product_id)] = str(item.quantity)
+        with self.redis.pipeline() as pipeline:
+            pipeline.hset(self.key(cart_id), mapping=values)
+            pipeline.expire(self.key(cart_id), self.timeout)
+            pipeline.execute()
+        return values
+
+    def build_items(self, cart_id, quantities):
+        products = Product.objects.only("id", "title", "unit_price").in_bulk(
+            list(quantities)
+        )
+        return [
+            CartItem(
+                id=product_id,
+                cart_id=cart_id,
+                product=products[product_id],
+                quantity=quantity,
+            )
+            for product_id, quantity in sorted(quantities.items())
+            if product_id in products
+        ]
+
+    def exists(self, cart_id):
+        if self.redis.exists(self.key(cart_id)):
+            return True
+        try:
+            self.load(cart_id)
+        except Cart.DoesNotExist:
+            return False
+        return True
+
+    def delete(self, cart_id):
+        key = self.key(cart_id)
+        in_redis = self.redis.exists(key)
+        in_database, _ = Cart.objects.filter(pk=cart_id).delete()
+        if not in_redis and not in_database:
+            raise Cart.DoesNotExist
+
+        # At checkout this runs inside the order transaction: keep the cart
+        # if the order is rolled back
+        def delete_from_redis():
+            self.redis.delete(key)
+            self.redis.srem(self.DIRTY_KEY, str(UUID(str(cart_id))))
+
+        transaction.on_commit(delete_from_redis)
+
+    def get_item(self, cart_id, item_id):
+        item_id = int(item_id)
+        if not self.exists(cart_id):
+            raise CartItem.DoesNotExist
+
+        quantity = self.redis.hget(self.key(cart_id), self.item_field(item_id))
+        if quantity is None:
+            raise CartItem.DoesNotExist
+
+        items = self.build_items(cart_id, {item_id: int(quantity)})
+        if not items:
+            raise CartItem.DoesNotExist
+        return items[0]
+
+    def add_item(self, cart_id, product_id, quantity):
+        if not self.exists(cart_id):
+            raise Cart.DoesNotExist
+        if not Product.objects.filter(pk=product_id).exists():
+            raise Product.DoesNotExist
+
+        with self.redis.pipeline() as pipeline:
+            pipeline.hincrby(self.key(cart_id), self.item_field(product_id), quantity)
+            self.touch(pipeline, cart_id)
+            total, *_ = pipeline.execute()
+        return CartItem(
+            id=product_id, cart_id=cart_id, product_id=product_id, quantity=total
+        )
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        cart_item = self.get_item(cart_id, item_id)
+        with self.redis.pipeline() as pipeline:
+            pipeline.hset(self.key(cart_id), self.item_field(cart_item.id), quantity)
+            self.touch(pipeline, cart_id)
+            pipeline.execute()
+        cart_item.quantity = quantity
+        return cart_item
+
+    def remove_item(self, cart_id, item_id):
+        if not self.exists(cart_id):
+            raise CartItem.DoesNotExist
+
+        with self.redis.pipeline() as pipeline:
+            pipeline.hdel(self.key(cart_id), self.item_field(item_id))
+            self.touch(pipeline, cart_id)
+            removed, *_ = pipeline.execute()
+        if not removed:
+            raise CartItem.DoesNotExist
+
+    def apply_operations(self, cart_id, operations):
+        if not self.exists(cart_id):
+            raise Cart.DoesNotExist
+
+        key = self.key(cart_id)
+        # MULTI/EXEC: the operations are applied together or not at all
+        with self.redis.pipeline(transaction=True) as pipeline:
+            for operation in operations:
+                field = self.item_field(operation["product_id"])
+                if operation["operation"] == "add":
+                    pipeline.hincrby(key, field, operation["quantity"])
+                elif operation["operation"] == "set":
+                    pipeline.hset(key, field, operation["quantity"])
+                else:
+                    pipeline.hdel(key, field)
+            self.touch(pipeline, cart_id)
+            pipeline.execute()
+
+    def flush(self, batch_size=100):
+        """
+        Writes the carts changed since the last flush to the Cart and CartItem
+        tables (write-behind), so they survive a Redis restart and show up in
+        the admin.
+        """
+
+        flushed = 0
+        while True:
+            cart_ids = self.redis.spop(self.DIRTY_KEY, batch_size)
+            if not cart_ids:
+                return flushed
+
+            for written, cart_id in enumerate(cart_ids):
+                try:
+                    self.write_behind(cart_id.decode())
+                except Exception:
+                    # Marked dirty again, for the next flush
+                    self.redis.sadd(self.DIRTY_KEY, *cart_ids[written:])
+                    raise
+            flushed += len(cart_ids)
+
+    def write_behind(self, cart_id):
+        values = self.redis.hgetall(self.key(cart_id))
+        if not values:
+            return
+
+        quantities = self.quantities(
+            {field.decode(): value.decode() for field, value in values.items()}
+        )
+        product_ids = Product.objects.filter(pk__in=list(quantities)).values_list(
+            "id", flat=True
+        )
+
+        with transaction.atomic():
+            Cart.objects.get_or_create(pk=cart_id)
+            CartItem.objects.filter(cart_id=cart_id).delete()
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(
+                        cart_id=cart_id,
+                        product_id=product_id,
+                        quantity=quantities[product_id],
+                    )
+                    for product_id in product_ids
+                ]
+            )
+
+        # The cart may have been checked out while it was being written
+        if not self.redis.exists(self.key(cart_id)):
+            Cart.objects.filter(pk=cart_id).delete()
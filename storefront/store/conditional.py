@@ -0,0 +1,85 @@
+"""
+Conditional GET (If-None-Match / If-Modified-Since) for the catalogue
+endpoints.
+
+The validators come from the catalogue version counters (see store.caching)
+or a single-column lookup, so a 304 is answered without running the main
+query or the serializers.
+"""
+
+import hashlib
+from urllib.parse import urlencode
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from rest_framework import status
+
+from . import caching
+
+
+class ConditionalGetMixin:
+    """
+    Answers conditional list and retrieve requests from the validators
+    returned by `get_list_validators` and `get_detail_validators`.
+    """
+
+    def get_list_validators(self):
+        """
+        Returns (etag, last_modified) for the list, either can be None.
+        """
+
+        return None, None
+
+    def get_detail_validators(self):
+        return None, None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            self.get_list_validators(), super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            self.get_detail_validators(), super().retrieve, request, *args, **kwargs
+        )
+
+    def get_conditional_response(self, validators, handler, request, *args, **kwargs):
+        etag, last_modified = validators
+        if etag is not None:
+            etag = make_etag(request, etag)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        elif response.status_code == status.HTTP_304_NOT_MODIFIED:
+            caching.record(caching.NOT_MODIFIED)
+
+        if response.status_code in [status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED]:
+            if etag is not None:
+                response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
+def make_etag(request, value):
+    """
+    Returns the quoted ETag of `value` for the representation negotiated by
+    `request` (pagination and image links are absolute, so the host counts).
+    The query string is part of it too: parameters like ?include= change the
+    body.
+    """
+
+    raw = "|".join(
+        [
+            request.get_host(),
+            request.path,
+            urlencode(sorted(request.query_params.lists()), doseq=True),
+            request.accepted_renderer.format,
+            str(value),
+        ]
+    )
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
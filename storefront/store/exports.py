@@ -0,0 +1,160 @@
+"""
+Streaming order exports, see OrderViewSet.export.
+
+Orders are read in keyset batches (WHERE id > last id ORDER BY id LIMIT n)
+with the items of each batch loaded by one more query, so memory stays flat
+and the first rows go out as soon as the first batch is read, however many
+orders match.
+"""
+
+import csv
+import json
+from collections import defaultdict
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import OrderItem
+
+
+BATCH_SIZE = 500
+
+CSV_COLUMNS = [
+    "order_id",
+    "customer_id",
+    "placed_at",
+    "payment_status",
+    "item_id",
+    "product_id",
+    "product_title",
+    "quantity",
+    "unit_price",
+]
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only used for errors, exports are streamed by iter_ndjson
+        return json.dumps(data, cls=JSONEncoder) + "\n"
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only used for errors, exports are streamed by iter_csv
+        data = data if isinstance(data, dict) else {"detail": data}
+        buffer = Echo()
+        writer = csv.writer(buffer)
+        return writer.writerow(data.keys()) + writer.writerow(data.values())
+
+
+class Echo:
+    """
+    File-like object handing back what csv.writer writes, so rows can be
+    streamed one at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_orders(queryset, batch_size=BATCH_SIZE):
+    """
+    Yields the orders of `queryset` in id order, each with its items, the way
+    OrderSerializer represents them.
+    """
+
+    orders = queryset.order_by("id").values(
+        "id", "customer_id", "placed_at", "payment_status"
+    )
+    last_id = 0
+    while True:
+        batch = list(orders.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+
+        items = get_items([order["id"] for order in batch])
+        for order in batch:
+            yield {
+                "id": order["id"],
+                "customer": order["customer_id"],
+                "placed_at": order["placed_at"],
+                "payment_status": order["payment_status"],
+                "items": items[order["id"]],
+            }
+        last_id = batch[-1]["id"]
+
+
+def get_items(order_ids):
+    items = defaultdict(list)
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .order_by("id")
+        .values(
+            "id",
+            "order_id",
+            "product_id",
+            "product__title",
+            "product__unit_price",
+            "quantity",
+            "unit_price",
+        )
+    )
+    for item in rows:
+        items[item["order_id"]].append(
+            {
+                "id": item["id"],
+                "product": {
+                    "id": item["product_id"],
+                    "title": item["product__title"],
+                    "unit_price": item["product__unit_price"],
+                },
+                "quantity": item["quantity"],
+                "unit_price": item["unit_price"],
+            }
+        )
+    return items
+
+
+def iter_ndjson(orders):
+    encoder = JSONEncoder()
+    for order in orders:
+        yield encoder.encode(order) + "\n"
+
+
+def iter_csv(orders):
+    """
+    Yields one CSV line per order item, orders without items get a line with
+    empty item columns.
+    """
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order in orders:
+        columns = [
+            order["id"],
+            order["customer"],
+            order["placed_at"].isoformat(),
+            order["payment_status"],
+        ]
+        for item in order["items"] or [None]:
+            if item is None:
+                yield writer.writerow(columns + [""] * 5)
+                continue
+            yield writer.writerow(
+                columns
+                + [
+                    item["id"],
+                    item["product"]["id"],
+                    item["product"]["title"],
+                    item["quantity"],
+                    item["unit_price"],
+                ]
+            )
@@ -0,0 +1,318 @@
+"""
+Streaming readers and batched upserts for catalogue feeds, see the
+import_catalogue command.
+
+Feeds are CSV files with a header row or NDJSON files with one record per
+line:
+
+    collections   title
+    products      slug, title, description, unit_price, inventory,
+                  collection (the collection title)
+    images        product (the product slug), image (path in the media storage)
+
+Records are read one at a time along with the byte offset just past them, so
+an interrupted import can seek back to the end of its last committed batch.
+"""
+
+import csv
+import json
+from collections import Counter
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching, search
+from .models import Collection, Product, ProductImage
+
+
+CSV = "csv"
+NDJSON = "ndjson"
+FORMATS = [CSV, NDJSON]
+
+EXTENSIONS = {".csv": CSV, ".ndjson": NDJSON, ".jsonl": NDJSON}
+
+# Keys of the counters returned by the importers
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+SKIPPED = "skipped"
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def detect_format(path):
+    return EXTENSIONS.get(Path(path).suffix.lower())
+
+
+def read_records(file, format, offset=0):
+    """
+    Yields (record, offset) for every record of a feed opened in binary mode,
+    starting at `offset` (0, or an offset previously yielded). Records that
+    can't be decoded are yielded as None.
+    """
+
+    if format == CSV:
+        return read_csv(file, offset)
+    return read_ndjson(file, offset)
+
+
+def read_csv(file, offset=0):
+    header_line = file.readline()
+    header = next(csv.reader([header_line.decode("utf-8-sig")]), [])
+    if offset:
+        file.seek(offset)
+    else:
+        offset = len(header_line)
+
+    position = offset
+
+    def lines():
+        nonlocal position
+        # csv.reader pulls lines one at a time, so once a row is returned the
+        # position is exactly the end of that row
+        for line in file:
+            position += len(line)
+            yield line.decode("utf-8")
+
+    for row in csv.reader(lines()):
+        if row:
+            yield dict(zip(header, row)), position
+
+
+def read_ndjson(file, offset=0):
+    file.seek(offset)
+    for line in file:
+        offset += len(line)
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else None, offset
+
+
+def clean(model, name, value):
+    """
+    Validates a feed value with the rules of the model field it's stored in.
+    """
+
+    field = model._meta.get_field(name)
+    try:
+        return field.clean(value, None)
+    except ValidationError as error:
+        raise InvalidRecord(f"{name}: {' '.join(error.messages)}")
+
+
+def get_text(record, name):
+    value = record.get(name)
+    return "" if value is None else str(value).strip()
+
+
+class CollectionImporter:
+    def parse(self, record):
+        return clean(Collection, "title", get_text(record, "title"))
+
+    def upsert(self, titles):
+        """
+        Creates the collections that don't exist yet, matched on title.
+        """
+
+        result = Counter({SKIPPED: len(titles) - len(set(titles))})
+        titles = set(titles)
+        existing = set(
+            Collection.objects.filter(title__in=titles).values_list("title", flat=True)
+        )
+        created = Collection.objects.bulk_create(
+            [Collection(title=title) for title in sorted(titles - existing)]
+        )
+        if created:
+            # bulk_create doesn't send the post_save the collection list
+            # validators rely on
+            transaction.on_commit(caching.bump_versions)
+
+        result[CREATED] += len(created)
+        result[UNCHANGED] += len(existing)
+        return result
+
+
+class ProductImporter:
+    fields = ["title", "description", "unit_price", "inventory", "collection_id"]
+
+    def __init__(self):
+        # Collection ids by title, there are few collections and many products
+        self.collection_ids = {}
+
+    def parse(self, record):
+        product = {
+            name: clean(Product, name, get_text(record, name))
+            for name in ["slug", "title", "description", "unit_price", "inventory"]
+        }
+        product["collection"] = clean(
+            Collection, "title", get_text(record, "collection")
+        )
+        return product
+
+    def get_collection_ids(self, titles):
+        missing = set(titles) - set(self.collection_ids)
+        if missing:
+            rows = (
+                Collection.objects.filter(title__in=missing)
+                .order_by("-id")
+                .values_list("title", "id")
+            )
+            # The oldest collection wins when titles are duplicated
+            self.collection_ids.update(rows)
+        return self.collection_ids
+
+    def upsert(self, products):
+        """
+        Creates or updates products matched on slug. Rows of unknown
+        collections are skipped, rows that don't change anything aren't
+        written.
+        """
+
+        result = Counter()
+        # The last row wins when a slug is repeated in the batch
+        by_slug = {product["slug"]: product for product in products}
+        result[SKIPPED] += len(products) - len(by_slug)
+
+        collection_ids = self.get_collection_ids(
+            product["collection"] for product in by_slug.values()
+        )
+        existing = {}
+        for product in (
+            Product.objects.filter(slug__in=by_slug)
+            .order_by("-id")
+            .only("id", "slug", *self.fields)
+        ):
+            existing[product.slug] = product
+
+        now = timezone.now()
+        to_create, to_update, to_index = [], [], []
+        for slug, data in by_slug.items():
+            values = {name: data[name] for name in self.fields[:-1]}
+            values["collection_id"] = collection_ids.get(data["collection"])
+            if values["collection_id"] is None:
+                result[SKIPPED] += 1
+                continue
+
+            product = existing.get(slug)
+            if product is None:
+                to_create.append(Product(slug=slug, last_update=now, **values))
+                continue
+
+            changed = [
+                name
+                for name, value in values.items()
+                if getattr(product, name) != value
+            ]
+            if not changed:
+                result[UNCHANGED] += 1
+                continue
+            for name, value in values.items():
+                setattr(product, name, value)
+            product.last_update = now
+            to_update.append(product)
+            if {"title", "description"} & set(changed):
+                to_index.append(product)
+
+        # Both go through ProductQuerySet, which keeps the products counts and
+        # the catalogue cache up to date
+        created = Product.objects.bulk_create(to_create) if to_create else []
+        if to_update:
+            Product.objects.bulk_update(to_update, [*self.fields, "last_update"])
+
+        if any(product.pk is None for product in created):
+            # Backends that don't return the ids of inserted rows (MySQL)
+            created = list(
+                Product.objects.filter(
+                    slug__in=[product.slug for product in created]
+                ).only("id", "title", "description")
+            )
+        search.index_batch([*created, *to_index])
+
+        result[CREATED] += len(to_create)
+        result[UPDATED] += len(to_update)
+        return result
+
+
+class ImageImporter:
+    def parse(self, record):
+        # The image field validators check uploaded files, a feed only names
+        # a file that is already in the storage
+        name = get_text(record, "image")
+        max_length = ProductImage._meta.get_field("image").max_length
+        if not name or len(name) > max_length:
+            raise InvalidRecord(f"image: a path of at most {max_length} characters")
+        return clean(Product, "slug", get_text(record, "product")), name
+
+    def upsert(self, images):
+        """
+        Adds the images that aren't attached to their product yet and queues
+        their renditions once the batch is committed.
+        """
+
+        from .tasks import generate_image_renditions
+
+        result = Counter()
+        product_ids = dict(
+            Product.objects.filter(slug__in={slug for slug, _ in images})
+            .order_by("-id")
+            .values_list("slug", "id")
+        )
+        pairs = set()
+        for slug, name in images:
+            if slug in product_ids:
+                pairs.add((product_ids[slug], name))
+        result[SKIPPED] += len(images) - len(pairs)
+
+        existing = set(
+            ProductImage.objects.filter(
+                product_id__in={product_id for product_id, _ in pairs},
+                image__in={name for _, name in pairs},
+            ).values_list("product_id", "image")
+        )
+        result[UNCHANGED] += len(pairs & existing)
+        new = sorted(pairs - existing)
+        if not new:
+            return result
+
+        created = ProductImage.objects.bulk_create(
+            [ProductImage(product_id=pk, image=name) for pk, name in new]
+        )
+        if any(image.pk is None for image in created):
+            created = [
+                image
+                for image in ProductImage.objects.filter(
+                    product_id__in={pk for pk, _ in new},
+                    image__in={name for _, name in new},
+                ).only("id", "product_id", "image")
+                if (image.product_id, image.image.name) in pairs - existing
+            ]
+        # Same as a single image upload (see store.signals.handlers)
+        Product.objects.filter(pk__in={pk for pk, _ in new}).update(
+            last_update=timezone.now()
+        )
+        image_ids = [image.pk for image in created]
+
+        def schedule_renditions():
+            for pk in image_ids:
+                generate_image_renditions.delay(pk)
+
+        # A broker error mustn't abort the import after the batch committed
+        transaction.on_commit(schedule_renditions, robust=True)
+
+        result[CREATED] += len(new)
+        return result
+
+
+IMPORTERS = {
+    "collections": CollectionImporter,
+    "products": ProductImporter,
+    "images": ImageImporter,
+}
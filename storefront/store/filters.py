@@ -1,12 +1,87 @@
-from django_filters.rest_framework import FilterSet
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum
+from django_filters.rest_framework import CharFilter, FilterSet
 
-from .models import Product
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+from tags.models import TaggedItem
+
+from .models import Order, Product, ProductSearchToken
+from .search import tokenize
 
 
 class ProductFilter(FilterSet):
+    tags = CharFilter(
+        method="filter_tags", label="Comma-separated labels, all must match"
+    )
+
     class Meta:
         model = Product
         fields = {
             "collection_id": ["exact"],
             "unit_price": ["gt", "lt"],
         }
+
+    def filter_tags(self, queryset, name, value):
+        labels = [label.strip() for label in value.split(",") if label.strip()]
+        if not labels:
+            return queryset
+        return queryset.filter(
+            pk__in=TaggedItem.objects.get_object_ids_tagged(Product, labels)
+        )
+
+
+class OrderFilter(FilterSet):
+    class Meta:
+        model = Order
+        fields = {
+            "placed_at": ["gte", "lt"],
+            "payment_status": ["exact"],
+        }
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    Searches products through the ProductSearchToken index instead of scanning
+    title and description with LIKE.
+
+    Every search term has to prefix-match a token of the product. Results are
+    annotated with `relevance` (sum of the matched token weights) and ordered by
+    it, unless OrderingFilter applies an explicit ordering afterwards.
+    """
+
+    search_param = api_settings.SEARCH_PARAM
+
+    def get_search_terms(self, request):
+        return tokenize(request.query_params.get(self.search_param, ""))
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            # Terms too short to be indexed can't match anything
+            if request.query_params.get(self.search_param, "").strip():
+                return queryset.none()
+            return queryset
+
+        # Tokens and terms are lowercase. startswith is LIKE BINARY on MySQL,
+        # which can't use the (token, product) index, istartswith is a LIKE in
+        # the column's collation, which can
+        matches = Q()
+        for term in terms:
+            queryset = queryset.filter(
+                pk__in=ProductSearchToken.objects.filter(
+                    token__istartswith=term
+                ).values("product_id")
+            )
+            matches |= Q(token__istartswith=term)
+
+        relevance = (
+            ProductSearchToken.objects.filter(matches, product=OuterRef("pk"))
+            .values("product")
+            .annotate(total=Sum("weight"))
+            .values("total")
+        )
+
+        return queryset.annotate(
+            relevance=Subquery(relevance, output_field=IntegerField())
+        ).order_by("-relevance")
@@ -0,0 +1,65 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from PIL import Image, ImageOps
+
+
+# Name -> bounding box. Images keep their aspect ratio and are never upscaled.
+RENDITIONS = {
+    "thumbnail": (100, 100),
+    "list": (300, 300),
+    "detail": (800, 800),
+}
+
+# File extension -> Pillow format
+FORMATS = {
+    "jpeg": "JPEG",
+    "webp": "WEBP",
+}
+
+QUALITY = 85
+RENDITIONS_DIRECTORY = "store/images/renditions"
+
+
+def generate_renditions(product_image):
+    """
+    Writes every rendition of a product image to the default storage and
+    returns their paths as {rendition: {extension: path}}.
+    """
+
+    with product_image.image.open("rb") as file:
+        original = Image.open(file)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+
+    name, _ = os.path.splitext(os.path.basename(product_image.image.name))
+    renditions = {}
+
+    for rendition, size in RENDITIONS.items():
+        image = original.copy()
+        image.thumbnail(size)
+        renditions[rendition] = {}
+
+        for extension, format in FORMATS.items():
+            buffer = BytesIO()
+            if format == "JPEG" and image.mode not in ["RGB", "L"]:
+                image.convert("RGB").save(buffer, format, quality=QUALITY)
+            else:
+                image.save(buffer, format, quality=QUALITY)
+
+            path = default_storage.save(
+                f"{RENDITIONS_DIRECTORY}/{name}_{rendition}.{extension}",
+                ContentFile(buffer.getvalue()),
+            )
+            renditions[rendition][extension] = path
+
+    return renditions
+
+
+def delete_renditions(renditions):
+    for paths in renditions.values():
+        for path in paths.values():
+            default_storage.delete(path)
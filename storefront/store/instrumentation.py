@@ -0,0 +1,292 @@
+"""
+Per-endpoint SQL query instrumentation.
+
+QueryInstrumentationMiddleware records, for a sample of the requests, the
+number of queries, the time spent in the database and the queries repeated
+with different parameters (N+1 patterns) of the resolved view, e.g.
+`ProductViewSet.list`. Requests over their query budget are logged as
+warnings and every sampled request adds to per-endpoint counters in the
+cache, printed by the query_stats command.
+
+    QUERY_INSTRUMENTATION = {
+        "SAMPLE_RATE": 0.01,
+        "DEFAULT_BUDGET": 20,
+        "BUDGETS": {"ProductViewSet.list": 5},
+        "REPEATED_QUERY_THRESHOLD": 5,
+    }
+
+Requests that aren't sampled only cost a call to random().
+"""
+
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)  # store.instrumentation
+
+DEFAULTS = {
+    "SAMPLE_RATE": 0,
+    "DEFAULT_BUDGET": 20,
+    "BUDGETS": {},
+    "REPEATED_QUERY_THRESHOLD": 5,
+}
+
+ENDPOINTS_KEY = "store:querystats:endpoints"
+STATS_KEY = "store:querystats:{endpoint}:{name}"
+REPEATED_KEY = "store:querystats:{endpoint}:repeated"
+
+REQUESTS = "requests"
+QUERIES = "queries"
+# Microseconds, so the counter stays an integer
+DB_TIME = "db_time_us"
+OVER_BUDGET = "over_budget"
+N_PLUS_ONE = "n_plus_one"
+STATS = [REQUESTS, QUERIES, DB_TIME, OVER_BUDGET, N_PLUS_ONE]
+
+# Statements that aren't part of what an endpoint queries: savepoints and the
+# profiling middleware (silk) recording and explaining the request
+IGNORED_QUERIES = ["SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT", "EXPLAIN"]
+IGNORED_TABLES = ['"silk_', "`silk_"]
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "QUERY_INSTRUMENTATION", {})}
+
+
+def get_endpoint(request):
+    """
+    Returns `<view>.<action>` for the view the request was resolved to, or
+    None if it wasn't resolved.
+    """
+
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+
+    view = match.func
+    cls = getattr(view, "cls", None) or getattr(view, "view_class", None)
+    if cls is None:
+        return f"{view.__module__}.{view.__name__}"
+
+    # Viewsets map the HTTP method to an action, APIViews and Django class
+    # based views name the handler after the method
+    actions = getattr(view, "actions", None) or {}
+    method = request.method.lower()
+    return f"{cls.__name__}.{actions.get(method, method)}"
+
+
+def fingerprint(sql):
+    """
+    Returns `sql` with its literals and placeholder lists collapsed, so the
+    same query run with other parameters gets the same fingerprint.
+    """
+
+    sql = PLACEHOLDER_LISTS.sub("(...)", sql)
+    return LITERALS.sub("?", sql)
+
+
+def is_counted(sql):
+    return not any(sql.startswith(prefix) for prefix in IGNORED_QUERIES) and not any(
+        table in sql for table in IGNORED_TABLES
+    )
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper collecting the fingerprint and duration of every
+    query run while it's installed.
+    """
+
+    def __init__(self):
+        self.fingerprints = Counter()
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if is_counted(sql):
+                self.duration += time.perf_counter() - start
+                self.count += 1
+                self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold):
+        return {
+            sql: count for sql, count in self.fingerprints.items() if count >= threshold
+        }
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """
+    Installs a database execute wrapper on every connection of the thread.
+    """
+
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(wrapper))
+        yield wrapper
+
+
+@asynccontextmanager
+async def async_execute_wrapper(wrapper):
+    """
+    execute_wrapper for async code. Connections are per thread and the ORM
+    calls of an async request run in its thread-sensitive sync_to_async
+    thread, so the wrapper is installed (and removed) there.
+    """
+
+    stack = ExitStack()
+    await sync_to_async(stack.enter_context)(execute_wrapper(wrapper))
+    try:
+        yield wrapper
+    finally:
+        await sync_to_async(stack.close)()
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        config = get_config()
+        if random.random() >= config["SAMPLE_RATE"]:
+            return self.get_response(request)
+
+        with execute_wrapper(QueryRecorder()) as recorder:
+            response = self.get_response(request)
+
+        endpoint = get_endpoint(request)
+        if endpoint is not None:
+            self.report(endpoint, recorder, config)
+        return response
+
+    async def __acall__(self, request):
+        config = get_config()
+        if random.random() >= config["SAMPLE_RATE"]:
+            return await self.get_response(request)
+
+        async with async_execute_wrapper(QueryRecorder()) as recorder:
+            response = await self.get_response(request)
+
+        endpoint = get_endpoint(request)
+        if endpoint is not None:
+            # The stats are kept in the cache
+            await sync_to_async(self.report)(endpoint, recorder, config)
+        return response
+
+    def report(self, endpoint, recorder, config):
+        budget = config["BUDGETS"].get(endpoint, config["DEFAULT_BUDGET"])
+        repeated = recorder.repeated(config["REPEATED_QUERY_THRESHOLD"])
+        over_budget = recorder.count > budget
+
+        record(
+            endpoint,
+            {
+                REQUESTS: 1,
+                QUERIES: recorder.count,
+                DB_TIME: round(recorder.duration * 1_000_000),
+                OVER_BUDGET: int(over_budget),
+                N_PLUS_ONE: int(bool(repeated)),
+            },
+            repeated,
+        )
+
+        if over_budget or repeated:
+            logger.warning(
+                "%s ran %s queries (budget %s) in %.1fms",
+                endpoint,
+                recorder.count,
+                budget,
+                recorder.duration * 1000,
+                extra={
+                    "endpoint": endpoint,
+                    "queries": recorder.count,
+                    "budget": budget,
+                    "db_time_ms": round(recorder.duration * 1000, 3),
+                    "repeated_queries": repeated,
+                },
+            )
+
+
+def record(endpoint, values, repeated=None):
+    endpoints = cache.get(ENDPOINTS_KEY, [])
+    if endpoint not in endpoints:
+        # Racing first requests may drop a name, the next one adds it back
+        cache.set(ENDPOINTS_KEY, sorted({*endpoints, endpoint}), timeout=None)
+
+    for name, value in values.items():
+        key = STATS_KEY.format(endpoint=endpoint, name=name)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.add(key, value, timeout=None)
+
+    if repeated:
+        # The most repeated query of the latest N+1 request
+        sql, count = max(repeated.items(), key=lambda item: item[1])
+        cache.set(REPEATED_KEY.format(endpoint=endpoint), (sql, count), timeout=None)
+
+
+def get_stats():
+    """
+    Returns {endpoint: {stat: value, "repeated": (sql, count) or None}}.
+    """
+
+    endpoints = cache.get(ENDPOINTS_KEY, [])
+    keys = {
+        (endpoint, name): STATS_KEY.format(endpoint=endpoint, name=name)
+        for endpoint in endpoints
+        for name in STATS
+    }
+    keys.update(
+        {
+            (endpoint, "repeated"): REPEATED_KEY.format(endpoint=endpoint)
+            for endpoint in endpoints
+        }
+    )
+    values = cache.get_many(keys.values())
+
+    stats = {}
+    for (endpoint, name), key in keys.items():
+        default = None if name == "repeated" else 0
+        stats.setdefault(endpoint, {})[name] = values.get(key, default)
+    return stats
+
+
+def reset_stats():
+    endpoints = cache.get(ENDPOINTS_KEY, [])
+    cache.delete_many(
+        [
+            ENDPOINTS_KEY,
+            *(
+                STATS_KEY.format(endpoint=endpoint, name=name)
+                for endpoint in endpoints
+                for name in STATS
+            ),
+            *(REPEATED_KEY.format(endpoint=endpoint) for endpoint in endpoints),
+        ]
+    )
@@ -0,0 +1,187 @@
+"""
+Read path of the catalogue endpoints.
+
+The product list is served from the versioned catalogue cache (see
+store.caching) by CachedListMixin.
+
+With CATALOGUE_FAST_READS on, the product and collection list and retrieve
+endpoints fetch values() rows and build the response dicts directly instead
+of instantiating a model and a serializer per row. The dicts have the same
+keys, order and value types as the ModelSerializer output, so the rendered
+JSON is byte-identical.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+
+from rest_framework import status
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+
+from likes.models import LikedItem
+from tags.models import TaggedItem
+
+from . import caching
+from .models import Product, ProductImage
+from .serializers import TAX_RATE, get_rendition_urls
+
+
+PRODUCT_FIELDS = [
+    "id",
+    "title",
+    "description",
+    "slug",
+    "inventory",
+    "unit_price",
+    "collection_id",
+    # Not rendered, only read by the keyset pagination cursor
+    "last_update",
+]
+
+COLLECTION_FIELDS = ["id", "title", "products_count"]
+
+
+def is_enabled():
+    return getattr(settings, "CATALOGUE_FAST_READS", False)
+
+
+class CachedListMixin:
+    """
+    Serves the product list from the catalogue cache, see store.caching
+    """
+
+    def is_list_cacheable(self):
+        return caching.is_enabled()
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_list_cacheable():
+            return super().list(request, *args, **kwargs)
+
+        key = caching.product_list_key(request)
+        data = caching.get_product_list(key)
+        if data is not None:
+            return Response(data, headers={"X-Cache": "HIT"})
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            caching.set_product_list(key, response.data)
+        response["X-Cache"] = "MISS"
+        return response
+
+
+class ValuesReadMixin:
+    """
+    Serves list and retrieve from `values_fields` rows rendered by
+    `to_representation_rows` when the fast read path is enabled.
+    """
+
+    values_fields = []
+
+    def get_values_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        # Annotations (e.g. the search relevance) may be part of the ordering
+        # the pagination cursor is built from
+        fields = [*self.values_fields, *queryset.query.annotations]
+        return queryset.prefetch_related(None).values(*fields)
+
+    def to_representation_rows(self, rows):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.get_values_queryset()
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.to_representation_rows(page))
+        return Response(self.to_representation_rows(list(queryset)))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super().retrieve(request, *args, **kwargs)
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(
+            self.get_values_queryset(),
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]},
+        )
+        self.check_object_permissions(request, row)
+        return Response(self.to_representation_rows([row])[0])
+
+
+def product_rows(rows, request=None, include=()):
+    """
+    Renders product rows like ProductSerializer, loading the images (and the
+    tags and likes listed in `include`) of the whole page at once.
+    """
+
+    product_ids = [row["id"] for row in rows]
+    images = get_images(product_ids, request)
+    products = [
+        {
+            "id": row["id"],
+            "title": row["title"],
+            "description": row["description"],
+            "slug": row["slug"],
+            "inventory": row["inventory"],
+            "unit_price": row["unit_price"],
+            "price_with_tax": row["unit_price"] * TAX_RATE,
+            "collection": row["collection_id"],
+            "images": images[row["id"]],
+        }
+        for row in rows
+    ]
+
+    if "tags" in include:
+        tags = TaggedItem.objects.get_tags_for_many(Product, product_ids)
+        for product in products:
+            product["tags"] = [tag.label for tag in tags.get(product["id"], [])]
+    if "likes" in include:
+        likes = LikedItem.objects.counts_for(Product, product_ids)
+        for product in products:
+            product["likes"] = likes.get(product["id"], 0)
+    return products
+
+
+def get_images(product_ids, request=None):
+    """
+    Returns {product_id: [image]} rendered like ProductImageSerializer.
+    """
+
+    storage = ProductImage._meta.get_field("image").storage
+    images = defaultdict(list)
+    if not product_ids:
+        return images
+
+    rows = (
+        ProductImage.objects.filter(product_id__in=product_ids)
+        .order_by("id")
+        .values_list("id", "product_id", "image", "renditions")
+    )
+    for pk, product_id, name, renditions in rows:
+        url = None
+        if name:
+            url = storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+        images[product_id].append(
+            {
+                "id": pk,
+                "image": url,
+                "renditions": get_rendition_urls(renditions, request),
+            }
+        )
+    return images
+
+
+def collection_rows(rows):
+    return [
+        {
+            "id": row["id"],
+            "title": row["title"],
+            "products_count": row["products_count"],
+        }
+        for row in rows
+    ]
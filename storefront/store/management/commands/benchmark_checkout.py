@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from time import perf_counter
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from rest_framework.exceptions import ValidationError
+
+from store.carts import get_cart_store
+from store.models import Collection, Order, OrderItem, Product
+from store.serializers import CreateOrderSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent checkouts of one product with limited stock and reports "
+        "orders per second. Fails if the inventory is oversold. The rows it "
+        "creates are committed (threads need to see them) and deleted at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--checkouts", type=int, default=200)
+        parser.add_argument("--stock", type=int, default=100)
+        parser.add_argument("--quantity", type=int, default=1)
+
+    def handle(self, *args, **options):
+        store = get_cart_store()
+        collection = Collection.objects.create(title="Checkout Benchmark")
+        product = Product.objects.create(
+            title="Checkout Benchmark",
+            slug="checkout-benchmark",
+            unit_price=Decimal("10.00"),
+            inventory=options["stock"],
+            collection=collection,
+        )
+
+        users = []
+        checkouts = []
+        for _ in range(options["checkouts"]):
+            name = uuid4().hex
+            user = get_user_model().objects.create(
+                username=name, email=f"{name}@storefront.com"
+            )
+            cart = store.create()
+            store.add_item(cart.id, product.id, options["quantity"])
+            users.append(user)
+            checkouts.append((cart.id, user.id))
+
+        try:
+            start = perf_counter()
+            with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+                results = list(executor.map(self.checkout, checkouts))
+            elapsed = perf_counter() - start
+
+            product.refresh_from_db()
+            placed = results.count(True)
+            sold = options["stock"] - product.inventory
+
+            self.stdout.write(f"Orders placed: {placed}")
+            self.stdout.write(f"Orders rejected: {results.count(False)}")
+            self.stdout.write(f"Orders per second: {len(results) / elapsed:.1f}")
+            self.stdout.write(f"Inventory left: {product.inventory}")
+
+            if product.inventory < 0 or sold != placed * options["quantity"]:
+                raise CommandError(
+                    f"Inventory is inconsistent: {sold} sold, {placed} orders placed"
+                )
+            self.stdout.write(self.style.SUCCESS("Inventory is consistent."))
+        finally:
+            OrderItem.objects.filter(product=product).delete()
+            Order.objects.filter(customer__user__in=users).delete()
+            for user in users:
+                user.delete()
+            product.delete()
+            collection.delete()
+
+    def checkout(self, checkout):
+        cart_id, user_id = checkout
+        try:
+            serializer = CreateOrderSerializer(
+                data={"cart_id": cart_id}, context={"user_id": user_id}
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return True
+        except ValidationError:
+            return False
+        finally:
+            connection.close()
@@ -0,0 +1,99 @@
+from decimal import Decimal
+from statistics import median
+from time import perf_counter
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from store.models import Collection, Product
+from store.pagination import DefaultPagination, KeysetPagination
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares page-number and keyset pagination latency at a deep page while "
+        "the product table grows. Runs inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[1_000, 10_000, 100_000, 1_000_000],
+            help="Product table sizes to measure at",
+        )
+        parser.add_argument("--page", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.factory = APIRequestFactory()
+
+        self.stdout.write(
+            f"{'rows':>10} {'page':>6} {'offset (ms)':>12} {'keyset (ms)':>12}"
+        )
+        with transaction.atomic():
+            collection = Collection.objects.create(title="Benchmark")
+            rows = Product.objects.count()
+
+            for size in sorted(options["sizes"]):
+                if size > rows:
+                    self.grow(collection, size - rows, options["batch_size"])
+                    rows = size
+
+                page = min(options["page"], max(rows // DefaultPagination.page_size, 1))
+                offset_ms = self.time_offset(page, options["repeat"])
+                keyset_ms = self.time_keyset(page, options["repeat"])
+                self.stdout.write(
+                    f"{rows:>10} {page:>6} {offset_ms:>12.2f} {keyset_ms:>12.2f}"
+                )
+
+            transaction.set_rollback(True)
+
+    def grow(self, collection, count, batch_size):
+        while count > 0:
+            batch = min(count, batch_size)
+            Product.objects.bulk_create(
+                [
+                    Product(
+                        title=uuid4().hex,
+                        slug="-",
+                        unit_price=Decimal("10.00"),
+                        inventory=10,
+                        collection=collection,
+                    )
+                    for _ in range(batch)
+                ]
+            )
+            count -= batch
+
+    def time_offset(self, page, repeat):
+        request = Request(self.factory.get("/store/products/", {"page": page}))
+        return self.measure(DefaultPagination, request, repeat)
+
+    def time_keyset(self, page, repeat):
+        # Locate the row the requested page starts after, outside of the timing
+        offset = (page - 1) * KeysetPagination.page_size
+        paginator = KeysetPagination()
+        paginator.ordering = paginator.get_ordering(Product.objects.all())
+
+        params = {"count": KeysetPagination.COUNT_NONE}
+        if offset:
+            boundary = Product.objects.order_by("title", "id")[offset - 1]
+            params["cursor"] = paginator.encode_token(boundary, reverse=False)
+
+        request = Request(self.factory.get("/store/products/", params))
+        return self.measure(KeysetPagination, request, repeat)
+
+    def measure(self, pagination_class, request, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = perf_counter()
+            pagination_class().paginate_queryset(Product.objects.all(), request)
+            timings.append((perf_counter() - start) * 1000)
+        return median(timings)
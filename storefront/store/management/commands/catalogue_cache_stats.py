@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from store import caching
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints the hit/miss counters of the product list cache and the number "
+        "of conditional catalogue requests answered with a 304"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset the counters after printing"
+        )
+
+    def handle(self, *args, **options):
+        stats = caching.get_stats()
+        total = stats[caching.HIT] + stats[caching.MISS]
+        ratio = stats[caching.HIT] / total if total else 0
+
+        self.stdout.write(f"Hits: {stats[caching.HIT]}")
+        self.stdout.write(f"Misses: {stats[caching.MISS]}")
+        self.stdout.write(f"Hit ratio: {ratio:.2%}")
+        self.stdout.write(f"Not modified (304): {stats[caching.NOT_MODIFIED]}")
+
+        if options["reset"]:
+            caching.reset_stats()
+            self.stdout.write("Counters were reset.")
@@ -0,0 +1,137 @@
+import json
+import os
+from collections import Counter
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store import feeds
+
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 10
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams a CSV or NDJSON feed of collections, products (upserted on "
+        "slug) or images into the catalogue, one transaction per batch"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(feeds.IMPORTERS))
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            choices=feeds.FORMATS,
+            help="Defaults to the file extension (.csv, .ndjson or .jsonl)",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted import after its last committed batch",
+        )
+        parser.add_argument(
+            "--checkpoint", help="Checkpoint file, defaults to <path>.checkpoint"
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = options["format"] or feeds.detect_format(path)
+        if format is None:
+            raise CommandError("Unknown feed format, use --format")
+        if not os.path.isfile(path):
+            raise CommandError(f"{path} does not exist")
+
+        self.checkpoint_path = options["checkpoint"] or f"{path}.checkpoint"
+        self.feed = {
+            "kind": options["kind"],
+            "path": os.path.abspath(path),
+            "size": os.path.getsize(path),
+            "mtime": os.path.getmtime(path),
+        }
+        offset = self.load_checkpoint() if options["resume"] else 0
+
+        importer = feeds.IMPORTERS[options["kind"]]()
+        batch_size = options["batch_size"]
+        self.result = Counter()
+        self.rows = 0
+        self.start = self.last_progress = perf_counter()
+
+        with open(path, "rb") as file:
+            batch = []
+            end = offset
+            for record, end in feeds.read_records(file, format, offset):
+                try:
+                    if record is None:
+                        raise feeds.InvalidRecord("not a valid record")
+                    batch.append(importer.parse(record))
+                except feeds.InvalidRecord as error:
+                    self.result[feeds.SKIPPED] += 1
+                    self.stderr.write(
+                        f"Skipped the record ending at byte {end}: {error}"
+                    )
+
+                if len(batch) == batch_size:
+                    self.import_batch(importer, batch, end)
+                    batch = []
+
+            if batch:
+                self.import_batch(importer, batch, end)
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        elapsed = perf_counter() - self.start
+        rate = self.rows / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {self.rows} {options['kind']} in {elapsed:.2f}s "
+                f"({rate:.0f} rows/s): "
+                + ", ".join(
+                    f"{self.result[name]} {name}"
+                    for name in [
+                        feeds.CREATED,
+                        feeds.UPDATED,
+                        feeds.UNCHANGED,
+                        feeds.SKIPPED,
+                    ]
+                )
+            )
+        )
+
+    def import_batch(self, importer, batch, offset):
+        with transaction.atomic():
+            self.result.update(importer.upsert(batch))
+        # Written after the commit: a crash in between replays the batch,
+        # which the upserts make harmless
+        self.save_checkpoint(offset)
+        self.rows += len(batch)
+
+        now = perf_counter()
+        if now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            rate = self.rows / (now - self.start)
+            self.stdout.write(f"{self.rows} rows ({rate:.0f} rows/s)")
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            raise CommandError(f"No checkpoint at {self.checkpoint_path}")
+
+        if {name: checkpoint.get(name) for name in self.feed} != self.feed:
+            raise CommandError(
+                "The feed changed since the checkpoint was written, "
+                "import it again without --resume"
+            )
+        return checkpoint["offset"]
+
+    def save_checkpoint(self, offset):
+        temporary = f"{self.checkpoint_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump({**self.feed, "offset": offset}, file)
+        os.replace(temporary, self.checkpoint_path)
@@ -0,0 +1,153 @@
+import json
+import random
+import re
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store.models import (
+    Collection,
+    Customer,
+    CustomerStats,
+    Order,
+    OrderItem,
+    Product,
+)
+from tags.models import Tag
+
+
+USERNAME = "loadtest-{}"
+ADMIN_USERNAME = "loadtest-admin"
+WORDS = re.compile(r"[a-z]{4,}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the customers, orders and admin user the Locust suite logs in "
+        "with and writes the ids it samples from to a JSON file. Run it against "
+        "the local database after seed_db; running it again reuses the users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=50)
+        parser.add_argument("--orders", type=int, default=5, help="Per customer")
+        parser.add_argument("--password", default="loadtest-password")
+        parser.add_argument(
+            "--restock",
+            type=int,
+            default=100_000,
+            help="Inventory given to every product so checkouts don't run out",
+        )
+        parser.add_argument(
+            "--output",
+            default=str(Path(settings.BASE_DIR) / "locustfiles" / "data.json"),
+        )
+
+    def handle(self, *args, **options):
+        products = list(Product.objects.order_by("id").values_list("id", "title"))
+        if not products:
+            raise CommandError("There are no products, run seed_db first.")
+
+        with transaction.atomic():
+            Product.objects.update(inventory=options["restock"])
+            users = self.create_users(options["customers"], options["password"])
+            self.create_admin(options["password"])
+            self.create_orders(users, options["orders"], [pk for pk, _ in products])
+
+        data = {
+            "products": [pk for pk, _ in products],
+            "collections": list(
+                Collection.objects.order_by("id").values_list("id", flat=True)
+            ),
+            "search_terms": get_search_terms(title for _, title in products),
+            "tags": list(Tag.objects.order_by("label").values_list("label", flat=True)),
+            "customers": [
+                {"username": user.username, "password": options["password"]}
+                for user in users
+            ],
+            "admin": {"username": ADMIN_USERNAME, "password": options["password"]},
+        }
+        Path(options["output"]).write_text(json.dumps(data, indent=2))
+
+        self.stdout.write(
+            f"Wrote {len(data['products'])} products and {len(users)} customers "
+            f"to {options['output']}"
+        )
+
+    def create_users(self, count, password):
+        User = get_user_model()
+        usernames = [USERNAME.format(n) for n in range(1, count + 1)]
+        existing = set(
+            User.objects.filter(username__in=usernames).values_list(
+                "username", flat=True
+            )
+        )
+        # Hashing is slow on purpose, every load test user shares one hash
+        hashed = make_password(password)
+        User.objects.bulk_create(
+            [
+                User(username=name, email=f"{name}@storefront.com", password=hashed)
+                for name in usernames
+                if name not in existing
+            ]
+        )
+        User.objects.filter(username__in=usernames).update(password=hashed)
+
+        # bulk_create doesn't send the post_save that creates customers
+        users = list(User.objects.filter(username__in=usernames).order_by("id"))
+        with_customer = set(
+            Customer.objects.filter(user__in=users).values_list("user_id", flat=True)
+        )
+        Customer.objects.bulk_create(
+            [Customer(user=user) for user in users if user.id not in with_customer]
+        )
+        return users
+
+    def create_admin(self, password):
+        admin, _ = get_user_model().objects.get_or_create(
+            username=ADMIN_USERNAME,
+            defaults={"email": f"{ADMIN_USERNAME}@storefront.com"},
+        )
+        admin.is_staff = admin.is_superuser = True
+        admin.set_password(password)
+        admin.save()
+
+    def create_orders(self, users, per_customer, product_ids):
+        customer_ids = list(
+            Customer.objects.filter(user__in=users).values_list("id", flat=True)
+        )
+        counts = Counter(
+            Order.objects.filter(customer_id__in=customer_ids).values_list(
+                "customer_id", flat=True
+            )
+        )
+        prices = dict(Product.objects.values_list("id", "unit_price"))
+        for customer_id in customer_ids:
+            for _ in range(per_customer - counts[customer_id]):
+                order = Order.objects.create(customer_id=customer_id)
+                OrderItem.objects.bulk_create(
+                    [
+                        OrderItem(
+                            order=order,
+                            product_id=product_id,
+                            quantity=random.randint(1, 3),
+                            unit_price=prices[product_id],
+                        )
+                        for product_id in random.sample(
+                            product_ids, min(3, len(product_ids))
+                        )
+                    ]
+                )
+
+        # The items were bulk created, recount instead of relying on signals
+        CustomerStats.objects.rebuild(customer_ids)
+
+
+def get_search_terms(titles, count=50):
+    words = Counter(word for title in titles for word in WORDS.findall(title.lower()))
+    return [word for word, _ in words.most_common(count)]
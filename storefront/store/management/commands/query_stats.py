@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from store import instrumentation
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints the queries per request, database time and N+1 patterns "
+        "recorded by QueryInstrumentationMiddleware for each endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset the counters after printing"
+        )
+
+    def handle(self, *args, **options):
+        stats = instrumentation.get_stats()
+        if not stats:
+            self.stdout.write("No sampled requests.")
+
+        # Heaviest endpoints first
+        for endpoint, values in sorted(
+            stats.items(),
+            key=lambda item: item[1][instrumentation.QUERIES]
+            / max(item[1][instrumentation.REQUESTS], 1),
+            reverse=True,
+        ):
+            requests = max(values[instrumentation.REQUESTS], 1)
+            self.stdout.write(
+                f"{endpoint}: {values[instrumentation.REQUESTS]} requests, "
+                f"{values[instrumentation.QUERIES] / requests:.1f} queries and "
+                f"{values[instrumentation.DB_TIME] / requests / 1000:.1f}ms "
+                "in the database per request, "
+                f"{values[instrumentation.OVER_BUDGET]} over budget, "
+                f"{values[instrumentation.N_PLUS_ONE]} with N+1 queries"
+            )
+            if values["repeated"] is not None:
+                sql, count = values["repeated"]
+                self.stdout.write(f"    repeated {count} times: {sql}")
+
+        if options["reset"]:
+            instrumentation.reset_stats()
+            self.stdout.write("Counters were reset.")
@@ -0,0 +1,40 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Customer, CustomerStats
+
+
+class Command(BaseCommand):
+    help = "Recomputes the order statistics of every customer from their orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        start = perf_counter()
+        rebuilt = 0
+        last_id = 0
+
+        while True:
+            ids = list(
+                Customer.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                CustomerStats.objects.rebuild(ids)
+            rebuilt += len(ids)
+            last_id = ids[-1]
+
+        elapsed = perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt the stats of {rebuilt} customers in {elapsed:.2f}s."
+            )
+        )
@@ -0,0 +1,21 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product search index (e.g. after bulk loading products)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        indexed = search.rebuild_index(batch_size=options["batch_size"])
+        elapsed = perf_counter() - start
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Indexed {indexed} products in {elapsed:.2f}s.")
+        )
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from store import caching
+from store.models import Collection, Product
+
+
+class Command(BaseCommand):
+    help = "Repairs drift between Collection.products_count and the product table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        checked = repaired = 0
+        last_id = 0
+
+        while True:
+            ids = list(
+                Collection.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            repaired += self.reconcile(ids)
+            checked += len(ids)
+            last_id = ids[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} collections, repaired {repaired}.")
+        )
+
+    def reconcile(self, ids):
+        actual = dict(
+            Product.objects.filter(collection_id__in=ids)
+            .order_by()
+            .values("collection_id")
+            .annotate(count=Count("id"))
+            .values_list("collection_id", "count")
+        )
+        drifted = [
+            pk
+            for pk, stored in Collection.objects.filter(id__in=ids).values_list(
+                "id", "products_count"
+            )
+            if stored != actual.get(pk, 0)
+        ]
+        if not drifted:
+            return 0
+
+        # Recount in the UPDATE itself so writes made since the check above
+        # aren't overwritten with a stale number
+        count = (
+            Product.objects.filter(collection_id=OuterRef("pk"))
+            .order_by()
+            .values("collection_id")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        with transaction.atomic():
+            Collection.objects.filter(id__in=drifted).update(
+                products_count=Coalesce(Subquery(count, output_field=IntegerField()), 0)
+            )
+            # The collection list ETag follows the catalogue versions
+            caching.bump_versions_on_commit(*drifted)
+        return len(drifted)
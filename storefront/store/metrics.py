@@ -0,0 +1,160 @@
+"""
+Prometheus metrics, served in the text format at /metrics.
+
+    storefront_request_duration_seconds   histogram by endpoint, method, status
+    storefront_request_db_seconds         database time per request, by endpoint
+    storefront_db_queries_total           queries, by endpoint
+    storefront_cache_requests_total       catalogue cache hits/misses/304s
+    storefront_celery_task_duration_seconds  by task and state
+
+Endpoints are named like in store.instrumentation (`ProductViewSet.list`),
+requests that don't resolve share one label so the number of series stays
+bounded.
+
+Under gunicorn (or any other multi-process server) set
+PROMETHEUS_MULTIPROC_DIR to a directory shared by the workers and emptied
+before they start; every process then writes its samples there and
+/metrics sums them up. gunicorn.conf.py cleans up after exited workers.
+Celery workers started with the same directory show up as well.
+
+/metrics is open to staff users and to scrapers sending
+`Authorization: Bearer <METRICS_TOKEN>`.
+"""
+
+import hmac
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from .instrumentation import (
+    async_execute_wrapper,
+    execute_wrapper,
+    get_endpoint,
+    is_counted,
+)
+
+
+UNRESOLVED = "unresolved"
+
+REQUEST_DURATION = Histogram(
+    "storefront_request_duration_seconds",
+    "Time spent handling requests",
+    ["endpoint", "method", "status"],
+)
+REQUEST_DB_TIME = Histogram(
+    "storefront_request_db_seconds",
+    "Time spent in the database per request",
+    ["endpoint"],
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5],
+)
+DB_QUERIES = Counter(
+    "storefront_db_queries", "Database queries run by requests", ["endpoint"]
+)
+CACHE_REQUESTS = Counter(
+    "storefront_cache_requests",
+    "Catalogue cache lookups, see store.caching",
+    ["result"],
+)
+TASK_DURATION = Histogram(
+    "storefront_celery_task_duration_seconds",
+    "Time spent running Celery tasks",
+    ["task", "state"],
+    buckets=[0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300],
+)
+
+
+class DatabaseTimer:
+    """
+    Database execute wrapper adding up the queries run while it's installed,
+    leaving out the same statements as store.instrumentation.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if is_counted(sql):
+                self.duration += time.perf_counter() - start
+                self.count += 1
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        with execute_wrapper(DatabaseTimer()) as timer:
+            response = self.get_response(request)
+        return self.observe(request, response, timer, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        async with async_execute_wrapper(DatabaseTimer()) as timer:
+            response = await self.get_response(request)
+        return self.observe(request, response, timer, time.perf_counter() - start)
+
+    def observe(self, request, response, timer, duration):
+        endpoint = get_endpoint(request) or UNRESOLVED
+        REQUEST_DURATION.labels(endpoint, request.method, response.status_code).observe(
+            duration
+        )
+        REQUEST_DB_TIME.labels(endpoint).observe(timer.duration)
+        DB_QUERIES.labels(endpoint).inc(timer.count)
+        return response
+
+
+def observe_task(task_name, state, duration):
+    TASK_DURATION.labels(task_name, state).observe(duration)
+
+
+def get_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def can_scrape(request):
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+
+    token = getattr(settings, "METRICS_TOKEN", "")
+    header = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(header, f"Bearer {token}")
+
+
+def metrics_view(request):
+    if not can_scrape(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST
+    )
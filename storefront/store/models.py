@@ -1,10 +1,26 @@
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    Max,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib import admin
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 
+from collections import Counter
 from uuid import uuid4
 
+from . import caching
+from .uploads import ImageField
 from .validators import validate_file_size
 
 
@@ -16,11 +32,29 @@ class Promotion(models.Model):
     # product_set (Model: Product)
 
 
+class CollectionManager(models.Manager):
+    def adjust_products_count(self, deltas):
+        """
+        Applies {collection_id: delta} to the stored products counts.
+        """
+
+        for collection_id, delta in deltas.items():
+            if collection_id is not None and delta:
+                self.filter(pk=collection_id).update(
+                    products_count=F("products_count") + delta
+                )
+
+
 class Collection(models.Model):
+    objects = CollectionManager()
+
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         "Product", null=True, on_delete=models.SET_NULL, related_name="+"
     )
+    # Maintained by store.signals.handlers and ProductQuerySet,
+    # repaired by the reconcile_products_count command
+    products_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
@@ -32,7 +66,93 @@ class Collection(models.Model):
     # products (Model: Product)
 
 
+class ProductQuerySet(models.QuerySet):
+    """
+    Bulk writes don't send post_save signals, so they update the collection
+    products counts and invalidate the catalogue cache themselves.
+    (bulk_update goes through update)
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            deltas = Counter(product.collection_id for product in objs)
+            Collection.objects.adjust_products_count(deltas)
+        caching.bump_versions_on_commit(*deltas, using=self.db)
+        return objs
+
+    def update(self, **kwargs):
+        # auto_now isn't applied by update, and last_update is what the
+        # product detail ETag and Last-Modified are built from
+        kwargs.setdefault("last_update", timezone.now())
+        if "collection" not in kwargs and "collection_id" not in kwargs:
+            collection_ids = set(
+                self.order_by().values_list("collection_id", flat=True).distinct()
+            )
+            rows = super().update(**kwargs)
+            caching.bump_versions_on_commit(*collection_ids, using=self.db)
+            return rows
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            # The new collection may be an expression (e.g. a Case from
+            # bulk_update), so count the moved rows before and after
+            pks = list(self.values_list("pk", flat=True))
+            before = self.model.count_by_collection(pks, using=self.db)
+            rows = super().update(**kwargs)
+            after = self.model.count_by_collection(pks, using=self.db)
+
+            deltas = Counter(after)
+            deltas.subtract(before)
+            Collection.objects.adjust_products_count(deltas)
+        caching.bump_versions_on_commit(*before, *after, using=self.db)
+        return rows
+
+    def reserve_inventory(self, quantities):
+        """
+        Takes {product_id: quantity} out of the inventory with one conditional
+        UPDATE (SET inventory = inventory - q WHERE inventory >= q). The rows
+        are first locked with SELECT ... ORDER BY id FOR UPDATE: the UPDATE
+        alone takes them in whatever order the plan scans them, and concurrent
+        checkouts locking in different orders could deadlock.
+
+        Either every product is reserved or none is. Returns the ids of the
+        products that don't have enough stock (empty on success).
+        """
+
+        product_ids = sorted(quantities)
+        quantity = Case(
+            *[When(pk=pk, then=Value(quantities[pk])) for pk in product_ids],
+            output_field=IntegerField(),
+        )
+
+        with transaction.atomic(using=self.db):
+            list(
+                self.filter(pk__in=product_ids)
+                .order_by("pk")
+                .select_for_update()
+                .values_list("pk", flat=True)
+            )
+            reserved = self.filter(pk__in=product_ids, inventory__gte=quantity).update(
+                inventory=F("inventory") - quantity
+            )
+            if reserved != len(product_ids):
+                # Roll back to the savepoint, releasing the rows that were taken
+                transaction.set_rollback(True, using=self.db)
+
+        if reserved == len(product_ids):
+            return []
+
+        available = set(
+            self.filter(pk__in=product_ids, inventory__gte=quantity).values_list(
+                "id", flat=True
+            )
+        )
+        return [pk for pk in product_ids if pk not in available]
+
+
 class Product(models.Model):
+    objects = ProductQuerySet.as_manager()
+
     title = models.CharField(max_length=255)
     slug = models.SlugField()
     description = models.TextField(blank=True, null=True)
@@ -55,8 +175,39 @@ class Product(models.Model):
     def __str__(self) -> str:
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the collection the row was loaded with, so signal handlers
+        # can tell when a product is moved to another collection.
+        instance._loaded_collection_id = instance.__dict__.get("collection_id")
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_collection_id = self.collection_id
+
+    @classmethod
+    def count_by_collection(cls, pks, using="default"):
+        return Counter(
+            dict(
+                cls._base_manager.using(using)
+                .filter(pk__in=pks)
+                .order_by()
+                .values("collection_id")
+                .annotate(count=Count("id"))
+                .values_list("collection_id", "count")
+            )
+        )
+
     class Meta:
         ordering = ["title"]
+        # Keyset pagination seeks on (ordering field, id)
+        indexes = [
+            models.Index(fields=["title", "id"]),
+            models.Index(fields=["unit_price", "id"]),
+            models.Index(fields=["last_update", "id"]),
+        ]
 
     # Related fields
     #   - images (Model: ProductImage)
@@ -65,6 +216,26 @@ class Product(models.Model):
     #   - reviews (Model: Reviews)
 
 
+class ProductSearchToken(models.Model):
+    """
+    Inverted index entry of the product search, see store.search
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="search_tokens"
+    )
+    token = models.CharField(max_length=50)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [
+            ["product", "token"],
+        ]
+        indexes = [
+            models.Index(fields=["token", "product"]),
+        ]
+
+
 class Customer(models.Model):
     MEMBERSHIP_BRONZE = "B"
     MEMBERSHIP_SILVER = "S"
@@ -109,10 +280,130 @@ class ProductImage(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="images"
     )
-    image = models.ImageField(upload_to="store/images", validators=[validate_file_size])
+    image = ImageField(upload_to="store/images", validators=[validate_file_size])
+    # {rendition: {extension: path}} written by the generate_image_renditions
+    # task, see store.images
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+
+class CustomerStatsManager(models.Manager):
+    def adjust(self, customer_id, orders=0, spend=0, placed_at=None):
+        """
+        Applies deltas to the stats of a customer, creating the row the first
+        time.
+        """
+
+        updates = {
+            "orders_count": F("orders_count") + orders,
+            "lifetime_spend": F("lifetime_spend") + spend,
+        }
+        if placed_at is not None:
+            updates["last_order_at"] = Greatest(
+                Coalesce("last_order_at", Value(placed_at)), Value(placed_at)
+            )
+
+        if self.filter(customer_id=customer_id).update(**updates):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(
+                    customer_id=customer_id,
+                    orders_count=orders,
+                    lifetime_spend=spend,
+                    last_order_at=placed_at,
+                )
+        except IntegrityError:
+            # Created concurrently
+            self.filter(customer_id=customer_id).update(**updates)
+
+    def rebuild(self, customer_ids):
+        """
+        Recomputes the stats of the given customers from their orders.
+        """
+
+        orders = dict(
+            (customer_id, (count, last_order_at))
+            for customer_id, count, last_order_at in Order.objects.filter(
+                customer_id__in=customer_ids
+            )
+            .order_by()
+            .values("customer_id")
+            .annotate(count=Count("id"), last_order_at=Max("placed_at"))
+            .values_list("customer_id", "count", "last_order_at")
+        )
+        spend = dict(
+            OrderItem.objects.filter(
+                order__customer_id__in=customer_ids,
+                order__payment_status=Order.PAYMENT_STATUS_COMPLETED,
+            )
+            .order_by()
+            .values("order__customer_id")
+            .annotate(spend=Sum(ORDER_ITEM_TOTAL))
+            .values_list("order__customer_id", "spend")
+        )
+
+        stats = [
+            CustomerStats(
+                customer_id=customer_id,
+                orders_count=orders.get(customer_id, (0, None))[0],
+                lifetime_spend=spend.get(customer_id) or 0,
+                last_order_at=orders.get(customer_id, (0, None))[1],
+            )
+            for customer_id in customer_ids
+        ]
+        # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target
+        features = connections[self.db].features
+        self.bulk_create(
+            stats,
+            update_conflicts=True,
+            unique_fields=(
+                ["customer"] if features.supports_update_conflicts_with_target else None
+            ),
+            update_fields=["orders_count", "lifetime_spend", "last_order_at"],
+        )
+
+
+class CustomerStats(models.Model):
+    """
+    Order statistics of a customer, maintained by store.signals.handlers and
+    repaired by the rebuild_customer_stats command
+    """
+
+    objects = CustomerStatsManager()
+
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    orders_count = models.PositiveIntegerField(default=0)
+    # Total of the orders whose payment is completed
+    lifetime_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "customer stats"
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        # OrderSerializer renders every item with its product
+        return self.prefetch_related(
+            models.Prefetch(
+                "items", queryset=OrderItem.objects.select_related("product")
+            )
+        )
+
+    def total(self):
+        return (
+            OrderItem.objects.filter(order__in=self)
+            .order_by()
+            .aggregate(total=Sum(ORDER_ITEM_TOTAL))["total"]
+            or 0
+        )
 
 
 class Order(models.Model):
+    objects = OrderQuerySet.as_manager()
+
     PAYMENT_STATUS_PENDING = "P"
     PAYMENT_STATUS_COMPLETED = "C"
     PAYMENT_STATUS_FAILED = "F"
@@ -132,10 +423,25 @@ class Order(models.Model):
     def __str__(self) -> str:
         return str(self.id)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the status the row was loaded with, so signal handlers can
+        # tell when the payment status changes
+        instance._loaded_payment_status = instance.__dict__.get("payment_status")
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_payment_status = self.payment_status
+
     class Meta:
         permissions = [
             ("cancel_order", "Can cancel order"),
         ]
+        indexes = [
+            models.Index(fields=["customer", "placed_at"]),
+        ]
 
     # Related fields
     #   - items (Model: OrderItem)
@@ -150,6 +456,12 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
 
+ORDER_ITEM_TOTAL = ExpressionWrapper(
+    F("quantity") * F("unit_price"),
+    output_field=models.DecimalField(max_digits=12, decimal_places=2),
+)
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -158,7 +470,112 @@ class Cart(models.Model):
     #   - items (Model: CartItem)
 
 
+class CartItemManager(models.Manager):
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Adds `quantity` of a product to a cart in a single statement:
+
+            INSERT ... SELECT FROM cart, product ... ON CONFLICT DO UPDATE
+            SET quantity = quantity + n
+
+        Concurrent adds to the same cart item can't lose updates, and the
+        existence of the cart and the product is checked by the SELECT
+        instead of separate queries. Raises Cart.DoesNotExist or
+        Product.DoesNotExist when nothing could be inserted.
+        """
+
+        connection = connections[self.db]
+
+        if connection.vendor == "mysql":
+            row = self._add_quantity_on_duplicate_key(
+                connection,
+                Cart._meta.pk.get_db_prep_value(cart_id, connection),
+                product_id,
+                quantity,
+            )
+        elif (
+            connection.features.supports_update_conflicts_with_target
+            and connection.features.can_return_columns_from_insert
+        ):
+            row = self._add_quantity_on_conflict(
+                connection,
+                Cart._meta.pk.get_db_prep_value(cart_id, connection),
+                product_id,
+                quantity,
+            )
+        else:
+            row = self._add_quantity_with_f_expression(cart_id, product_id, quantity)
+
+        if row is None:
+            if not Cart.objects.using(self.db).filter(pk=cart_id).exists():
+                raise Cart.DoesNotExist
+            raise Product.DoesNotExist
+
+        pk, total = row
+        return self.model(id=pk, cart_id=cart_id, product_id=product_id, quantity=total)
+
+    def _insert_select_sql(self, connection):
+        quote = connection.ops.quote_name
+        return (
+            f"INSERT INTO {quote(self.model._meta.db_table)} "
+            f"(cart_id, product_id, quantity) "
+            f"SELECT cart.id, product.id, %s "
+            f"FROM {quote(Cart._meta.db_table)} cart, "
+            f"{quote(Product._meta.db_table)} product "
+            f"WHERE cart.id = %s AND product.id = %s"
+        )
+
+    def _add_quantity_on_conflict(self, connection, cart_id, product_id, quantity):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        sql = (
+            f"{self._insert_select_sql(connection)} "
+            f"ON CONFLICT (cart_id, product_id) "
+            f"DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity "
+            f"RETURNING id, quantity"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [quantity, cart_id, product_id])
+            return cursor.fetchone()
+
+    def _add_quantity_on_duplicate_key(self, connection, cart_id, product_id, quantity):
+        # LAST_INSERT_ID(id) makes lastrowid the id of the updated row as well.
+        # The columns are qualified, the SELECT's cart and product have an id
+        # too and MySQL resolves their columns in this clause.
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        sql = (
+            f"{self._insert_select_sql(connection)} "
+            f"ON DUPLICATE KEY UPDATE {table}.id = LAST_INSERT_ID({table}.id), "
+            f"{table}.quantity = {table}.quantity + %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [quantity, cart_id, product_id, quantity])
+            if cursor.rowcount == 0:
+                return None
+            pk = cursor.lastrowid
+            cursor.execute(f"SELECT id, quantity FROM {table} WHERE id = %s", [pk])
+            return cursor.fetchone()
+
+    def _add_quantity_with_f_expression(self, cart_id, product_id, quantity):
+        items = self.filter(cart_id=cart_id, product_id=product_id)
+        if not items.update(quantity=F("quantity") + quantity):
+            if not Product.objects.using(self.db).filter(pk=product_id).exists():
+                return None
+            try:
+                with transaction.atomic(using=self.db):
+                    item = self.create(
+                        cart_id=cart_id, product_id=product_id, quantity=quantity
+                    )
+                return item.id, item.quantity
+            except IntegrityError:
+                # Lost the race to insert it, or the cart doesn't exist
+                if not items.update(quantity=F("quantity") + quantity):
+                    return None
+        return items.values_list("id", "quantity").first()
+
+
 class CartItem(models.Model):
+    objects = CartItemManager()
+
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
@@ -182,3 +599,26 @@ class Review(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
+
+
+class OutboxMessage(models.Model):
+    """
+    Event written in the same transaction as the change it describes and
+    delivered to its signal receivers after commit, see store.outbox
+    """
+
+    event = models.CharField(max_length=255)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.event} #{self.id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["dispatched_at", "available_at"]),
+        ]
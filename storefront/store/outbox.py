@@ -0,0 +1,129 @@
+"""
+Transactional outbox for store signals.
+
+Instead of calling signal receivers inside the checkout transaction, the
+event is stored as an OutboxMessage in that transaction and delivered by the
+dispatch_outbox Celery task after commit. Delivery is at-least-once: when a
+receiver fails, every receiver of the message runs again on the next attempt,
+so receivers must be idempotent.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OutboxMessage
+from .signals import order_created
+
+logger = logging.getLogger(__name__)  # store.outbox
+
+
+ORDER_CREATED = "order_created"
+
+# Event name -> (signal, model of payload["id"], signal argument name)
+EVENTS = {
+    ORDER_CREATED: (order_created, Order, "order"),
+}
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 10
+# A claimed message is retried if it isn't marked dispatched within this time
+LEASE = timedelta(minutes=5)
+MAX_BACKOFF = timedelta(hours=1)
+
+
+def enqueue(event, instance):
+    """
+    Writes an event about `instance` to the outbox and schedules its delivery
+    for when the current transaction commits.
+    """
+
+    from .tasks import dispatch_outbox
+
+    message = OutboxMessage.objects.create(event=event, payload={"id": instance.pk})
+    # The order is committed by then: if the broker is down the beat sweep
+    # delivers the message instead of the request failing
+    transaction.on_commit(dispatch_outbox.delay, robust=True)
+    return message
+
+
+def get_backoff(attempts):
+    return min(timedelta(seconds=2**attempts), MAX_BACKOFF)
+
+
+def claim(batch_size=BATCH_SIZE):
+    """
+    Leases a batch of due messages so concurrent dispatchers skip them.
+    """
+
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(
+                dispatched_at__isnull=True,
+                available_at__lte=now,
+                attempts__lt=MAX_ATTEMPTS,
+            )
+            .order_by("id")[:batch_size]
+        )
+        OutboxMessage.objects.filter(
+            pk__in=[message.pk for message in messages]
+        ).update(available_at=now + LEASE)
+    return messages
+
+
+def dispatch_batch(batch_size=BATCH_SIZE):
+    """
+    Delivers one batch of due messages and returns how many were claimed.
+    """
+
+    messages = claim(batch_size)
+
+    instances = {}
+    for event, (_, model, _) in EVENTS.items():
+        ids = [message.payload["id"] for message in messages if message.event == event]
+        if ids:
+            instances[event] = model.objects.in_bulk(ids)
+
+    now = timezone.now()
+    for message in messages:
+        message.attempts += 1
+        error = deliver(message, instances.get(message.event, {}))
+        if error is None:
+            message.dispatched_at = now
+            message.last_error = ""
+        else:
+            logger.warning("Outbox message %s failed: %s", message, error)
+            message.available_at = now + get_backoff(message.attempts)
+            message.last_error = error
+
+    OutboxMessage.objects.bulk_update(
+        messages, ["attempts", "available_at", "last_error", "dispatched_at"]
+    )
+    return len(messages)
+
+
+def deliver(message, instances):
+    """
+    Sends the signal of a message and returns an error description, or None
+    when every receiver succeeded.
+    """
+
+    if message.event not in EVENTS:
+        return f"Unknown event {message.event!r}"
+
+    signal, model, argument = EVENTS[message.event]
+    instance = instances.get(message.payload["id"])
+    if instance is None:
+        return f"{model.__name__} {message.payload['id']} does not exist"
+
+    responses = signal.send_robust(model, **{argument: instance})
+    errors = [
+        f"{receiver.__module__}.{receiver.__qualname__}: {response!r}"
+        for receiver, response in responses
+        if isinstance(response, Exception)
+    ]
+    return "\n".join(errors) or None
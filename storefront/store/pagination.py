@@ -1,5 +1,250 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # Keep the full microsecond precision, the keyset compares for equality
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks past the last row of the previous page
+    (WHERE (title, id) > (%s, %s)) instead of scanning an OFFSET, so every page
+    costs the same no matter how deep it is.
+
+    The page is ordered by the queryset's ordering (e.g. applied by
+    OrderingFilter, or the model's Meta.ordering) with `id` as a tiebreaker.
+    The total count is exact unless `?count=none|estimate` skips or estimates
+    it (see estimate_count).
+    """
+
+    page_size = 10
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    tiebreaker = "id"
+
+    COUNT_NONE = "none"
+    COUNT_ESTIMATE = "estimate"
+    COUNT_EXACT = "exact"
+    count_modes = [COUNT_NONE, COUNT_ESTIMATE, COUNT_EXACT]
+    default_count_mode = COUNT_EXACT
+
+    # Filtered querysets are counted exactly up to this many rows only
+    max_estimated_count = 1000
+
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        self.count = self.get_count(queryset)
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor["reverse"]
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [(name, not descending) for name, descending in ordering]
+
+        queryset = queryset.order_by(
+            *[f"-{name}" if descending else name for name, descending in ordering]
+        )
+        if cursor is not None:
+            # Values of the wrong type for their fields fail when the lookups
+            # are prepared, e.g. a string for the id
+            try:
+                queryset = queryset.filter(self.seek(ordering, cursor["values"]))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response["count"] = self.count
+        response["next"] = self.get_next_link()
+        response["previous"] = self.get_previous_link()
+        response["results"] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "count": {"type": "integer", "example": 123},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_ordering(self, queryset):
+        """
+        Returns the ordering as a list of (field name, descending) pairs ending
+        with the tiebreaker.
+        """
+
+        names = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        ordering = [
+            (name.lstrip("-"), name.startswith("-"))
+            for name in names
+            if name.lstrip("-") not in [self.tiebreaker, "pk"]
+        ]
+        ordering.append((self.tiebreaker, False))
+        return ordering
+
+    def get_count(self, queryset):
+        mode = self.request.query_params.get(
+            self.count_query_param, self.default_count_mode
+        )
+        if mode not in self.count_modes:
+            mode = self.default_count_mode
+
+        if mode == self.COUNT_EXACT:
+            return queryset.count()
+        if mode == self.COUNT_ESTIMATE:
+            return self.estimate_count(queryset)
+        return None
+
+    def estimate_count(self, queryset):
+        """
+        Reads the row count from the table statistics for unfiltered querysets,
+        otherwise counts at most `max_estimated_count` + 1 rows.
+        """
+
+        if not queryset.query.where:
+            estimate = estimate_table_rows(queryset.model, queryset.db)
+            if estimate is not None:
+                return estimate
+        return queryset.order_by()[: self.max_estimated_count + 1].count()
+
+    def seek(self, ordering, values):
+        """
+        Builds the keyset condition selecting the rows after `values`, e.g.
+        (title > t) OR (title = t AND id > i) for ordering title, id.
+        """
+
+        condition = Q()
+        for position, (name, descending) in enumerate(ordering):
+            lookup = "lt" if descending else "gt"
+            clause = Q(**{f"{name}__{lookup}": values[position]})
+            for previous, (previous_name, _) in enumerate(ordering[:position]):
+                clause &= Q(**{previous_name: values[previous]})
+            condition |= clause
+        return condition
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        url = self.request.build_absolute_uri()
+        token = self.encode_token(instance, reverse)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def encode_token(self, instance, reverse):
+        cursor = {
+            "values": [get_value(instance, name) for name, _ in self.ordering],
+            "reverse": reverse,
+        }
+        return base64.urlsafe_b64encode(
+            json.dumps(cursor, cls=CursorEncoder).encode()
+        ).decode()
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+            values = cursor["values"]
+            reverse = bool(cursor["reverse"])
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return {"values": values, "reverse": reverse}
+
+    def get_results(self, data):
+        return data["results"]
+
+
+def get_value(instance, name):
+    # values() rows, see store.listings
+    if isinstance(instance, dict):
+        return instance[name]
+    for attribute in name.split("__"):
+        instance = getattr(instance, attribute)
+    return instance
+
+
+def estimate_table_rows(model, using="default"):
+    """
+    Returns the row count the database keeps in its table statistics, or None
+    when the backend doesn't expose one.
+    """
+
+    connection = connections[using]
+    table = model._meta.db_table
+
+    if connection.vendor == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+    elif connection.vendor == "mysql":
+        sql = (
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+        )
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
@@ -0,0 +1,88 @@
+import re
+from collections import Counter
+
+from django.db import transaction
+
+from .models import Product, ProductSearchToken
+
+
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = ProductSearchToken._meta.get_field("token").max_length
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase word tokens, e.g. "Bread - Multigrain" becomes
+    ["bread", "multigrain"].
+    """
+
+    if not text:
+        return []
+    return [
+        word[:MAX_TOKEN_LENGTH]
+        for word in WORD_PATTERN.findall(text.lower())
+        if len(word) >= MIN_TOKEN_LENGTH
+    ]
+
+
+def get_weights(product):
+    weights = Counter()
+    for token in tokenize(product.title):
+        weights[token] += TITLE_WEIGHT
+    for token in tokenize(product.description):
+        weights[token] += DESCRIPTION_WEIGHT
+    return weights
+
+
+def build_tokens(product):
+    return [
+        ProductSearchToken(product_id=product.id, token=token, weight=weight)
+        for token, weight in get_weights(product).items()
+    ]
+
+
+def index_product(product):
+    """
+    Replaces the search tokens of a single product.
+    """
+
+    with transaction.atomic():
+        ProductSearchToken.objects.filter(product_id=product.id).delete()
+        ProductSearchToken.objects.bulk_create(build_tokens(product))
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Rebuilds the search tokens of every product in batches and returns the
+    number of products indexed.
+    """
+
+    indexed = 0
+    products = Product.objects.only("id", "title", "description").order_by("id")
+    batch = []
+
+    for product in products.iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) == batch_size:
+            indexed += index_batch(batch)
+            batch = []
+
+    if batch:
+        indexed += index_batch(batch)
+    return indexed
+
+
+def index_batch(products):
+    with transaction.atomic():
+        ProductSearchToken.objects.filter(
+            product_id__in=[product.id for product in products]
+        ).delete()
+        ProductSearchToken.objects.bulk_create(
+            [token for product in products for token in build_tokens(product)]
+        )
+    return len(products)
@@ -2,12 +2,20 @@ from decimal import Decimal
 
 from rest_framework import serializers
 
-from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.storage import default_storage
+from django.db import models, transaction
 
+from likes.models import LikedItem
+from tags.models import TaggedItem
+
+from . import outbox
+from .carts import get_cart_store, resolve_quantities
 from .models import (
     Cart,
     CartItem,
     Customer,
+    CustomerStats,
     Order,
     OrderItem,
     Product,
@@ -15,8 +23,29 @@ from .models import (
     ProductImage,
     Review,
 )
+from .uploads import ImageFormField
+
+
+# Built from the float on purpose: Decimal("1.1") would change the published
+# prices in the last digits
+TAX_RATE = Decimal(1.1)
+
 
-from .signals import order_created
+def get_rendition_urls(renditions, request=None):
+    """
+    Returns the URLs of the resized renditions of a product image (empty until
+    they have been generated).
+    """
+
+    urls = {}
+    for rendition, paths in renditions.items():
+        urls[rendition] = {}
+        for extension, path in paths.items():
+            url = default_storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[rendition][extension] = url
+    return urls
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -26,9 +55,17 @@ class CollectionSerializer(serializers.ModelSerializer):
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ["id", "image"]
+        fields = ["id", "image", "renditions"]
+        # Reports files dropped by the upload handler for their size instead
+        # of Pillow failing to open them, same as the admin form
+        extra_kwargs = {"image": {"_DjangoImageField": ImageFormField}}
+
+    def get_renditions(self, product_image: ProductImage):
+        return get_rendition_urls(product_image.renditions, self.context.get("request"))
 
     def save(self, **kwargs):
         product_id = self.context["product_id"]
@@ -39,9 +76,26 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return self.instance
 
 
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        data = list(data.all() if isinstance(data, models.Manager) else data)
+        if "tags" in self.child.fields:
+            # One query for the tags of the whole page
+            self.child.tags_by_product = TaggedItem.objects.get_tags_for_many(
+                Product, [product.id for product in data]
+            )
+        if "likes" in self.child.fields:
+            self.child.likes_by_product = LikedItem.objects.counts_for(
+                Product, [product.id for product in data]
+            )
+        return super().to_representation(data)
+
+
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     price_with_tax = serializers.SerializerMethodField(method_name="calculate_tax")
+    tags = serializers.SerializerMethodField()
+    likes = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
@@ -55,10 +109,33 @@ class ProductSerializer(serializers.ModelSerializer):
             "price_with_tax",
             "collection",
             "images",
+            "tags",
+            "likes",
         ]
+        list_serializer_class = ProductListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only rendered when asked for, e.g. with ?include=tags,likes
+        include = self.context.get("include", set())
+        for name in ["tags", "likes"]:
+            if name not in include:
+                self.fields.pop(name)
 
     def calculate_tax(self, product: Product):
-        return product.unit_price * Decimal(1.1)
+        return product.unit_price * TAX_RATE
+
+    def get_tags(self, product: Product):
+        tags = getattr(self, "tags_by_product", None)
+        if tags is None:
+            tags = TaggedItem.objects.get_tags_for_many(Product, [product.id])
+        return [tag.label for tag in tags.get(product.id, [])]
+
+    def get_likes(self, product: Product):
+        likes = getattr(self, "likes_by_product", None)
+        if likes is None:
+            likes = LikedItem.objects.counts_for(Product, [product.id])
+        return likes.get(product.id, 0)
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -115,15 +192,13 @@ class CartSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError("No product with the given ID was found")
-        return value
-
     def save(self, **kwargs):
         """
         Updates the product quantity of cart item if product is already
         present inside cart.
+
+        The product is validated by the cart store while adding it
+        (see CartItemManager.add_quantity), not by a separate query.
         """
 
         cart_id = self.context["cart_id"]
@@ -132,14 +207,10 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         quantity = self.validated_data["quantity"]
 
         try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data
+            self.instance = get_cart_store().add_item(cart_id, product_id, quantity)
+        except Product.DoesNotExist:
+            raise serializers.ValidationError(
+                {"product_id": ["No product with the given ID was found"]}
             )
 
         return self.instance
@@ -149,11 +220,109 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ["id", "product_id", "quantity"]
 
 
+class CartItemOperationSerializer(serializers.Serializer):
+    OPERATION_ADD = "add"
+    OPERATION_SET = "set"
+    OPERATION_REMOVE = "remove"
+
+    OPERATION_CHOICES = [OPERATION_ADD, OPERATION_SET, OPERATION_REMOVE]
+
+    # CartItem.quantity is a PositiveSmallIntegerField
+    MAX_QUANTITY = 32_767
+
+    operation = serializers.ChoiceField(
+        choices=OPERATION_CHOICES, default=OPERATION_ADD
+    )
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(
+        min_value=1, max_value=MAX_QUANTITY, required=False
+    )
+
+    def validate(self, attrs):
+        if attrs["operation"] != self.OPERATION_REMOVE and "quantity" not in attrs:
+            raise serializers.ValidationError({"quantity": ["This field is required."]})
+        return attrs
+
+
+class BatchCartItemSerializer(serializers.Serializer):
+    """
+    Applies a list of add/set/remove operations to a cart in one transaction.
+    """
+
+    max_operations = 100
+
+    operations = CartItemOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        if len(operations) > self.max_operations:
+            raise serializers.ValidationError(
+                f"Ensure there are no more than {self.max_operations} operations."
+            )
+
+        product_ids = {operation["product_id"] for operation in operations}
+        found = set(
+            Product.objects.filter(pk__in=product_ids).values_list("id", flat=True)
+        )
+        missing = sorted(product_ids - found)
+        if missing:
+            raise serializers.ValidationError(
+                f"No products with the given IDs were found: {missing}"
+            )
+        return operations
+
+    def validate(self, attrs):
+        operations = attrs["operations"]
+        if any(
+            operation["operation"] == CartItemOperationSerializer.OPERATION_ADD
+            for operation in operations
+        ):
+            # Additions can push the quantities already in the cart too high
+            quantities = resolve_quantities(self.get_quantities(), operations)
+            over = sorted(
+                product_id
+                for product_id, quantity in quantities.items()
+                if quantity is not None
+                and quantity > CartItemOperationSerializer.MAX_QUANTITY
+            )
+            if over:
+                raise serializers.ValidationError(
+                    {
+                        "operations": [
+                            "Ensure the quantities are no more than "
+                            f"{CartItemOperationSerializer.MAX_QUANTITY}: {over}"
+                        ]
+                    }
+                )
+        return attrs
+
+    def get_quantities(self):
+        try:
+            items = get_cart_store().get_items(self.context["cart_id"])
+        except (Cart.DoesNotExist, ValueError, DjangoValidationError):
+            # save() fails the same way, and the view answers 404
+            return {}
+        return {item.product_id: item.quantity for item in items}
+
+    def save(self, **kwargs):
+        cart_id = self.context["cart_id"]
+        store = get_cart_store()
+
+        store.apply_operations(cart_id, self.validated_data["operations"])
+        self.instance = store.get(cart_id)
+
+        return self.instance
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ["quantity"]
 
+    def update(self, instance, validated_data):
+        return get_cart_store().set_quantity(
+            instance.cart_id, instance.id, validated_data["quantity"]
+        )
+
 
 class CustomerSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField(read_only=True)
@@ -163,6 +332,12 @@ class CustomerSerializer(serializers.ModelSerializer):
         fields = ["id", "user_id", "phone", "birth_date", "membership"]
 
 
+class CustomerStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerStats
+        fields = ["orders_count", "lifetime_spend", "last_order_at"]
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
 
@@ -189,20 +364,29 @@ class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        try:
+            self.cart_items = get_cart_store().get(cart_id).items.all()
+        except Cart.DoesNotExist:
             raise serializers.ValidationError("No cart with the given ID was found.")
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if len(self.cart_items) == 0:
             raise serializers.ValidationError("The cart is empty.")
         return cart_id
 
     def save(self, **kwargs):
         with transaction.atomic():
             cart_id = self.validated_data["cart_id"]
+            cart_items = self.cart_items
+
+            out_of_stock = Product.objects.reserve_inventory(
+                {item.product.id: item.quantity for item in cart_items}
+            )
+            if out_of_stock:
+                raise serializers.ValidationError(
+                    {"cart_id": [f"Not enough inventory for products: {out_of_stock}"]}
+                )
+
             customer = Customer.objects.get(user_id=self.context["user_id"])
             order = Order.objects.create(customer=customer)
-            cart_items = CartItem.objects.select_related("product").filter(
-                cart_id=cart_id
-            )
             order_items = [
                 OrderItem(
                     order=order,
@@ -214,7 +398,7 @@ class CreateOrderSerializer(serializers.Serializer):
             ]
 
             OrderItem.objects.bulk_create(order_items)
-            Cart.objects.filter(pk=cart_id).delete()
-            order_created.send_robust(self.__class__, order=order)
+            get_cart_store().delete(cart_id)
+            outbox.enqueue(outbox.ORDER_CREATED, order)
 
             return order
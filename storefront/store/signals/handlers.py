@@ -1,8 +1,25 @@
-from store.models import Customer
+from time import perf_counter
+
+from celery.signals import task_postrun, task_prerun
+
+from store import caching, images, metrics, search
+from store.models import (
+    Collection,
+    Customer,
+    CustomerStats,
+    Order,
+    OrderItem,
+    Product,
+    ProductImage,
+)
+from tags.models import TaggedItem
 
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 
 # signal handler
@@ -10,3 +27,125 @@ from django.dispatch import receiver
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs["created"]:
         Customer.objects.create(user=kwargs["instance"])
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, **kwargs):
+    previous_collection_id = getattr(instance, "_loaded_collection_id", None)
+    if created:
+        Collection.objects.adjust_products_count({instance.collection_id: 1})
+    elif previous_collection_id not in [None, instance.collection_id]:
+        Collection.objects.adjust_products_count(
+            {previous_collection_id: -1, instance.collection_id: 1}
+        )
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    Collection.objects.adjust_products_count({instance.collection_id: -1})
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_lists_for_product(sender, instance, **kwargs):
+    previous_collection_id = getattr(instance, "_loaded_collection_id", None)
+    caching.bump_versions_on_commit(instance.collection_id, previous_collection_id)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product_for_image(sender, instance, **kwargs):
+    # Images are part of the product representation: moving last_update keeps
+    # its Last-Modified/ETag honest, and the update invalidates the cached
+    # lists (see ProductQuerySet.update)
+    Product.objects.filter(pk=instance.product_id).update(last_update=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=TaggedItem)
+def touch_product_for_tag(sender, instance, **kwargs):
+    # Tags can be rendered with the product, same as images
+    if instance.content_type_id == ContentType.objects.get_for_model(Product).id:
+        Product.objects.filter(pk=instance.object_id).update(last_update=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_product_lists_for_collection(sender, instance, **kwargs):
+    caching.bump_versions_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {"title", "description"} & set(update_fields):
+        search.index_product(instance)
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_image_renditions(sender, instance, created, **kwargs):
+    if created:
+        from store.tasks import generate_image_renditions
+
+        # Without renditions the image is still served at its original URL,
+        # a broker error mustn't fail the upload that already committed
+        transaction.on_commit(
+            lambda: generate_image_renditions.delay(instance.id), robust=True
+        )
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_renditions(sender, instance, **kwargs):
+    # Only once the row is gone for good: a rollback keeps the image. A
+    # storage error then leaves orphaned files, not a failed delete
+    renditions = instance.renditions
+    transaction.on_commit(lambda: images.delete_renditions(renditions), robust=True)
+
+
+@receiver(post_save, sender=Order)
+def count_saved_order(sender, instance, created, **kwargs):
+    completed = Order.PAYMENT_STATUS_COMPLETED
+    previous_status = getattr(instance, "_loaded_payment_status", None)
+
+    spend = 0
+    if (instance.payment_status == completed) != (previous_status == completed):
+        total = Order.objects.filter(pk=instance.pk).total()
+        spend = total if instance.payment_status == completed else -total
+
+    if created:
+        CustomerStats.objects.adjust(
+            instance.customer_id, orders=1, spend=spend, placed_at=instance.placed_at
+        )
+    elif spend:
+        CustomerStats.objects.adjust(instance.customer_id, spend=spend)
+
+
+@receiver(post_delete, sender=Order)
+def count_deleted_order(sender, instance, **kwargs):
+    CustomerStats.objects.rebuild([instance.customer_id])
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def count_order_item(sender, instance, **kwargs):
+    # Items of paid orders are only edited by hand (e.g. in the admin), the
+    # checkout creates them with bulk_create before the payment completes
+    customer_id = (
+        Order.objects.filter(
+            pk=instance.order_id, payment_status=Order.PAYMENT_STATUS_COMPLETED
+        )
+        .values_list("customer_id", flat=True)
+        .first()
+    )
+    if customer_id is not None:
+        CustomerStats.objects.rebuild([customer_id])
+
+
+# Start times of the Celery tasks running in this process, by task id
+task_started = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id, **kwargs):
+    task_started[task_id] = perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id, task, state=None, **kwargs):
+    started = task_started.pop(task_id, None)
+    if started is not None:
+        metrics.observe_task(task.name, state or "UNKNOWN", perf_counter() - started)
@@ -0,0 +1,44 @@
+from celery import shared_task
+
+from . import images, outbox
+from .carts import get_cart_store
+from .models import ProductImage
+
+
+@shared_task
+def flush_carts():
+    """
+    Writes carts changed in the cart store to the database (write-behind).
+    """
+
+    return get_cart_store().flush()
+
+
+@shared_task
+def dispatch_outbox():
+    """
+    Delivers due outbox messages in batches, see store.outbox
+    """
+
+    dispatched = 0
+    while True:
+        claimed = outbox.dispatch_batch()
+        dispatched += claimed
+        if claimed < outbox.BATCH_SIZE:
+            return dispatched
+
+
+@shared_task
+def generate_image_renditions(product_image_id):
+    """
+    Generates the resized renditions of an uploaded product image.
+    """
+
+    product_image = ProductImage.objects.filter(pk=product_image_id).first()
+    if product_image is None:
+        return
+
+    previous = product_image.renditions
+    product_image.renditions = images.generate_renditions(product_image)
+    product_image.save(update_fields=["renditions"])
+    images.delete_renditions(previous)
@@ -1,9 +1,22 @@
+from contextlib import contextmanager
+
 import pytest
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework.test import APIClient
 
+from store.instrumentation import is_counted
+from storefront.celery import celery
+
+
+@pytest.fixture(autouse=True)
+def celery_eager():
+    # Run tasks in the test process instead of sending them to the broker
+    celery.conf.task_always_eager = True
+
 
 @pytest.fixture
 def api_client():
@@ -16,3 +29,33 @@ def authenticate(api_client):
         return api_client.force_authenticate(user=User(is_staff=is_staff))
 
     return do_authenticate
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Fails the test when the block runs more than `budget` queries, listing
+    the queries that were run:
+
+        with query_budget(3) as queries:
+            api_client.get("/store/orders/")
+    """
+
+    @contextmanager
+    def do_query_budget(budget):
+        queries = []
+        with CaptureQueriesContext(connection) as context:
+            yield queries
+
+        queries.extend(
+            query["sql"]
+            for query in context.captured_queries
+            if is_counted(query["sql"])
+        )
+        if len(queries) > budget:
+            pytest.fail(
+                f"Expected at most {budget} queries but {len(queries)} were run:\n\n"
+                + "\n\n".join(queries)
+            )
+
+    return do_query_budget
@@ -0,0 +1,164 @@
+"""
+Micro-benchmarks of the serializers and queries behind the main endpoints,
+each run on datasets of several sizes.
+
+Skipped unless pytest runs with `--benchmark-only` (see pytest.ini), e.g.
+`pytest --benchmark-only store/tests/test_benchmarks.py`. Besides the timings,
+every case records the number of queries and the peak of traced allocations
+of one extra (untimed) run in its extra_info. Save runs with
+`--benchmark-autosave` and compare commits with
+`pytest-benchmark compare --group-by=group`, or pass
+`--benchmark-compare --benchmark-compare-fail=mean:20%` to fail on a
+regression against the last saved run.
+"""
+
+import tracemalloc
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from model_bakery import baker
+
+from store.carts import get_cart_store
+from store.instrumentation import is_counted
+from store.listings import PRODUCT_FIELDS, product_rows
+from store.models import Collection, Product, ProductImage
+from store.serializers import (
+    CartSerializer,
+    CollectionSerializer,
+    CreateOrderSerializer,
+    ProductSerializer,
+)
+
+import pytest
+
+
+PAGE_SIZES = [10, 50, 100]
+CART_SIZES = [1, 10, 100, 500]
+ORDER_SIZES = [1, 10, 50]
+COLLECTION_COUNTS = [10, 100, 1000]
+# Order creation consumes its cart, each round gets a new one
+ORDER_ROUNDS = 10
+
+
+@pytest.fixture
+def measure(benchmark):
+    """
+    Benchmarks `function`, after recording the queries and peak allocations
+    of one run. `setup` returns the arguments of each call when a call can't
+    be repeated on the same data.
+    """
+
+    def do_measure(group, function, setup=None, rounds=ORDER_ROUNDS):
+        benchmark.group = group
+
+        args = setup() if setup else ()
+        with CaptureQueriesContext(connection) as context:
+            function(*args)
+        benchmark.extra_info["queries"] = sum(
+            is_counted(query["sql"]) for query in context.captured_queries
+        )
+
+        args = setup() if setup else ()
+        tracemalloc.start()
+        try:
+            function(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_kib"] = round(peak / 1024, 1)
+
+        if setup is None:
+            return benchmark(function)
+        return benchmark.pedantic(function, setup=lambda: (setup(), {}), rounds=rounds)
+
+    return do_measure
+
+
+@pytest.fixture(params=PAGE_SIZES)
+def product_page(request):
+    collection = baker.make(Collection)
+    products = baker.make(Product, collection=collection, _quantity=request.param)
+    for product in products:
+        baker.make(
+            ProductImage, product=product, image="store/images/photo.png", _quantity=2
+        )
+    return Product.objects.order_by("title", "id")[: request.param]
+
+
+@pytest.fixture
+def request_():
+    return APIRequestFactory().get("/store/products/")
+
+
+@pytest.mark.django_db
+def test_product_list_serializer(measure, product_page, request_):
+    def render():
+        queryset = product_page.prefetch_related("images")
+        data = ProductSerializer(queryset, many=True, context={"request": request_})
+        return JSONRenderer().render(data.data)
+
+    assert measure(f"product-list-{len(product_page)}", render)
+
+
+@pytest.mark.django_db
+def test_product_list_values(measure, product_page, request_):
+    def render():
+        rows = list(product_page.values(*PRODUCT_FIELDS))
+        return JSONRenderer().render(product_rows(rows, request_))
+
+    assert measure(f"product-list-{len(product_page)}", render)
+
+
+def make_cart(size):
+    store = get_cart_store()
+    cart = store.create()
+    for product in baker.make(
+        Product, unit_price=Decimal("9.99"), inventory=1000, _quantity=size
+    ):
+        store.add_item(cart.id, product.id, 2)
+    return cart.id
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("size", CART_SIZES)
+def test_cart_total(measure, size):
+    cart_id = make_cart(size)
+
+    def total():
+        return CartSerializer(get_cart_store().get(cart_id)).data["total_price"]
+
+    assert measure(f"cart-total-{size}", total) == size * 2 * Decimal("9.99")
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("size", ORDER_SIZES)
+def test_create_order(measure, size):
+    user = baker.make(settings.AUTH_USER_MODEL)
+
+    def create(cart_id):
+        serializer = CreateOrderSerializer(
+            data={"cart_id": cart_id}, context={"user_id": user.id}
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    order = measure(f"create-order-{size}", create, setup=lambda: (make_cart(size),))
+    assert order.items.count() == size
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("count", COLLECTION_COUNTS)
+def test_collection_list(measure, count):
+    baker.make(Collection, _quantity=count)
+
+    def render():
+        data = CollectionSerializer(Collection.objects.all(), many=True).data
+        return JSONRenderer().render(data)
+
+    assert measure(f"collection-list-{count}", render)
@@ -0,0 +1,337 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from rest_framework import status
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django_redis import get_redis_connection
+
+from model_bakery import baker
+
+from store.carts import get_cart_store
+from store.models import Cart, CartItem, Order, Product
+
+import pytest
+
+
+@pytest.fixture(
+    params=["store.carts.DatabaseCartStore", "store.carts.RedisCartStore"],
+    autouse=True,
+)
+def cart_store(request, settings):
+    if request.param.endswith("RedisCartStore"):
+        try:
+            get_redis_connection("default").ping()
+        except Exception:
+            pytest.skip("Redis is not available")
+
+    settings.CART_STORE = {"BACKEND": request.param}
+    return request.param
+
+
+@pytest.fixture
+def create_cart(api_client):
+    def do_create_cart():
+        return api_client.post("/store/carts/").data["id"]
+
+    return do_create_cart
+
+
+@pytest.fixture
+def add_to_cart(api_client):
+    def do_add_to_cart(cart_id, product_id, quantity=1):
+        return api_client.post(
+            f"/store/carts/{cart_id}/items/",
+            {"product_id": product_id, "quantity": quantity},
+        )
+
+    return do_add_to_cart
+
+
+class TestCarts:
+    @pytest.mark.django_db
+    def test_create_returns_an_empty_cart(self, api_client):
+        response = api_client.post("/store/carts/")
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data["items"] == []
+        assert response.data["total_price"] == 0
+
+    @pytest.mark.django_db
+    def test_adding_a_product_twice_adds_up_quantities(
+        self, api_client, create_cart, add_to_cart
+    ):
+        product = baker.make(Product, unit_price=10)
+        cart_id = create_cart()
+
+        add_to_cart(cart_id, product.id, 2)
+        response = add_to_cart(cart_id, product.id, 3)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data["quantity"] == 5
+        cart = api_client.get(f"/store/carts/{cart_id}/").data
+        assert cart["total_price"] == 50
+        assert [item["product"]["id"] for item in cart["items"]] == [product.id]
+
+    @pytest.mark.django_db
+    def test_if_product_does_not_exist_returns_400(self, create_cart, add_to_cart):
+        response = add_to_cart(create_cart(), 0)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["product_id"] is not None
+
+    @pytest.mark.django_db
+    def test_update_and_delete_item(self, api_client, create_cart, add_to_cart):
+        product = baker.make(Product, unit_price=10)
+        cart_id = create_cart()
+        item_id = add_to_cart(cart_id, product.id).data["id"]
+        url = f"/store/carts/{cart_id}/items/{item_id}/"
+
+        response = api_client.patch(url, {"quantity": 4})
+        assert response.status_code == status.HTTP_200_OK
+        assert api_client.get(url).data["total_price"] == 40
+
+        assert api_client.delete(url).status_code == status.HTTP_204_NO_CONTENT
+        assert api_client.get(f"/store/carts/{cart_id}/items/").data == []
+        assert api_client.get(url).status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.django_db
+    def test_if_cart_does_not_exist_returns_404(self, api_client, add_to_cart):
+        missing = "00000000-0000-0000-0000-000000000000"
+        product = baker.make(Product)
+
+        assert api_client.get(f"/store/carts/{missing}/").status_code == 404
+        assert api_client.delete(f"/store/carts/{missing}/").status_code == 404
+        assert add_to_cart(missing, product.id).status_code == 404
+
+    @pytest.mark.django_db
+    def test_checkout_turns_cart_into_order(
+        self, api_client, create_cart, add_to_cart, django_capture_on_commit_callbacks
+    ):
+        product = baker.make(Product, unit_price=10, inventory=10)
+        user = baker.make(settings.AUTH_USER_MODEL)
+        cart_id = create_cart()
+        add_to_cart(cart_id, product.id, 2)
+        api_client.force_authenticate(user=user)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post("/store/orders/", {"cart_id": cart_id})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["items"][0]["quantity"] == 2
+        assert Order.objects.filter(customer__user=user).exists()
+        assert api_client.get(f"/store/carts/{cart_id}/").status_code == 404
+
+    @pytest.mark.django_db
+    def test_flush_writes_carts_to_the_database(
+        self, cart_store, create_cart, add_to_cart
+    ):
+        product = baker.make(Product)
+        cart_id = create_cart()
+        add_to_cart(cart_id, product.id, 3)
+
+        get_cart_store().flush()
+
+        assert Cart.objects.filter(pk=cart_id).exists()
+        assert CartItem.objects.get(cart_id=cart_id).quantity == 3
+
+    @pytest.mark.django_db
+    def test_if_write_fails_carts_stay_dirty(
+        self, cart_store, create_cart, add_to_cart
+    ):
+        if not cart_store.endswith("RedisCartStore"):
+            pytest.skip("Only the Redis store writes behind")
+        product = baker.make(Product)
+        cart_ids = [create_cart(), create_cart()]
+        for cart_id in cart_ids:
+            add_to_cart(cart_id, product.id)
+        store = get_cart_store()
+        write_behind, failed = store.write_behind, []
+
+        def fail_once(cart_id):
+            if not failed:
+                failed.append(cart_id)
+                raise DatabaseError
+            write_behind(cart_id)
+
+        store.write_behind = fail_once
+        with pytest.raises(DatabaseError):
+            store.flush()
+        store.flush()
+
+        assert Cart.objects.filter(pk__in=cart_ids).count() == 2
+
+
+class TestBatchCartItems:
+    @pytest.mark.django_db
+    def test_operations_are_applied_in_order(
+        self, api_client, create_cart, add_to_cart
+    ):
+        kept, replaced, removed, added = baker.make(Product, unit_price=10, _quantity=4)
+        cart_id = create_cart()
+        add_to_cart(cart_id, kept.id, 1)
+        add_to_cart(cart_id, replaced.id, 1)
+        add_to_cart(cart_id, removed.id, 1)
+
+        response = api_client.post(
+            f"/store/carts/{cart_id}/items/batch/",
+            {
+                "operations": [
+                    {"operation": "set", "product_id": replaced.id, "quantity": 5},
+                    {"operation": "remove", "product_id": removed.id},
+                    {"product_id": added.id, "quantity": 2},
+                    {"operation": "add", "product_id": added.id, "quantity": 1},
+                ]
+            },
+            format="json",
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        quantities = {
+            item["product"]["id"]: item["quantity"] for item in response.data["items"]
+        }
+        assert quantities == {kept.id: 1, replaced.id: 5, added.id: 3}
+        assert response.data["total_price"] == 90
+
+    @pytest.mark.django_db
+    def test_if_a_product_does_not_exist_nothing_is_applied(
+        self, api_client, create_cart
+    ):
+        product = baker.make(Product)
+        cart_id = create_cart()
+
+        response = api_client.post(
+            f"/store/carts/{cart_id}/items/batch/",
+            {
+                "operations": [
+                    {"product_id": product.id, "quantity": 1},
+                    {"product_id": 0, "quantity": 1},
+                ]
+            },
+            format="json",
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert api_client.get(f"/store/carts/{cart_id}/items/").data == []
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize(
+        "operations",
+        [
+            [{"operation": "set", "quantity": 32_768}],
+            [{"quantity": 32_000}, {"quantity": 767}],
+        ],
+    )
+    def test_if_quantity_is_too_large_returns_400(
+        self, api_client, create_cart, add_to_cart, operations
+    ):
+        product = baker.make(Product)
+        cart_id = create_cart()
+        add_to_cart(cart_id, product.id, 1)
+
+        response = api_client.post(
+            f"/store/carts/{cart_id}/items/batch/",
+            {
+                "operations": [
+                    {"product_id": product.id, **operation} for operation in operations
+                ]
+            },
+            format="json",
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        [item] = api_client.get(f"/store/carts/{cart_id}/items/").data
+        assert item["quantity"] == 1
+
+    @pytest.mark.django_db
+    def test_if_cart_does_not_exist_returns_404(self, api_client):
+        product = baker.make(Product)
+
+        response = api_client.post(
+            "/store/carts/00000000-0000-0000-0000-000000000000/items/batch/",
+            {"operations": [{"product_id": product.id, "quantity": 1}]},
+            format="json",
+        )
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def read_modify_write(cart_id, product_id, quantity):
+    """
+    The add-to-cart implementation the upsert replaced, kept for comparison
+    """
+
+    try:
+        cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
+        cart_item.quantity += quantity
+        cart_item.save()
+    except CartItem.DoesNotExist:
+        CartItem.objects.create(
+            cart_id=cart_id, product_id=product_id, quantity=quantity
+        )
+
+
+def hammer(add, cart_id, product_id, threads, adds_per_thread):
+    """
+    Adds one item `threads * adds_per_thread` times from concurrent threads and
+    returns the adds per second.
+    """
+
+    def worker():
+        try:
+            for _ in range(adds_per_thread):
+                try:
+                    add(cart_id, product_id, 1)
+                except Exception:
+                    pass
+        finally:
+            connection.close()
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(worker) for _ in range(threads)]:
+            future.result()
+    return threads * adds_per_thread / (perf_counter() - start)
+
+
+class TestAddToCartConcurrency:
+    THREADS = 8
+    ADDS_PER_THREAD = 50
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_adds_are_not_lost(self, cart_store, capsys):
+        if cart_store.endswith("RedisCartStore"):
+            pytest.skip("Stresses the SQL upsert")
+        if connection.vendor == "sqlite":
+            pytest.skip("SQLite serializes writers")
+
+        expected = self.THREADS * self.ADDS_PER_THREAD
+        legacy_cart, upsert_cart = baker.make(Cart, _quantity=2)
+        product = baker.make(Product)
+
+        legacy_rate = hammer(
+            read_modify_write,
+            legacy_cart.id,
+            product.id,
+            self.THREADS,
+            self.ADDS_PER_THREAD,
+        )
+        upsert_rate = hammer(
+            CartItem.objects.add_quantity,
+            upsert_cart.id,
+            product.id,
+            self.THREADS,
+            self.ADDS_PER_THREAD,
+        )
+
+        legacy = CartItem.objects.filter(cart=legacy_cart).first()
+        upsert = CartItem.objects.get(cart=upsert_cart)
+        with capsys.disabled():
+            print(
+                f"\nread-modify-write: {legacy_rate:.0f} adds/s, "
+                f"{expected - (legacy.quantity if legacy else 0)} lost; "
+                f"upsert: {upsert_rate:.0f} adds/s, "
+                f"{expected - upsert.quantity} lost"
+            )
+        assert upsert.quantity == expected
@@ -1,10 +1,11 @@
 from rest_framework import status
 
 from django.contrib.auth.models import User
+from django.core.management import call_command
 
 from model_bakery import baker
 
-from store.models import Collection
+from store.models import Collection, Product
 
 import pytest
 
@@ -79,3 +80,90 @@ class TestRetrieveCollection:
             "title": collection.title,
             "products_count": 0,
         }
+
+
+def products_count(collection):
+    collection.refresh_from_db()
+    return collection.products_count
+
+
+class TestConditionalGet:
+    @pytest.mark.django_db(transaction=True)
+    def test_if_collections_are_unchanged_returns_304(self, api_client):
+        collection = baker.make(Collection)
+        etag = api_client.get("/store/collections/")["ETag"]
+
+        response = api_client.get("/store/collections/", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        baker.make(Product, collection=collection)
+        response = api_client.get("/store/collections/", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0]["products_count"] == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_if_counts_are_repaired_returns_200(self, api_client):
+        collection = baker.make(Collection)
+        Collection.objects.update(products_count=7)
+        etag = api_client.get("/store/collections/")["ETag"]
+
+        call_command("reconcile_products_count")
+
+        response = api_client.get("/store/collections/", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0]["products_count"] == 0
+
+
+class TestProductsCount:
+    @pytest.mark.django_db
+    def test_created_and_deleted_products_are_counted(self):
+        collection = baker.make(Collection)
+        first, second = baker.make(Product, collection=collection, _quantity=2)
+
+        assert products_count(collection) == 2
+
+        first.delete()
+
+        assert products_count(collection) == 1
+
+    @pytest.mark.django_db
+    def test_moved_product_is_counted_once(self):
+        source, target = baker.make(Collection, _quantity=2)
+        product = baker.make(Product, collection=source)
+
+        product.collection = target
+        product.save()
+        product.save()
+
+        assert products_count(source) == 0
+        assert products_count(target) == 1
+
+    @pytest.mark.django_db
+    def test_bulk_writes_are_counted(self):
+        source, target = baker.make(Collection, _quantity=2)
+        Product.objects.bulk_create(
+            baker.prepare(Product, collection=source, _quantity=3)
+        )
+        assert products_count(source) == 3
+
+        moved = list(Product.objects.values_list("pk", flat=True)[:2])
+        Product.objects.filter(pk__in=moved).update(collection=target)
+        assert products_count(source) == 1
+        assert products_count(target) == 2
+
+        products = list(Product.objects.all())
+        for product in products:
+            product.collection = source
+        Product.objects.bulk_update(products, ["collection"])
+        assert products_count(source) == 3
+        assert products_count(target) == 0
+
+    @pytest.mark.django_db
+    def test_reconcile_command_repairs_drift(self):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+        Collection.objects.update(products_count=7)
+
+        call_command("reconcile_products_count", batch_size=1)
+
+        assert products_count(collection) == 2
@@ -0,0 +1,164 @@
+from decimal import Decimal
+
+from rest_framework import status
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.management import call_command
+from django.db import connection
+
+from model_bakery import baker
+
+from store.models import CustomerStats, Order, OrderItem
+
+import pytest
+
+
+def make_customer():
+    return baker.make(settings.AUTH_USER_MODEL).customer
+
+
+def make_order(customer, totals=(), **kwargs):
+    order = baker.make(Order, customer=customer, **kwargs)
+    for total in totals:
+        baker.make(OrderItem, order=order, quantity=2, unit_price=Decimal(total) / 2)
+    return order
+
+
+def complete(order):
+    order.payment_status = Order.PAYMENT_STATUS_COMPLETED
+    order.save()
+
+
+class TestCustomerStats:
+    @pytest.mark.django_db
+    def test_new_orders_are_counted(self):
+        customer = make_customer()
+
+        first = make_order(customer)
+        second = make_order(customer)
+
+        stats = CustomerStats.objects.get(customer=customer)
+        assert stats.orders_count == 2
+        assert stats.last_order_at == second.placed_at
+        assert stats.last_order_at >= first.placed_at
+        assert stats.lifetime_spend == 0
+
+    @pytest.mark.django_db
+    def test_spend_follows_the_payment_status(self):
+        customer = make_customer()
+        order = Order.objects.get(pk=make_order(customer, totals=["10.00", "2.50"]).pk)
+
+        complete(order)
+        assert CustomerStats.objects.get(customer=customer).lifetime_spend == Decimal(
+            "12.50"
+        )
+
+        order.payment_status = Order.PAYMENT_STATUS_FAILED
+        order.save()
+        assert CustomerStats.objects.get(customer=customer).lifetime_spend == 0
+
+    @pytest.mark.django_db
+    def test_edited_items_of_paid_orders_are_counted(self):
+        customer = make_customer()
+        order = make_order(customer, totals=["4.00"])
+        complete(order)
+
+        item = order.items.get()
+        item.quantity = 4
+        item.save()
+
+        assert CustomerStats.objects.get(customer=customer).lifetime_spend == Decimal(
+            "8.00"
+        )
+
+    @pytest.mark.django_db
+    def test_rebuild_command_repairs_drift(self):
+        customer = make_customer()
+        order = make_order(customer, totals=["3.00"])
+        complete(order)
+        CustomerStats.objects.filter(customer=customer).delete()
+        idle = make_customer()
+
+        call_command("rebuild_customer_stats", batch_size=1)
+
+        stats = CustomerStats.objects.get(customer=customer)
+        assert (stats.orders_count, stats.lifetime_spend) == (1, Decimal("3.00"))
+        assert stats.last_order_at == order.placed_at
+        assert CustomerStats.objects.get(customer=idle).orders_count == 0
+
+    @pytest.mark.django_db
+    def test_rebuild_works_without_conflict_targets(self, monkeypatch):
+        # Like MySQL, where the upsert can't name the unique fields
+        monkeypatch.setattr(
+            connection.features, "supports_update_conflicts_with_target", False
+        )
+        customer = make_customer()
+        make_order(customer, totals=["3.00"])
+        CustomerStats.objects.filter(customer=customer).delete()
+
+        CustomerStats.objects.rebuild([customer.id])
+
+        assert CustomerStats.objects.get(customer=customer).orders_count == 1
+
+
+@pytest.fixture
+def get_history(api_client):
+    def do_get_history(customer, can_view=True):
+        user = baker.make(settings.AUTH_USER_MODEL)
+        if can_view:
+            user.user_permissions.add(Permission.objects.get(codename="view_history"))
+        api_client.force_authenticate(user=user)
+        return api_client.get(f"/store/customers/{customer.id}/history/")
+
+    return do_get_history
+
+
+class TestCustomerHistory:
+    @pytest.mark.django_db
+    def test_returns_stats_and_recent_orders_first(self, get_history):
+        customer = make_customer()
+        orders = [make_order(customer, totals=["5.00"]) for _ in range(12)]
+        complete(orders[0])
+
+        response = get_history(customer)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["stats"]["orders_count"] == 12
+        assert response.data["stats"]["lifetime_spend"] == Decimal("5.00")
+        assert [order["id"] for order in response.data["results"]] == [
+            order.id for order in reversed(orders[2:])
+        ]
+        assert response.data["next"]
+
+    @pytest.mark.django_db
+    def test_if_customer_has_no_orders_stats_are_empty(self, get_history):
+        response = get_history(make_customer())
+
+        assert response.data["stats"] == {
+            "orders_count": 0,
+            "lifetime_spend": Decimal("0"),
+            "last_order_at": None,
+        }
+        assert response.data["results"] == []
+
+    @pytest.mark.django_db
+    def test_if_user_lacks_permission_returns_403(self, get_history):
+        response = get_history(make_customer(), can_view=False)
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+class TestCustomerAdmin:
+    @pytest.mark.django_db
+    def test_changelist_sorts_and_filters_on_stored_stats(self, client):
+        admin = baker.make(settings.AUTH_USER_MODEL, is_staff=True, is_superuser=True)
+        client.force_login(admin)
+        frequent = make_customer()
+        for _ in range(5):
+            make_order(frequent)
+
+        response = client.get("/admin/store/customer/?orders=5%2B&o=4")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert list(response.context["cl"].result_list) == [frequent]
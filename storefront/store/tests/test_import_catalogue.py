@@ -0,0 +1,192 @@
+import json
+
+from django.core.management import CommandError, call_command
+
+from model_bakery import baker
+
+from store import feeds
+from store.models import Collection, Product, ProductImage, ProductSearchToken
+
+import pytest
+
+
+PRODUCTS_CSV = """slug,title,description,unit_price,inventory,collection
+bread,Bread,"Multigrain
+bread",2.50,10,Grocery
+soap,Soap,,3,5,Beauty
+tulips,Tulips,Red tulips,9.99,3,Flowers
+"""
+
+
+@pytest.fixture
+def write_feed(tmp_path):
+    def do_write_feed(name, content):
+        path = tmp_path / name
+        path.write_text(content)
+        return str(path)
+
+    return do_write_feed
+
+
+@pytest.fixture
+def import_feed(capsys):
+    def do_import_feed(kind, path, *args):
+        call_command("import_catalogue", kind, path, *args)
+        return capsys.readouterr()
+
+    return do_import_feed
+
+
+@pytest.fixture
+def collections(write_feed, import_feed):
+    path = write_feed("collections.csv", "title\nGrocery\nBeauty\nFlowers\n")
+    import_feed("collections", path)
+    return {collection.title: collection for collection in Collection.objects.all()}
+
+
+class TestImportCatalogue:
+    @pytest.mark.django_db
+    def test_products_are_created_and_counted(
+        self, collections, write_feed, import_feed
+    ):
+        path = write_feed("products.csv", PRODUCTS_CSV)
+
+        output = import_feed("products", path, "--batch-size", "2")
+
+        assert "Imported 3 products" in output.out
+        assert "rows/s" in output.out
+        bread = Product.objects.get(slug="bread")
+        assert bread.description == "Multigrain\nbread"
+        assert bread.collection == collections["Grocery"]
+        assert Collection.objects.get(title="Grocery").products_count == 1
+        assert ProductSearchToken.objects.filter(
+            product=bread, token="multigrain"
+        ).exists()
+
+    @pytest.mark.django_db
+    def test_products_are_upserted_on_slug(self, collections, write_feed, import_feed):
+        import_feed("products", write_feed("products.csv", PRODUCTS_CSV))
+        feed = [
+            {
+                "slug": "bread",
+                "title": "Bread",
+                "description": "Multigrain\nbread",
+                "unit_price": 2.5,
+                "inventory": 10,
+                "collection": "Grocery",
+            },
+            {
+                "slug": "soap",
+                "title": "Hand Soap",
+                "unit_price": "3.00",
+                "inventory": 8,
+                "collection": "Grocery",
+            },
+        ]
+        path = write_feed("products.ndjson", "\n".join(map(json.dumps, feed)))
+
+        output = import_feed("products", path)
+
+        assert "0 created, 1 updated, 1 unchanged, 0 skipped" in output.out
+        assert Product.objects.count() == 3
+        soap = Product.objects.get(slug="soap")
+        assert (soap.title, soap.inventory) == ("Hand Soap", 8)
+        assert Collection.objects.get(title="Grocery").products_count == 2
+        assert Collection.objects.get(title="Beauty").products_count == 0
+
+    @pytest.mark.django_db
+    def test_invalid_records_are_skipped(self, collections, write_feed, import_feed):
+        path = write_feed(
+            "products.csv",
+            PRODUCTS_CSV + "cheap,Cheap,,0.50,1,Grocery\n" + "lost,Lost,,5,1,Unknown\n",
+        )
+
+        output = import_feed("products", path)
+
+        assert "3 created, 0 updated, 0 unchanged, 2 skipped" in output.out
+        assert "unit_price" in output.err
+        assert not Product.objects.filter(slug__in=["cheap", "lost"]).exists()
+
+    @pytest.mark.django_db
+    def test_images_are_attached_once(
+        self, write_feed, import_feed, django_capture_on_commit_callbacks, monkeypatch
+    ):
+        scheduled = []
+        monkeypatch.setattr(
+            "store.tasks.generate_image_renditions.delay", scheduled.append
+        )
+        product = baker.make(Product, slug="bread")
+        path = write_feed(
+            "images.csv",
+            "product,image\nbread,store/images/a.png\nbread,store/images/b.png\n"
+            "missing,store/images/c.png\n",
+        )
+
+        with django_capture_on_commit_callbacks(execute=True):
+            import_feed("images", path)
+            output = import_feed("images", path)
+
+        assert "0 created, 0 updated, 2 unchanged, 1 skipped" in output.out
+        images = ProductImage.objects.filter(product=product)
+        assert sorted(images.values_list("image", flat=True)) == [
+            "store/images/a.png",
+            "store/images/b.png",
+        ]
+        assert sorted(scheduled) == sorted(image.id for image in images)
+
+    @pytest.mark.django_db
+    def test_if_broker_is_down_images_are_still_attached(
+        self, write_feed, import_feed, django_capture_on_commit_callbacks, monkeypatch
+    ):
+        def delay(*args, **kwargs):
+            raise ConnectionError("Broker is down")
+
+        monkeypatch.setattr("store.tasks.generate_image_renditions.delay", delay)
+        product = baker.make(Product, slug="bread")
+        path = write_feed("images.csv", "product,image\nbread,store/images/a.png\n")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            output = import_feed("images", path)
+
+        assert "1 created" in output.out
+        assert ProductImage.objects.filter(product=product).exists()
+
+    @pytest.mark.django_db
+    def test_interrupted_import_resumes_after_the_last_batch(
+        self, collections, write_feed, import_feed, monkeypatch
+    ):
+        path = write_feed("products.csv", PRODUCTS_CSV)
+        upsert = feeds.ProductImporter.upsert
+        calls = []
+
+        def failing_upsert(self, products):
+            calls.append([product["slug"] for product in products])
+            if len(calls) == 2:
+                raise RuntimeError("Connection lost")
+            return upsert(self, products)
+
+        monkeypatch.setattr(feeds.ProductImporter, "upsert", failing_upsert)
+        with pytest.raises(RuntimeError):
+            import_feed("products", path, "--batch-size", "1")
+        assert list(Product.objects.values_list("slug", flat=True)) == ["bread"]
+
+        output = import_feed("products", path, "--batch-size", "1", "--resume")
+
+        assert "Imported 2 products" in output.out
+        assert calls[2:] == [["soap"], ["tulips"]]
+        assert Product.objects.count() == 3
+
+    @pytest.mark.django_db
+    def test_if_feed_changed_resume_is_refused(
+        self, collections, write_feed, import_feed, monkeypatch
+    ):
+        path = write_feed("products.csv", PRODUCTS_CSV)
+        monkeypatch.setattr(
+            feeds.ProductImporter, "upsert", lambda self, products: 1 / 0
+        )
+        with pytest.raises(ZeroDivisionError):
+            import_feed("products", path)
+        write_feed("products.csv", PRODUCTS_CSV + "mint,Mint,,2,1,Grocery\n")
+
+        with pytest.raises(CommandError):
+            import_feed("products", path, "--resume")
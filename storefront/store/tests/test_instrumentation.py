@@ -0,0 +1,121 @@
+import logging
+
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from model_bakery import baker
+
+from store import instrumentation
+from store.instrumentation import QueryInstrumentationMiddleware
+from store.models import Collection, Product
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def sample_everything(settings):
+    settings.QUERY_INSTRUMENTATION = {
+        "SAMPLE_RATE": 1,
+        "DEFAULT_BUDGET": 20,
+        "BUDGETS": {"ProductViewSet.list": 5},
+        "REPEATED_QUERY_THRESHOLD": 3,
+    }
+    instrumentation.reset_stats()
+    yield
+    instrumentation.reset_stats()
+
+
+def run_middleware(path, view, method="get"):
+    request = getattr(RequestFactory(), method)(path)
+    request.resolver_match = resolve(path)
+    return QueryInstrumentationMiddleware(lambda request: view())(request)
+
+
+class TestFingerprint:
+    def test_literals_and_placeholder_lists_are_collapsed(self):
+        first = instrumentation.fingerprint(
+            "SELECT * FROM a WHERE id IN (%s, %s) AND title = 'x' LIMIT 21"
+        )
+        second = instrumentation.fingerprint(
+            "SELECT * FROM a WHERE id IN (%s, %s, %s) AND title = 'y' LIMIT 1"
+        )
+
+        assert (
+            first == second == "SELECT * FROM a WHERE id IN (...) AND title = ? LIMIT ?"
+        )
+
+
+class TestQueryInstrumentation:
+    @pytest.mark.django_db
+    def test_records_queries_per_viewset_action(self, api_client):
+        baker.make(Product, _quantity=2)
+
+        api_client.get("/store/products/")
+        api_client.get("/store/products/")
+        api_client.get("/store/collections/")
+
+        stats = instrumentation.get_stats()
+        assert set(stats) == {"ProductViewSet.list", "CollectionViewSet.list"}
+        assert stats["ProductViewSet.list"][instrumentation.REQUESTS] == 2
+        assert stats["ProductViewSet.list"][instrumentation.QUERIES] > 0
+        assert stats["ProductViewSet.list"][instrumentation.OVER_BUDGET] == 0
+
+    @pytest.mark.django_db
+    def test_detects_repeated_queries(self, caplog):
+        collections = baker.make(Collection, _quantity=4)
+
+        def view():
+            for collection in collections:
+                Collection.objects.get(pk=collection.pk)
+            return HttpResponse()
+
+        with caplog.at_level(logging.WARNING, logger="store.instrumentation"):
+            run_middleware(f"/store/collections/{collections[0].pk}/", view)
+
+        stats = instrumentation.get_stats()["CollectionViewSet.retrieve"]
+        assert stats[instrumentation.N_PLUS_ONE] == 1
+        sql, count = stats["repeated"]
+        assert count == 4 and "store_collection" in sql
+        [record] = caplog.records
+        assert record.endpoint == "CollectionViewSet.retrieve"
+        assert list(record.repeated_queries.values()) == [4]
+
+    @pytest.mark.django_db
+    def test_warns_when_an_endpoint_exceeds_its_budget(self, caplog):
+        def view():
+            for _ in range(6):
+                Product.objects.exists()
+                Collection.objects.exists()
+            return HttpResponse()
+
+        with caplog.at_level(logging.WARNING, logger="store.instrumentation"):
+            run_middleware("/store/products/", view)
+
+        [record] = caplog.records
+        assert (record.endpoint, record.queries, record.budget) == (
+            "ProductViewSet.list",
+            12,
+            5,
+        )
+        stats = instrumentation.get_stats()["ProductViewSet.list"]
+        assert stats[instrumentation.OVER_BUDGET] == 1
+
+    @pytest.mark.django_db
+    def test_requests_that_arent_sampled_are_not_recorded(self, api_client, settings):
+        settings.QUERY_INSTRUMENTATION = {"SAMPLE_RATE": 0}
+
+        api_client.get("/store/products/")
+
+        assert instrumentation.get_stats() == {}
+
+    @pytest.mark.django_db
+    def test_command_prints_the_stats(self, api_client, capsys):
+        api_client.get("/store/products/")
+
+        call_command("query_stats", "--reset")
+
+        output = capsys.readouterr().out
+        assert output.startswith("ProductViewSet.list: 1 requests")
+        assert instrumentation.get_stats() == {}
@@ -0,0 +1,261 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from rest_framework import status
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import DatabaseError, connection
+from django_redis import get_redis_connection
+
+from model_bakery import baker
+
+from likes import counters
+from likes.models import LikeCount, LikedItem
+from likes.tasks import flush_like_counts, reconcile_like_counts
+from store.models import Product
+
+import pytest
+
+
+def clear_likes(redis):
+    keys = list(redis.scan_iter("likes:*"))
+    if keys:
+        redis.delete(*keys)
+
+
+@pytest.fixture(autouse=True)
+def redis():
+    redis = get_redis_connection("default")
+    try:
+        redis.ping()
+    except Exception:
+        pytest.skip("Redis is not available")
+
+    # Counters and dirty members left by other tests name rolled back rows
+    clear_likes(redis)
+    yield redis
+    clear_likes(redis)
+
+
+@pytest.fixture
+def like(api_client):
+    def do_like(product, user=None, method="post"):
+        user = user or baker.make(settings.AUTH_USER_MODEL)
+        api_client.force_authenticate(user=user)
+        return getattr(api_client, method)(f"/store/products/{product.id}/like/")
+
+    return do_like
+
+
+def product_key(product):
+    return counters.key(ContentType.objects.get_for_model(Product).id)
+
+
+# The counters move once the likes are committed, so tests reading them back
+# run in transaction mode
+class TestLikeProduct:
+    @pytest.mark.django_db(transaction=True)
+    def test_if_user_is_anonymous_returns_401(self, api_client):
+        product = baker.make(Product)
+
+        response = api_client.post(f"/store/products/{product.id}/like/")
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    @pytest.mark.django_db(transaction=True)
+    def test_if_product_does_not_exist_returns_404(self, like):
+        response = like(Product(id=0))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.django_db(transaction=True)
+    def test_liking_twice_counts_once(self, like):
+        product = baker.make(Product)
+        user = baker.make(settings.AUTH_USER_MODEL)
+
+        like(product, user)
+        response = like(product, user)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {"liked": True, "likes": 1}
+        assert LikedItem.objects.count() == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_unliking_twice_uncounts_once(self, like):
+        product = baker.make(Product)
+        user = baker.make(settings.AUTH_USER_MODEL)
+        like(product)
+        like(product, user)
+
+        like(product, user, method="delete")
+        response = like(product, user, method="delete")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {"liked": False, "likes": 1}
+
+    @pytest.mark.django_db(transaction=True)
+    def test_counters_are_seeded_from_existing_likes(self, like):
+        product = baker.make(Product)
+        for user in baker.make(settings.AUTH_USER_MODEL, _quantity=3):
+            baker.make(LikedItem, user=user, content_object=product)
+
+        response = like(product)
+
+        assert response.data["likes"] == 4
+
+
+class TestListLikes:
+    @pytest.mark.django_db(transaction=True)
+    def test_likes_are_only_listed_when_included(self, api_client, like):
+        liked, other = baker.make(Product, _quantity=2)
+        like(liked)
+        like(liked)
+
+        assert "likes" not in api_client.get("/store/products/").data["results"][0]
+        response = api_client.get("/store/products/?include=likes")
+        assert {
+            product["id"]: product["likes"] for product in response.data["results"]
+        } == {liked.id: 2, other.id: 0}
+
+    @pytest.mark.django_db(transaction=True)
+    def test_listed_likes_are_never_cached(self, api_client, like):
+        product = baker.make(Product)
+        api_client.get("/store/products/?include=likes")
+
+        like(product)
+        response = api_client.get("/store/products/?include=likes")
+
+        assert "X-Cache" not in response
+        assert "ETag" not in response
+        assert response.data["results"][0]["likes"] == 1
+
+    @pytest.mark.django_db
+    def test_a_page_of_likes_takes_one_query_once_seeded(
+        self, api_client, settings, query_budget
+    ):
+        settings.CATALOGUE_CACHE_ENABLED = False
+        baker.make(Product, _quantity=5)
+        api_client.get("/store/products/?include=likes")
+
+        # Page, count and images
+        with query_budget(3):
+            api_client.get("/store/products/?include=likes")
+
+    @pytest.mark.django_db(transaction=True)
+    def test_fast_reads_render_the_same_likes(self, api_client, settings, like):
+        like(baker.make(Product))
+        api_client.force_authenticate(user=None)
+
+        settings.CATALOGUE_FAST_READS = False
+        expected = api_client.get("/store/products/?include=likes,tags")
+        settings.CATALOGUE_FAST_READS = True
+        response = api_client.get("/store/products/?include=likes,tags")
+
+        assert response.content == expected.content
+
+
+class TestLikeCounters:
+    @pytest.mark.django_db(transaction=True)
+    def test_flush_writes_changed_counters(self, like):
+        product = baker.make(Product)
+        like(product)
+        like(product)
+
+        assert flush_like_counts.delay().get() == 1
+        assert LikeCount.objects.get(object_id=product.id).count == 2
+        assert flush_like_counts.delay().get() == 0
+
+    @pytest.mark.django_db(transaction=True)
+    def test_if_write_fails_counters_stay_dirty(self, like, monkeypatch):
+        product = baker.make(Product)
+        like(product)
+
+        def fail(counts):
+            raise DatabaseError
+
+        with monkeypatch.context() as patch:
+            patch.setattr(counters, "write_counts", fail)
+            with pytest.raises(DatabaseError):
+                counters.flush()
+
+        assert counters.flush() == 1
+        assert LikeCount.objects.get(object_id=product.id).count == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_flush_works_without_conflict_targets(self, like, monkeypatch):
+        # Like MySQL, where the upsert can't name the unique fields
+        monkeypatch.setattr(
+            connection.features, "supports_update_conflicts_with_target", False
+        )
+        product = baker.make(Product)
+        like(product)
+
+        assert flush_like_counts.delay().get() == 1
+        assert LikeCount.objects.get(object_id=product.id).count == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_reconcile_repairs_drift(self, like):
+        product, lost = baker.make(Product, _quantity=2)
+        like(product)
+        like(lost)
+        flush_like_counts.delay().get()
+        get_redis_connection("default").hset(product_key(product), product.id, 7)
+        get_redis_connection("default").hdel(product_key(lost), lost.id)
+        LikedItem.objects.filter(object_id=lost.id).delete()
+
+        assert reconcile_like_counts.delay().get() == 1
+        assert LikedItem.objects.counts_for(Product, [product.id, lost.id]) == {
+            product.id: 1,
+            lost.id: 0,
+        }
+        assert list(LikeCount.objects.values_list("object_id", "count")) == [
+            (product.id, 1)
+        ]
+
+
+class TestLikeConcurrency:
+    THREADS = 32
+    LIKES = 3000
+
+    @pytest.mark.django_db
+    def test_simultaneous_increments_are_not_lost(self):
+        product = baker.make(Product)
+        content_type_id = ContentType.objects.get_for_model(Product).id
+        counters.seed(content_type_id, [product.id])
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            list(
+                executor.map(
+                    lambda _: counters.add(content_type_id, product.id, 1),
+                    range(self.LIKES),
+                )
+            )
+
+        assert LikedItem.objects.counts_for(Product, [product.id]) == {
+            product.id: self.LIKES
+        }
+        counters.flush()
+        assert LikeCount.objects.get(object_id=product.id).count == self.LIKES
+
+    @pytest.mark.django_db(transaction=True)
+    def test_simultaneous_likes_are_counted_once_per_user(self):
+        if connection.vendor == "sqlite":
+            pytest.skip("SQLite serializes writers")
+
+        product = baker.make(Product)
+        users = baker.make(settings.AUTH_USER_MODEL, _quantity=self.LIKES)
+
+        def like_twice(user):
+            try:
+                LikedItem.objects.like(user, product)
+                LikedItem.objects.like(user, product)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            list(executor.map(like_twice, users))
+
+        assert LikedItem.objects.count() == self.LIKES
+        assert LikedItem.objects.counts_for(Product, [product.id]) == {
+            product.id: self.LIKES
+        }
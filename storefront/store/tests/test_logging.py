@@ -0,0 +1,215 @@
+import json
+import logging
+import logging.config
+import threading
+import time
+
+from model_bakery import baker
+
+from store.models import Collection
+from storefront.logs import JSONFormatter, QueueHandler, SamplingFilter
+
+import pytest
+
+
+# Time the slow handler takes per record, like a disk or socket that stalls
+SINK_DELAY = 0.02
+
+
+class SlowHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        # Holds back emit() while cleared, for a second at most
+        self.released = threading.Event()
+        self.released.set()
+
+    def emit(self, record):
+        self.released.wait(timeout=1)
+        time.sleep(SINK_DELAY)
+        self.records.append(record)
+
+
+@pytest.fixture
+def sink():
+    handler = SlowHandler()
+    yield handler
+    handler.close()
+
+
+@pytest.fixture
+def queue_handler(sink):
+    handlers = []
+
+    def make_queue_handler(maxsize=100):
+        handler = QueueHandler(handlers=[sink], maxsize=maxsize)
+        handlers.append(handler)
+        return handler
+
+    yield make_queue_handler
+    for handler in handlers:
+        handler.stop()
+        handler.close()
+
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger("store.tests.logging")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger
+    logger.handlers.clear()
+
+
+def make_record(name="store", level=logging.INFO, **extra):
+    return logging.makeLogRecord(
+        {
+            "name": name,
+            "levelno": level,
+            "levelname": logging.getLevelName(level),
+            "msg": "Hello %s",
+            "args": ("world",),
+            **extra,
+        }
+    )
+
+
+class TestQueueHandler:
+    def test_records_are_written_by_the_listener(self, logger, queue_handler, sink):
+        handler = queue_handler()
+        logger.addHandler(handler)
+
+        logger.info("Hello %s", "world")
+        handler.stop()
+
+        assert [record.getMessage() for record in sink.records] == ["Hello world"]
+
+    def test_handlers_are_resolved_like_in_the_settings(self, sink):
+        # As dictConfig passes them, after configuring the target handlers
+        configurator = logging.config.DictConfigurator(
+            {
+                "handlers": {
+                    "sink": sink,
+                    "queue": {"handlers": ["cfg://handlers.sink"], "maxsize": 10},
+                }
+            }
+        )
+
+        config = configurator.config["handlers"]["queue"]
+        handler = QueueHandler(**{name: config[name] for name in config})
+
+        assert handler.targets == [sink]
+        handler.close()
+
+    def test_logging_does_not_wait_for_the_handlers(self, logger, queue_handler, sink):
+        handler = queue_handler()
+        logger.addHandler(handler)
+        sink.released.clear()
+
+        for _ in range(10):
+            logger.info("Hello")
+
+        assert sink.records == []
+        sink.released.set()
+        handler.stop()
+        assert len(sink.records) == 10
+
+    def test_if_queue_is_full_records_are_dropped_and_reported(
+        self, logger, queue_handler, sink
+    ):
+        handler = queue_handler(maxsize=2)
+        logger.addHandler(handler)
+
+        for _ in range(5):
+            logger.info("Hello")
+        assert handler.dropped > 0
+        # Lets the listener empty the queue
+        time.sleep(SINK_DELAY * 6)
+        logger.info("Hello")
+        handler.stop()
+
+        reports = [record for record in sink.records if hasattr(record, "dropped")]
+        assert sum(record.dropped for record in reports) == handler.dropped
+
+    def test_traceback_is_kept_apart_from_message(self, logger, queue_handler, sink):
+        handler = queue_handler()
+        logger.addHandler(handler)
+
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("Failed")
+        handler.stop()
+
+        [record] = sink.records
+        assert record.getMessage() == "Failed"
+        assert "ZeroDivisionError" in record.exc_text
+
+
+class TestSamplingFilter:
+    def test_info_records_are_sampled(self, monkeypatch):
+        sampling = SamplingFilter(rates={"playground": 0.1})
+        monkeypatch.setattr("random.random", lambda: 0.5)
+
+        assert not sampling.filter(make_record("playground.views"))
+        assert sampling.filter(make_record("store.views"))
+
+    def test_warnings_are_always_kept(self):
+        sampling = SamplingFilter(rates={"playground": 0})
+
+        assert sampling.filter(make_record("playground.views", logging.WARNING))
+
+
+class TestJSONFormatter:
+    def test_includes_message_and_extra_fields(self):
+        data = json.loads(JSONFormatter().format(make_record(endpoint="A.list")))
+
+        assert data["message"] == "Hello world"
+        assert data["level"] == "INFO"
+        assert data["logger"] == "store"
+        assert data["endpoint"] == "A.list"
+        assert "exception" not in data
+
+
+@pytest.fixture
+def log_every_request(settings):
+    # Every request goes over its query budget and logs a warning
+    settings.QUERY_INSTRUMENTATION = {
+        **settings.QUERY_INSTRUMENTATION,
+        "SAMPLE_RATE": 1,
+        "DEFAULT_BUDGET": 0,
+        "BUDGETS": {},
+    }
+    logger = logging.getLogger("store.instrumentation")
+    logger.propagate = False
+    yield logger
+    logger.handlers.clear()
+    logger.disabled = False
+    logger.propagate = True
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("mode", ["off", "queued", "blocking"])
+def test_request_latency(
+    benchmark, api_client, queue_handler, sink, log_every_request, mode
+):
+    """
+    Latency of a request logging a warning, with logging off and with a slow
+    handler behind the queue or called directly (for comparison): the first
+    two should be the same.
+    """
+
+    baker.make(Collection, _quantity=5)
+    if mode == "off":
+        log_every_request.disabled = True
+    elif mode == "queued":
+        log_every_request.addHandler(queue_handler(maxsize=10_000))
+    else:
+        log_every_request.addHandler(sink)
+
+    benchmark.group = "request-logging"
+    response = benchmark(api_client.get, "/store/collections/")
+
+    assert response.status_code == 200
+    if mode == "blocking":
+        assert sink.records
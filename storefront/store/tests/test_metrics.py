@@ -0,0 +1,159 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from rest_framework import status
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.base import BaseHandler
+from django.test import AsyncClient
+
+from model_bakery import baker
+from prometheus_client import REGISTRY
+
+from playground.tasks import notify_customers
+from store.models import Collection, Product
+from storefront.settings import common
+
+import pytest
+
+
+def get_sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def get_metrics(client):
+    def do_get_metrics(**headers):
+        return client.get("/metrics", headers=headers)
+
+    return do_get_metrics
+
+
+class TestMetricsEndpoint:
+    @pytest.mark.django_db
+    def test_if_user_is_anonymous_returns_403(self, get_metrics):
+        response = get_metrics()
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.django_db
+    def test_if_user_is_staff_returns_prometheus_text(self, client, get_metrics):
+        client.force_login(baker.make(settings.AUTH_USER_MODEL, is_staff=True))
+        client.get("/store/products/")
+
+        response = get_metrics()
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"].startswith("text/plain")
+        assert (
+            'storefront_request_duration_seconds_count{endpoint="ProductViewSet.list",'
+            'method="GET",status="200"}'
+        ) in response.content.decode()
+
+    @pytest.mark.django_db
+    def test_bearer_token_is_checked(self, get_metrics, settings):
+        settings.METRICS_TOKEN = "secret"
+
+        assert get_metrics(Authorization="Bearer secret").status_code == 200
+        assert get_metrics(Authorization="Bearer wrong").status_code == 403
+
+
+class TestMetrics:
+    @pytest.mark.django_db
+    def test_requests_are_timed_per_action_and_status(self, api_client):
+        labels = {"endpoint": "ProductViewSet.retrieve", "method": "GET"}
+        before = get_sample(
+            "storefront_request_duration_seconds_count", status="404", **labels
+        )
+
+        api_client.get("/store/products/0/")
+
+        after = get_sample(
+            "storefront_request_duration_seconds_count", status="404", **labels
+        )
+        assert after == before + 1
+
+    @pytest.mark.django_db
+    def test_database_queries_are_counted(self, api_client):
+        baker.make(Product)
+        before = get_sample(
+            "storefront_db_queries_total", endpoint="ProductViewSet.retrieve"
+        )
+
+        api_client.get(f"/store/products/{Product.objects.get().id}/")
+
+        after = get_sample(
+            "storefront_db_queries_total", endpoint="ProductViewSet.retrieve"
+        )
+        assert after > before
+
+    @pytest.mark.django_db
+    def test_cache_hits_and_misses_are_counted(self, api_client):
+        cache.clear()
+        hits = get_sample("storefront_cache_requests_total", result="hits")
+        misses = get_sample("storefront_cache_requests_total", result="misses")
+
+        api_client.get("/store/products/")
+        api_client.get("/store/products/")
+
+        assert get_sample("storefront_cache_requests_total", result="hits") == hits + 1
+        assert (
+            get_sample("storefront_cache_requests_total", result="misses") == misses + 1
+        )
+
+    @pytest.mark.django_db
+    def test_celery_tasks_are_timed(self):
+        labels = {"task": "playground.tasks.notify_customers", "state": "SUCCESS"}
+        before = get_sample("storefront_celery_task_duration_seconds_count", **labels)
+
+        notify_customers.delay("Hello")
+
+        after = get_sample("storefront_celery_task_duration_seconds_count", **labels)
+        assert after == before + 1
+
+
+class TestAsyncRequests:
+    def test_middleware_runs_async_requests_without_threads(self, settings, caplog):
+        # The dev settings add the profiling middleware, which is sync-only
+        settings.MIDDLEWARE = [
+            name
+            for name in common.MIDDLEWARE
+            if not name.startswith(("silk.", "debug_toolbar."))
+        ]
+        # Django only logs the adaptations in debug mode
+        settings.DEBUG = True
+
+        with caplog.at_level(logging.DEBUG, logger="django.request"):
+            BaseHandler().load_middleware(is_async=True)
+
+        assert [
+            record.getMessage()
+            for record in caplog.records
+            if "adapted" in record.getMessage()
+        ] == []
+
+    @pytest.mark.django_db
+    def test_async_requests_are_timed_and_their_queries_counted(self):
+        baker.make(Collection)
+        labels = {"endpoint": "CollectionViewSet.list", "method": "GET"}
+        requests = get_sample(
+            "storefront_request_duration_seconds_count", status="200", **labels
+        )
+        queries = get_sample(
+            "storefront_db_queries_total", endpoint="CollectionViewSet.list"
+        )
+
+        response = async_to_sync(AsyncClient().get)("/store/collections/")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert (
+            get_sample(
+                "storefront_request_duration_seconds_count", status="200", **labels
+            )
+            == requests + 1
+        )
+        assert (
+            get_sample("storefront_db_queries_total", endpoint="CollectionViewSet.list")
+            > queries
+        )
@@ -0,0 +1,310 @@
+import csv
+import io
+import json
+
+from rest_framework import status
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from model_bakery import baker
+
+from store import exports, outbox
+from store.models import Cart, CartItem, Order, OrderItem, OutboxMessage, Product
+from store.signals import order_created
+from store.tasks import dispatch_outbox
+
+import pytest
+
+
+@pytest.fixture
+def checkout(api_client):
+    def do_checkout(cart):
+        user = baker.make(settings.AUTH_USER_MODEL)
+        api_client.force_authenticate(user=user)
+        return api_client.post("/store/orders/", {"cart_id": cart.id})
+
+    return do_checkout
+
+
+class TestCreateOrder:
+    @pytest.mark.django_db
+    def test_products_are_locked_in_id_order_before_the_update(self):
+        products = baker.make(Product, inventory=5, _quantity=3)
+
+        with CaptureQueriesContext(connection) as context:
+            Product.objects.reserve_inventory(
+                {product.id: 1 for product in reversed(products)}
+            )
+
+        queries = [query["sql"] for query in context.captured_queries]
+        lock = next(index for index, sql in enumerate(queries) if "ORDER BY" in sql)
+        update = next(index for index, sql in enumerate(queries) if "UPDATE" in sql)
+        assert lock < update
+        order_by = queries[lock].partition("ORDER BY")[2]
+        assert order_by.split()[0].endswith(connection.ops.quote_name("id"))
+
+    @pytest.mark.django_db
+    def test_checkout_reserves_inventory(self, checkout):
+        product = baker.make(Product, inventory=5)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=3)
+
+        response = checkout(cart)
+
+        assert response.status_code == status.HTTP_200_OK
+        product.refresh_from_db()
+        assert product.inventory == 2
+
+    @pytest.mark.django_db
+    def test_if_stock_is_short_order_is_rejected(self, checkout):
+        in_stock = baker.make(Product, inventory=5)
+        short = baker.make(Product, inventory=1)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=in_stock, quantity=3)
+        baker.make(CartItem, cart=cart, product=short, quantity=2)
+
+        response = checkout(cart)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert str(short.id) in str(response.data["cart_id"])
+        assert Product.objects.get(pk=in_stock.id).inventory == 5
+        assert Product.objects.get(pk=short.id).inventory == 1
+        assert Cart.objects.filter(pk=cart.id).exists()
+        assert not Order.objects.exists()
+
+
+def make_orders(quantity):
+    user = baker.make(settings.AUTH_USER_MODEL)
+    return baker.make(Order, customer=user.customer, _quantity=quantity)
+
+
+@pytest.fixture
+def receiver():
+    received = []
+
+    def on_order_created(sender, **kwargs):
+        received.append(kwargs["order"])
+
+    order_created.connect(on_order_created)
+    yield received
+    order_created.disconnect(on_order_created)
+
+
+@pytest.fixture
+def failing_receiver():
+    def on_order_created(sender, **kwargs):
+        raise RuntimeError("ERP is down")
+
+    order_created.connect(on_order_created)
+    yield
+    order_created.disconnect(on_order_created)
+
+
+class TestOrderCreatedOutbox:
+    @pytest.mark.django_db
+    def test_receivers_run_after_commit(
+        self, checkout, receiver, django_capture_on_commit_callbacks
+    ):
+        product = baker.make(Product, inventory=5)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=1)
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            response = checkout(cart)
+
+            assert receiver == []
+            assert OutboxMessage.objects.get().payload == {"id": response.data["id"]}
+
+        for callback in callbacks:
+            callback()
+
+        assert [order.id for order in receiver] == [response.data["id"]]
+        assert OutboxMessage.objects.get().dispatched_at is not None
+
+    @pytest.mark.django_db(transaction=True)
+    def test_if_broker_is_down_checkout_succeeds(self, checkout, monkeypatch):
+        def delay(*args, **kwargs):
+            raise ConnectionError("Broker is down")
+
+        monkeypatch.setattr(dispatch_outbox, "delay", delay)
+        product = baker.make(Product, inventory=5)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=1)
+
+        response = checkout(cart)
+
+        assert response.status_code == status.HTTP_200_OK
+        # Left for the beat sweep
+        assert OutboxMessage.objects.get().dispatched_at is None
+
+    @pytest.mark.django_db
+    def test_failed_delivery_is_retried_with_backoff(self, failing_receiver):
+        (order,) = make_orders(1)
+        message = OutboxMessage.objects.create(
+            event=outbox.ORDER_CREATED, payload={"id": order.id}
+        )
+
+        assert outbox.dispatch_batch() == 1
+
+        message.refresh_from_db()
+        assert message.dispatched_at is None
+        assert message.attempts == 1
+        assert "ERP is down" in message.last_error
+        assert outbox.dispatch_batch() == 0
+
+    @pytest.mark.django_db
+    def test_batches_are_dispatched_once(self, receiver):
+        orders = make_orders(3)
+        for order in orders:
+            OutboxMessage.objects.create(
+                event=outbox.ORDER_CREATED, payload={"id": order.id}
+            )
+
+        assert outbox.dispatch_batch(batch_size=2) == 2
+        assert outbox.dispatch_batch(batch_size=2) == 1
+        assert outbox.dispatch_batch(batch_size=2) == 0
+        assert sorted(order.id for order in receiver) == [order.id for order in orders]
+
+
+def add_items(orders, quantity):
+    for order in orders:
+        baker.make(OrderItem, order=order, unit_price=1, _quantity=quantity)
+
+
+class TestRetrieveOrders:
+    # Orders page, count and items with their products
+    LIST_BUDGET = 3
+    # Order and items with their products
+    DETAIL_BUDGET = 2
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize("items", [1, 5])
+    def test_list_query_count_doesnt_grow_with_items(
+        self, api_client, query_budget, items
+    ):
+        orders = make_orders(4)
+        add_items(orders, items)
+        api_client.force_authenticate(user=orders[0].customer.user)
+
+        with query_budget(self.LIST_BUDGET):
+            response = api_client.get("/store/orders/")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data["results"]) == 4
+        assert all(len(order["items"]) == items for order in response.data["results"])
+
+    @pytest.mark.django_db
+    def test_staff_list_stays_within_budget(self, api_client, query_budget):
+        add_items(make_orders(3), 3)
+        api_client.force_authenticate(
+            user=baker.make(settings.AUTH_USER_MODEL, is_staff=True)
+        )
+
+        with query_budget(self.LIST_BUDGET):
+            response = api_client.get("/store/orders/")
+
+        assert len(response.data["results"]) == 3
+
+    @pytest.mark.django_db
+    def test_retrieve_stays_within_budget(self, api_client, query_budget):
+        order = make_orders(1)[0]
+        add_items([order], 5)
+        api_client.force_authenticate(user=order.customer.user)
+
+        with query_budget(self.DETAIL_BUDGET):
+            response = api_client.get(f"/store/orders/{order.id}/")
+
+        assert len(response.data["items"]) == 5
+        assert response.data["items"][0]["product"]["title"]
+
+    @pytest.mark.django_db
+    def test_customers_only_see_their_orders(self, api_client):
+        make_orders(2)
+        order = make_orders(1)[0]
+        api_client.force_authenticate(user=order.customer.user)
+
+        response = api_client.get("/store/orders/")
+
+        assert [result["id"] for result in response.data["results"]] == [order.id]
+
+
+@pytest.fixture
+def export_orders(api_client, monkeypatch):
+    # Small batches so the tests cross batch boundaries
+    monkeypatch.setattr(exports, "BATCH_SIZE", 2)
+
+    def do_export_orders(query="", is_staff=True):
+        user = baker.make(settings.AUTH_USER_MODEL, is_staff=is_staff)
+        api_client.force_authenticate(user=user)
+        return api_client.get(f"/store/orders/export/{query}")
+
+    return do_export_orders
+
+
+def read_content(response):
+    return b"".join(response.streaming_content).decode()
+
+
+class TestExportOrders:
+    @pytest.mark.django_db
+    def test_orders_are_streamed_as_ndjson(self, export_orders):
+        orders = make_orders(5)
+        product = baker.make(Product, title="Bread", unit_price=2)
+        baker.make(
+            OrderItem, order=orders[2], product=product, quantity=3, unit_price=1
+        )
+
+        response = export_orders()
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.streaming
+        assert response["Content-Type"] == "application/x-ndjson; charset=utf-8"
+        lines = [json.loads(line) for line in read_content(response).splitlines()]
+        assert [line["id"] for line in lines] == [order.id for order in orders]
+        assert lines[2]["items"] == [
+            {
+                "id": OrderItem.objects.get().id,
+                "product": {"id": product.id, "title": "Bread", "unit_price": 2.0},
+                "quantity": 3,
+                "unit_price": 1.0,
+            }
+        ]
+
+    @pytest.mark.django_db
+    def test_orders_are_streamed_as_csv(self, export_orders):
+        order = make_orders(1)[0]
+        baker.make(OrderItem, order=order, quantity=1, unit_price=5, _quantity=2)
+
+        response = export_orders("?format=csv")
+
+        rows = list(csv.DictReader(io.StringIO(read_content(response))))
+        assert response["Content-Disposition"] == 'attachment; filename="orders.csv"'
+        assert len(rows) == 2
+        assert {row["order_id"] for row in rows} == {str(order.id)}
+
+    @pytest.mark.django_db
+    def test_orders_are_filtered(self, export_orders):
+        orders = make_orders(4)
+        Order.objects.filter(pk__in=[orders[1].id, orders[3].id]).update(
+            payment_status=Order.PAYMENT_STATUS_COMPLETED
+        )
+        Order.objects.filter(pk=orders[3].id).update(placed_at="2020-01-01T00:00Z")
+
+        response = export_orders("?payment_status=C&placed_at__gte=2021-01-01")
+
+        lines = [json.loads(line) for line in read_content(response).splitlines()]
+        assert [line["id"] for line in lines] == [orders[1].id]
+
+    @pytest.mark.django_db
+    def test_if_filter_is_invalid_returns_400(self, export_orders):
+        response = export_orders("?placed_at__gte=yesterday")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.django_db
+    def test_if_user_is_not_admin_returns_403(self, export_orders):
+        response = export_orders(is_staff=False)
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,73 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+
+from model_bakery import baker
+
+from store.models import Customer, CustomerStats, Order, Product
+
+import pytest
+
+
+@pytest.fixture
+def prepare(tmp_path):
+    output = tmp_path / "data.json"
+
+    def do_prepare(*args):
+        call_command("prepare_load_test", "--output", str(output), *args)
+        return json.loads(output.read_text())
+
+    return do_prepare
+
+
+class TestPrepareLoadTest:
+    @pytest.mark.django_db
+    def test_writes_ids_that_exist(self, prepare):
+        products = baker.make(Product, title="Organic Bread", _quantity=3)
+
+        data = prepare("--customers", "3", "--orders", "2")
+
+        assert data["products"] == [product.id for product in products]
+        assert data["search_terms"] == ["organic", "bread"]
+        assert [customer["username"] for customer in data["customers"]] == [
+            "loadtest-1",
+            "loadtest-2",
+            "loadtest-3",
+        ]
+        assert get_user_model().objects.get(username="loadtest-admin").is_superuser
+
+    @pytest.mark.django_db
+    def test_customers_can_log_in_and_have_orders(self, prepare, api_client):
+        baker.make(Product, _quantity=3)
+
+        data = prepare("--customers", "2", "--orders", "2")
+
+        response = api_client.post("/auth/jwt/create/", data["customers"][0])
+        assert "access" in response.data
+        assert Order.objects.count() == 4
+        assert set(CustomerStats.objects.values_list("orders_count", flat=True)) == {2}
+
+    @pytest.mark.django_db
+    def test_running_again_reuses_users_and_orders(self, prepare):
+        baker.make(Product, _quantity=3)
+
+        prepare("--customers", "2", "--orders", "2")
+        prepare("--customers", "2", "--orders", "2")
+
+        assert Customer.objects.count() == 3
+        assert Order.objects.count() == 4
+
+    @pytest.mark.django_db
+    def test_restocks_products(self, prepare):
+        product = baker.make(Product, inventory=0)
+
+        prepare("--customers", "1", "--restock", "500")
+
+        product.refresh_from_db()
+        assert product.inventory == 500
+
+    @pytest.mark.django_db
+    def test_if_there_are_no_products_fails(self, prepare):
+        with pytest.raises(CommandError):
+            prepare()
@@ -0,0 +1,674 @@
+import base64
+import json
+from decimal import Decimal
+from io import BytesIO
+
+from rest_framework import status
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, transaction
+
+from model_bakery import baker
+from PIL import Image
+
+from store import caching, validators
+from store.models import Cart, CartItem, Collection, Product, ProductImage
+from store.pagination import KeysetPagination
+from tags.models import Tag, TaggedItem
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+class TestListProductsCache:
+    @pytest.mark.django_db
+    def test_second_request_is_served_from_cache(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+
+        first = api_client.get("/store/products/")
+        second = api_client.get("/store/products/")
+
+        assert first["X-Cache"] == "MISS"
+        assert second["X-Cache"] == "HIT"
+        assert second.data == first.data
+        assert caching.get_stats() == {
+            caching.HIT: 1,
+            caching.MISS: 1,
+            caching.NOT_MODIFIED: 0,
+        }
+
+    @pytest.mark.django_db
+    def test_equivalent_query_strings_share_an_entry(self, api_client):
+        collection = baker.make(Collection)
+
+        api_client.get(f"/store/products/?collection_id={collection.id}&foo=1")
+        response = api_client.get(f"/store/products/?collection_id={collection.id}")
+
+        assert response["X-Cache"] == "HIT"
+
+    @pytest.mark.django_db(transaction=True)
+    def test_if_product_changes_list_is_invalidated(self, api_client):
+        collection = baker.make(Collection)
+        product = baker.make(Product, collection=collection)
+        url = f"/store/products/?collection_id={collection.id}"
+        api_client.get(url)
+        api_client.get("/store/products/")
+
+        product.title = "New Title"
+        product.save()
+
+        assert api_client.get(url)["X-Cache"] == "MISS"
+        response = api_client.get("/store/products/")
+        assert response["X-Cache"] == "MISS"
+        assert response.data["results"][0]["title"] == "New Title"
+
+    @pytest.mark.django_db(transaction=True)
+    def test_if_product_moves_both_collections_are_invalidated(self, api_client):
+        source, target = baker.make(Collection, _quantity=2)
+        baker.make(Product, collection=source)
+        source_url = f"/store/products/?collection_id={source.id}"
+        api_client.get(source_url)
+
+        product = Product.objects.get()
+        product.collection = target
+        product.save()
+
+        response = api_client.get(source_url)
+        assert response["X-Cache"] == "MISS"
+        assert response.data["results"] == []
+
+    @pytest.mark.django_db
+    def test_lists_are_invalidated_when_the_write_commits(
+        self, django_capture_on_commit_callbacks
+    ):
+        collection = baker.make(Collection)
+        scope = caching.collection_scope(collection.id)
+        version = caching.get_version(scope)
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            baker.make(Product, collection=collection)
+            # Readers in the meantime can't see the product yet
+            assert caching.get_version(scope) == version
+
+        for callback in callbacks:
+            callback()
+        assert caching.get_version(scope) != version
+
+    @pytest.mark.django_db
+    def test_reservations_invalidate_lists_when_they_commit(
+        self, django_capture_on_commit_callbacks
+    ):
+        product = baker.make(Product, inventory=5)
+        version = caching.get_version(caching.ALL_COLLECTIONS)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            # Rolled back, nothing to invalidate
+            assert Product.objects.reserve_inventory({product.id: 10}) == [product.id]
+        assert caching.get_version(caching.ALL_COLLECTIONS) == version
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert Product.objects.reserve_inventory({product.id: 2}) == []
+        assert caching.get_version(caching.ALL_COLLECTIONS) != version
+
+    @pytest.mark.django_db
+    def test_other_collections_stay_cached(self, api_client):
+        first, second = baker.make(Collection, _quantity=2)
+        url = f"/store/products/?collection_id={second.id}"
+        api_client.get(url)
+
+        baker.make(Product, collection=first)
+
+        assert api_client.get(url)["X-Cache"] == "HIT"
+
+
+class TestListProductsPagination:
+    @pytest.mark.django_db
+    def test_pages_follow_the_ordering_without_gaps(self, api_client):
+        collection = baker.make(Collection)
+        for price in [5, 3, 3, 3, 1, 4, 2, 3, 5, 1, 2, 4]:
+            baker.make(Product, collection=collection, unit_price=price)
+        expected = list(
+            Product.objects.order_by("unit_price", "id").values_list("id", flat=True)
+        )
+
+        seen = []
+        url = "/store/products/?ordering=unit_price"
+        while url:
+            response = api_client.get(url)
+            seen += [product["id"] for product in response.data["results"]]
+            url = response.data["next"]
+
+        assert seen == expected
+
+    @pytest.mark.django_db
+    def test_previous_link_returns_the_previous_page(self, api_client):
+        baker.make(Product, _quantity=15)
+
+        first = api_client.get("/store/products/")
+        second = api_client.get(first.data["next"])
+        previous = api_client.get(second.data["previous"])
+
+        assert len(second.data["results"]) == 5
+        assert previous.data["results"] == first.data["results"]
+        assert first.data["previous"] is None
+
+    @pytest.mark.django_db
+    def test_count_can_be_skipped(self, api_client):
+        baker.make(Product, _quantity=3)
+
+        response = api_client.get("/store/products/?count=none")
+
+        assert "count" not in response.data
+
+    @pytest.mark.django_db
+    def test_exact_count(self, api_client):
+        baker.make(Product, _quantity=3)
+
+        response = api_client.get("/store/products/?count=exact")
+
+        assert response.data["count"] == 3
+
+    @pytest.mark.django_db
+    def test_count_is_exact_unless_an_estimate_is_asked_for(
+        self, api_client, monkeypatch
+    ):
+        monkeypatch.setattr(KeysetPagination, "max_estimated_count", 2)
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=4)
+        url = f"/store/products/?collection_id={collection.id}"
+
+        assert api_client.get(url).data["count"] == 4
+        assert api_client.get(f"{url}&count=estimate").data["count"] == 3
+
+    @pytest.mark.django_db
+    def test_if_cursor_is_invalid_returns_404(self, api_client):
+        response = api_client.get("/store/products/?cursor=garbage")
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize("ordering", ["title", "unit_price"])
+    def test_if_cursor_values_have_wrong_types_returns_404(self, api_client, ordering):
+        baker.make(Product)
+        cursor = base64.urlsafe_b64encode(
+            json.dumps({"values": ["x", "abc"], "reverse": False}).encode()
+        ).decode()
+
+        response = api_client.get(
+            f"/store/products/?ordering={ordering}&cursor={cursor}"
+        )
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestSearchProducts:
+    @pytest.mark.django_db
+    def test_title_matches_rank_above_description_matches(self, api_client):
+        in_description = baker.make(
+            Product, title="Coffee Mug", description="Holds hot tea"
+        )
+        in_title = baker.make(Product, title="Green Tea", description="Loose leaf")
+        baker.make(Product, title="Bread", description="Multigrain")
+
+        response = api_client.get("/store/products/?search=tea")
+
+        assert [product["id"] for product in response.data["results"]] == [
+            in_title.id,
+            in_description.id,
+        ]
+
+    @pytest.mark.django_db
+    def test_if_every_term_is_too_short_returns_nothing(self, api_client):
+        baker.make(Product, title="A Tea")
+
+        response = api_client.get("/store/products/?search=a")
+
+        assert response.data["results"] == []
+
+    @pytest.mark.django_db
+    def test_every_term_has_to_match(self, api_client):
+        product = baker.make(Product, title="Green Tea Bags")
+        baker.make(Product, title="Green Apples")
+
+        response = api_client.get("/store/products/?search=gre tea")
+
+        assert [item["id"] for item in response.data["results"]] == [product.id]
+
+    @pytest.mark.django_db
+    def test_index_follows_product_updates(self, api_client):
+        product = baker.make(Product, title="Green Tea")
+
+        product.title = "Black Coffee"
+        product.save()
+
+        assert api_client.get("/store/products/?search=tea").data["results"] == []
+        results = api_client.get("/store/products/?search=coffee").data["results"]
+        assert [item["id"] for item in results] == [product.id]
+
+    @pytest.mark.django_db
+    def test_facets_still_apply(self, api_client):
+        collection = baker.make(Collection)
+        product = baker.make(Product, title="Tea", collection=collection)
+        baker.make(Product, title="Tea")
+
+        response = api_client.get(
+            f"/store/products/?search=tea&collection_id={collection.id}"
+        )
+
+        assert [item["id"] for item in response.data["results"]] == [product.id]
+
+
+@pytest.fixture
+def get_both(api_client, settings):
+    """
+    Requests `url` through the serializers and through the values() read path.
+    """
+
+    settings.CATALOGUE_CACHE_ENABLED = False
+
+    def do_get_both(url):
+        settings.CATALOGUE_FAST_READS = False
+        expected = api_client.get(url)
+        settings.CATALOGUE_FAST_READS = True
+        return expected, api_client.get(url)
+
+    return do_get_both
+
+
+class TestFastReads:
+    @pytest.mark.django_db
+    def test_product_list_is_byte_identical(self, get_both):
+        collection = baker.make(Collection)
+        for price in ["1.10", "19.99", "7.35"]:
+            product = baker.make(Product, collection=collection, unit_price=price)
+            baker.make(
+                ProductImage,
+                product=product,
+                image="store/images/photo.png",
+                renditions={"thumbnail": {"webp": "store/images/photo-100.webp"}},
+                _quantity=2,
+            )
+
+        expected, response = get_both("/store/products/?ordering=-unit_price")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.content == expected.content
+
+    @pytest.mark.django_db
+    def test_cursor_pages_match(self, get_both):
+        baker.make(Product, _quantity=15)
+        first = get_both("/store/products/?ordering=last_update")[1]
+
+        expected, response = get_both(first.data["next"])
+
+        assert len(response.data["results"]) == 5
+        assert response.content == expected.content
+
+    @pytest.mark.django_db
+    def test_search_results_match(self, get_both):
+        baker.make(Product, title="Bread - Multigrain")
+        baker.make(Product, title="Bread Crumbs", description="Multigrain bread")
+
+        expected, response = get_both("/store/products/?search=multigrain")
+
+        assert len(response.data["results"]) == 2
+        assert response.content == expected.content
+
+    @pytest.mark.django_db
+    def test_product_detail_is_byte_identical(self, get_both):
+        product = baker.make(Product, unit_price="3.33")
+        baker.make(ProductImage, product=product, image="store/images/photo.png")
+
+        expected, response = get_both(f"/store/products/{product.id}/")
+
+        assert response.content == expected.content
+
+    @pytest.mark.django_db
+    def test_if_product_doesnt_exist_returns_404(self, get_both):
+        response = get_both("/store/products/0/")[1]
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.django_db
+    def test_collections_are_byte_identical(self, get_both):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+
+        expected, response = get_both("/store/collections/")
+        assert response.content == expected.content
+
+        expected, response = get_both(f"/store/collections/{collection.id}/")
+        assert response.content == expected.content
+
+
+class TestConditionalGet:
+    @pytest.mark.django_db
+    def test_if_list_is_unchanged_returns_304_without_queries(
+        self, api_client, query_budget
+    ):
+        baker.make(Product, _quantity=2)
+        etag = api_client.get("/store/products/")["ETag"]
+
+        with query_budget(0):
+            response = api_client.get("/store/products/", HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response["ETag"] == etag
+        assert response.content == b""
+        assert caching.get_stats()[caching.NOT_MODIFIED] == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_list_etag_is_scoped_to_the_collection(self, api_client):
+        first, second = baker.make(Collection, _quantity=2)
+        url = f"/store/products/?collection_id={second.id}"
+        etag = api_client.get(url)["ETag"]
+
+        baker.make(Product, collection=first)
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        baker.make(Product, collection=second)
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response["ETag"] != etag
+
+    @pytest.mark.django_db
+    def test_list_etag_depends_on_the_query(self, api_client):
+        etag = api_client.get("/store/products/")["ETag"]
+
+        response = api_client.get(
+            "/store/products/?ordering=unit_price", HTTP_IF_NONE_MATCH=etag
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.django_db
+    def test_if_product_is_not_modified_since_returns_304(
+        self, api_client, query_budget
+    ):
+        product = baker.make(Product)
+        url = f"/store/products/{product.id}/"
+        last_modified = api_client.get(url)["Last-Modified"]
+
+        with query_budget(1) as queries:
+            response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        assert len(queries) == 1
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    @pytest.mark.django_db
+    def test_new_image_changes_the_product_etag(self, api_client):
+        product = baker.make(Product)
+        url = f"/store/products/{product.id}/"
+        etag = api_client.get(url)["ETag"]
+
+        baker.make(ProductImage, product=product, image="store/images/photo.png")
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data["images"]) == 1
+
+    @pytest.mark.django_db
+    def test_checkout_changes_the_product_etag(self, api_client):
+        product = baker.make(Product, inventory=10)
+        url = f"/store/products/{product.id}/"
+        etag = api_client.get(url)["ETag"]
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=3)
+        api_client.force_authenticate(user=baker.make(settings.AUTH_USER_MODEL))
+        assert (
+            api_client.post("/store/orders/", {"cart_id": cart.id}).status_code == 200
+        )
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["inventory"] == 7
+
+    @pytest.mark.django_db
+    def test_included_fields_change_the_product_etag(self, api_client):
+        product = baker.make(Product)
+        url = f"/store/products/{product.id}/"
+        etag = api_client.get(url)["ETag"]
+
+        response = api_client.get(f"{url}?include=tags", HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["tags"] == []
+
+    @pytest.mark.django_db
+    def test_if_product_doesnt_exist_returns_404(self, api_client):
+        response = api_client.get("/store/products/0/", HTTP_IF_NONE_MATCH="*")
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def tag(product, *labels):
+    for label in labels:
+        baker.make(
+            TaggedItem,
+            tag=Tag.objects.get_or_create(label=label)[0],
+            content_object=product,
+        )
+
+
+class TestProductTags:
+    @pytest.mark.django_db
+    def test_tags_for_many_products_take_one_query(self, query_budget):
+        first, second, untagged = baker.make(Product, _quantity=3)
+        tag(first, "red", "organic")
+        tag(second, "red")
+
+        with query_budget(1):
+            tags = TaggedItem.objects.get_tags_for_many(
+                Product, [first.id, second.id, untagged.id]
+            )
+
+        assert {pk: [tag.label for tag in tags[pk]] for pk in tags} == {
+            first.id: ["organic", "red"],
+            second.id: ["red"],
+        }
+
+    @pytest.mark.django_db
+    def test_tags_are_only_listed_when_included(self, api_client, settings):
+        settings.CATALOGUE_CACHE_ENABLED = False
+        tag(baker.make(Product), "red")
+
+        assert "tags" not in api_client.get("/store/products/").data["results"][0]
+        response = api_client.get("/store/products/?include=tags")
+        assert response.data["results"][0]["tags"] == ["red"]
+
+    @pytest.mark.django_db
+    def test_tagged_list_query_count_doesnt_grow(
+        self, api_client, settings, query_budget
+    ):
+        settings.CATALOGUE_CACHE_ENABLED = False
+        for product in baker.make(Product, _quantity=5):
+            tag(product, "red", "blue")
+
+        # Page, count, images and tags
+        with query_budget(4):
+            response = api_client.get("/store/products/?include=tags")
+
+        assert all(
+            product["tags"] == ["blue", "red"] for product in response.data["results"]
+        )
+
+    @pytest.mark.django_db
+    def test_fast_reads_render_the_same_tags(self, get_both):
+        tag(baker.make(Product), "red", "organic")
+
+        expected, response = get_both("/store/products/?include=tags")
+
+        assert response.content == expected.content
+
+    @pytest.mark.django_db
+    def test_filter_intersects_tags(self, api_client):
+        both, red, organic = baker.make(Product, _quantity=3)
+        tag(both, "red", "organic")
+        tag(red, "red")
+        tag(organic, "organic")
+
+        response = api_client.get("/store/products/?tags=red,organic")
+
+        assert [product["id"] for product in response.data["results"]] == [both.id]
+
+    @pytest.mark.django_db(transaction=True)
+    def test_new_tag_invalidates_cached_lists(self, api_client):
+        product = baker.make(Product)
+        api_client.get("/store/products/?tags=red")
+
+        tag(product, "red")
+
+        response = api_client.get("/store/products/?tags=red")
+        assert response["X-Cache"] == "MISS"
+        assert len(response.data["results"]) == 1
+
+
+def make_image(size=(1600, 1200), format="PNG"):
+    buffer = BytesIO()
+    Image.new("RGB", size, "red").save(buffer, format)
+    return SimpleUploadedFile("photo.png", buffer.getvalue(), "image/png")
+
+
+@pytest.fixture
+def upload_image(api_client, settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+    def do_upload_image(product, image):
+        return api_client.post(
+            f"/store/products/{product.id}/images/", {"image": image}
+        )
+
+    return do_upload_image
+
+
+class TestProductImages:
+    @pytest.mark.django_db
+    def test_renditions_are_generated_after_commit(
+        self, api_client, upload_image, django_capture_on_commit_callbacks
+    ):
+        product = baker.make(Product)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = upload_image(product, make_image())
+
+        assert response.status_code == status.HTTP_201_CREATED
+        product_image = ProductImage.objects.get()
+        thumbnail = product_image.renditions["thumbnail"]
+        with product_image.image.storage.open(thumbnail["webp"]) as file:
+            image = Image.open(file)
+            assert image.format == "WEBP"
+            assert image.size == (100, 75)
+
+        data = api_client.get(f"/store/products/{product.id}/").data
+        renditions = data["images"][0]["renditions"]
+        assert set(renditions) == {"thumbnail", "list", "detail"}
+        assert renditions["list"]["jpeg"].startswith("http://testserver/media/")
+
+    @pytest.mark.django_db
+    def test_renditions_are_deleted_after_commit(
+        self, upload_image, django_capture_on_commit_callbacks
+    ):
+        product = baker.make(Product)
+        with django_capture_on_commit_callbacks(execute=True):
+            upload_image(product, make_image())
+        product_image = ProductImage.objects.get()
+        storage = product_image.image.storage
+        path = product_image.renditions["thumbnail"]["webp"]
+
+        with pytest.raises(DatabaseError):
+            with transaction.atomic():
+                product_image.delete()
+                raise DatabaseError
+        assert storage.exists(path)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            ProductImage.objects.get().delete()
+        assert not storage.exists(path)
+
+    @pytest.mark.django_db
+    def test_if_broker_is_down_upload_succeeds(
+        self, upload_image, monkeypatch, django_capture_on_commit_callbacks
+    ):
+        def delay(*args, **kwargs):
+            raise ConnectionError("Broker is down")
+
+        monkeypatch.setattr("store.tasks.generate_image_renditions.delay", delay)
+        product = baker.make(Product)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = upload_image(product, make_image())
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert ProductImage.objects.get().renditions == {}
+
+    @pytest.mark.django_db
+    def test_if_upload_is_too_large_returns_400(self, upload_image, monkeypatch):
+        monkeypatch.setattr(validators, "MAX_FILE_SIZE_KB", 1)
+        product = baker.make(Product)
+
+        response = upload_image(product, make_image(size=(2000, 2000), format="BMP"))
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["image"] == ["Files cannot be larger than 1KB"]
+        assert not ProductImage.objects.exists()
+
+    @pytest.mark.django_db
+    def test_if_replacement_is_too_large_returns_400(
+        self, api_client, upload_image, monkeypatch
+    ):
+        product = baker.make(Product)
+        product_image = ProductImage.objects.get(
+            pk=upload_image(product, make_image(size=(10, 10))).data["id"]
+        )
+        monkeypatch.setattr(validators, "MAX_FILE_SIZE_KB", 1)
+
+        response = api_client.put(
+            f"/store/products/{product.id}/images/{product_image.id}/",
+            {"image": make_image(size=(2000, 2000), format="BMP")},
+            format="multipart",
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["image"] == ["Files cannot be larger than 1KB"]
+
+    @pytest.mark.django_db
+    def test_if_admin_upload_is_too_large_reports_it(
+        self, client, settings, tmp_path, monkeypatch
+    ):
+        settings.MEDIA_ROOT = tmp_path
+        monkeypatch.setattr(validators, "MAX_FILE_SIZE_KB", 1)
+        client.force_login(
+            baker.make(settings.AUTH_USER_MODEL, is_staff=True, is_superuser=True)
+        )
+        product = baker.make(Product, unit_price=Decimal("9.99"), inventory=10)
+
+        response = client.post(
+            f"/admin/store/product/{product.id}/change/",
+            {
+                "title": product.title,
+                "slug": product.slug,
+                "unit_price": "9.99",
+                "inventory": "10",
+                "collection": product.collection_id,
+                "images-TOTAL_FORMS": "1",
+                "images-INITIAL_FORMS": "0",
+                "images-0-image": make_image(size=(2000, 2000), format="BMP"),
+            },
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        [images] = [
+            inline.formset
+            for inline in response.context["inline_admin_formsets"]
+            if inline.formset.prefix == "images"
+        ]
+        assert images.errors == [{"image": ["Files cannot be larger than 1KB"]}]
+        assert not ProductImage.objects.exists()
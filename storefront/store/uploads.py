@@ -0,0 +1,64 @@
+from io import BytesIO
+
+from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import models
+
+from . import validators
+
+
+class OversizedFile(UploadedFile):
+    """
+    Stands in for an upload dropped by MaxFileSizeUploadHandler. It has no
+    content but keeps the size that was received, so validate_file_size
+    rejects it wherever the file is validated.
+    """
+
+    def __init__(self, name, size, content_type=None, charset=None):
+        super().__init__(BytesIO(), name, content_type, size, charset)
+
+
+class MaxFileSizeUploadHandler(FileUploadHandler):
+    """
+    Counts the bytes of each uploaded file while it streams in and stops
+    keeping them as soon as it goes over validators.MAX_FILE_SIZE_KB, instead
+    of buffering the whole file before validate_file_size sees it. The file
+    is then replaced by an OversizedFile.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > validators.MAX_FILE_SIZE_KB * 1024:
+            # The following handlers get nothing more to store
+            return None
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.received > validators.MAX_FILE_SIZE_KB * 1024:
+            return OversizedFile(
+                self.file_name, self.received, self.content_type, self.charset
+            )
+        return None
+
+
+class ImageFormField(forms.ImageField):
+    def to_python(self, data):
+        # Before Pillow tries to open it: an OversizedFile has no content
+        if isinstance(data, UploadedFile):
+            validators.validate_file_size(data)
+        return super().to_python(data)
+
+
+class ImageField(models.ImageField):
+    """
+    ImageField whose forms (e.g. in the admin) report files over the size
+    limit as such, see ImageFormField.
+    """
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{"form_class": ImageFormField, **kwargs})
@@ -1,8 +1,14 @@
 from django.core.exceptions import ValidationError
 
+MAX_FILE_SIZE_KB = 5000
+
+
+def get_file_size_message(max_size_kb):
+    return f"Files cannot be larger than {max_size_kb}KB"
+
 
 def validate_file_size(file):
-    max_size_kb = 5000
+    max_size_kb = MAX_FILE_SIZE_KB
 
-    if file.size > max_size_kb * 1024:  # 50KB (Kilobytes)
-        raise ValidationError(f"Files cannot be larger than {max_size_kb}KB")
+    if file.size > max_size_kb * 1024:  # 5000KB (Kilobytes)
+        raise ValidationError(get_file_size_message(max_size_kb))
@@ -1,26 +1,40 @@
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework import serializers, status
 from rest_framework.mixins import (
     CreateModelMixin,
     RetrieveModelMixin,
     DestroyModelMixin,
 )
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 
+from . import caching, exports
+from .carts import get_cart_store
+from .conditional import ConditionalGetMixin
+from .listings import (
+    COLLECTION_FIELDS,
+    PRODUCT_FIELDS,
+    CachedListMixin,
+    ValuesReadMixin,
+    collection_rows,
+    product_rows,
+)
 from .permissions import (
     IsAdminOrReadOnly,
     ViewCustomerHistoryPermission,
 )
-from .pagination import DefaultPagination
-from .filters import ProductFilter
+from .pagination import KeysetPagination
+from .filters import OrderFilter, ProductFilter, ProductSearchFilter
 from .models import (
     Cart,
     CartItem,
     Customer,
+    CustomerStats,
     Order,
     OrderItem,
     Product,
@@ -30,10 +44,12 @@ from .models import (
 )
 from .serializers import (
     AddCartItemSerializer,
+    BatchCartItemSerializer,
     CartItemSerializer,
     CartSerializer,
     CreateOrderSerializer,
     CustomerSerializer,
+    CustomerStatsSerializer,
     OrderSerializer,
     ProductImageSerializer,
     ProductSerializer,
@@ -43,22 +59,97 @@ from .serializers import (
     UpdateOrderSerializer,
 )
 
-from django.db.models import Count
+from django.core.exceptions import ValidationError
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 
+from likes.models import LikedItem
+
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(
+    ConditionalGetMixin, CachedListMixin, ValuesReadMixin, ModelViewSet
+):
     queryset = Product.objects.prefetch_related("images").all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
-    search_fields = ["title", "description"]
     ordering_fields = ["unit_price", "last_update"]
-    pagination_class = DefaultPagination
+    pagination_class = KeysetPagination
     permission_classes = [IsAdminOrReadOnly]
+    values_fields = PRODUCT_FIELDS
+
+    # Optional fields, requested with ?include=
+    includes = ["tags", "likes"]
+    # Like counts move without touching the catalogue version or last_update,
+    # so they are neither cached nor validated
+    live_includes = ["likes"]
 
     def get_serializer_context(self):
-        return {"request": self.request}
+        return {"request": self.request, "include": self.get_includes()}
+
+    def get_includes(self):
+        include = self.request.query_params.get("include", "")
+        return {name.strip() for name in include.split(",")} & set(self.includes)
+
+    def includes_live_fields(self):
+        return bool(self.get_includes() & set(self.live_includes))
+
+    def to_representation_rows(self, rows):
+        return product_rows(rows, self.request, include=self.get_includes())
+
+    def is_list_cacheable(self):
+        return not self.includes_live_fields() and super().is_list_cacheable()
+
+    def get_list_validators(self):
+        if self.includes_live_fields():
+            return None, None
+        # The cache key is scoped to the version of the filtered collection
+        return caching.product_list_key(self.request), None
+
+    def get_detail_validators(self):
+        if self.includes_live_fields():
+            return None, None
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        try:
+            last_update = (
+                queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+                .order_by()
+                .values_list("last_update", flat=True)
+                .first()
+            )
+        except (TypeError, ValueError, ValidationError):
+            return None, None
+
+        if last_update is None:
+            return None, None
+        # HTTP dates have a one second resolution
+        return last_update.isoformat(), int(last_update.timestamp())
+
+    @action(
+        detail=True, methods=["post", "delete"], permission_classes=[IsAuthenticated]
+    )
+    def like(self, request, pk):
+        """
+        POST likes the product, DELETE takes the like back. Both can be
+        repeated safely.
+        """
+
+        product = get_object_or_404(Product.objects.only("id"), pk=pk)
+        if request.method == "POST":
+            LikedItem.objects.like(request.user, product)
+        else:
+            LikedItem.objects.unlike(request.user, product)
+
+        return Response(
+            {
+                "liked": request.method == "POST",
+                "likes": LikedItem.objects.counts_for(Product, [product.id])[
+                    product.id
+                ],
+            }
+        )
 
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs["pk"]).count() > 0:
@@ -71,10 +162,22 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(products_count=Count("products"))
+class CollectionViewSet(ConditionalGetMixin, ValuesReadMixin, ModelViewSet):
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
+    values_fields = COLLECTION_FIELDS
+
+    def to_representation_rows(self, rows):
+        return collection_rows(rows)
+
+    # Every collection write and products_count change bumps the version of
+    # the whole catalogue
+    def get_list_validators(self):
+        return caching.get_version(caching.ALL_COLLECTIONS), None
+
+    def get_detail_validators(self):
+        return caching.get_version(caching.ALL_COLLECTIONS), None
 
     def destroy(self, request, *args, **kwargs):
         if Product.objects.filter(collection_id=kwargs["pk"]).count() > 0:
@@ -90,6 +193,7 @@ class CollectionViewSet(ModelViewSet):
 
 class ReviewViewSet(ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs["product_pk"])
@@ -106,15 +210,33 @@ class CartViewSet(
 ):
     """
     Custom viewset for creating a cart, retrieving a cart
+
+    Carts are read and written through the configured cart store,
+    see store.carts
     """
 
     queryset = Cart.objects.prefetch_related("items__product").all()
     serializer_class = CartSerializer
 
+    def get_object(self):
+        try:
+            return get_cart_store().get(self.kwargs["pk"])
+        except (Cart.DoesNotExist, ValueError, ValidationError):
+            raise NotFound()
+
+    def perform_create(self, serializer):
+        serializer.instance = get_cart_store().create()
+
+    def perform_destroy(self, instance):
+        get_cart_store().delete(instance.id)
+
 
 class CartItemViewSet(ModelViewSet):
     """
     Viewset for listing, updating and deleting cart items.
+
+    Items are read and written through the configured cart store,
+    see store.carts
     """
 
     http_method_names = ["get", "post", "patch", "delete"]
@@ -136,6 +258,50 @@ class CartItemViewSet(ModelViewSet):
             .all()
         )
 
+    def get_object(self):
+        try:
+            return get_cart_store().get_item(self.kwargs["cart_pk"], self.kwargs["pk"])
+        except (CartItem.DoesNotExist, ValueError, ValidationError):
+            raise NotFound()
+
+    def list(self, request, *args, **kwargs):
+        try:
+            items = get_cart_store().get_items(self.kwargs["cart_pk"])
+        except (Cart.DoesNotExist, ValueError, ValidationError):
+            items = []
+        serializer = self.get_serializer(items, many=True)
+        return Response(serializer.data)
+
+    def perform_create(self, serializer):
+        try:
+            serializer.save()
+        except (Cart.DoesNotExist, ValueError, ValidationError):
+            raise NotFound()
+
+    def perform_destroy(self, instance):
+        get_cart_store().remove_item(instance.cart_id, instance.id)
+
+    @action(detail=False, methods=["POST"])
+    def batch(self, request, cart_pk):
+        """
+        Applies several add/set/remove operations in one request, e.g.
+
+            {"operations": [{"operation": "add", "product_id": 1, "quantity": 2},
+                            {"operation": "remove", "product_id": 3}]}
+
+        and returns the whole cart.
+        """
+
+        serializer = BatchCartItemSerializer(
+            data=request.data, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        try:
+            cart = serializer.save()
+        except (Cart.DoesNotExist, ValueError, ValidationError):
+            raise NotFound()
+        return Response(CartSerializer(cart).data)
+
 
 class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all()
@@ -158,9 +324,26 @@ class CustomerViewSet(ModelViewSet):
             serializer.save()
             return Response(serializer.data)
 
-    @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
+    @action(
+        detail=True,
+        permission_classes=[ViewCustomerHistoryPermission],
+        pagination_class=KeysetPagination,
+    )
     def history(self, request, pk):
-        return Response("Ok")
+        """
+        Returns the precomputed order stats of the customer and their orders,
+        most recent first.
+        """
+
+        customer = self.get_object()
+        stats = CustomerStats.objects.filter(customer=customer).first()
+        if stats is None:
+            stats = CustomerStats(customer=customer)
+
+        orders = Order.objects.with_items().filter(customer=customer)
+        page = self.paginate_queryset(orders.order_by("-placed_at"))
+        orders = self.get_paginated_response(OrderSerializer(page, many=True).data)
+        return Response({"stats": CustomerStatsSerializer(stats).data, **orders.data})
 
 
 class OrderViewSet(ModelViewSet):
@@ -172,19 +355,51 @@ class OrderViewSet(ModelViewSet):
         "head",
         "options",
     ]
+    pagination_class = KeysetPagination
 
     def get_permissions(self):
-        if self.request.method in ["PATCH", "DELETE"]:
+        if self.request.method in ["PATCH", "DELETE"] or self.action == "export":
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    @action(
+        detail=False,
+        methods=["get"],
+        renderer_classes=[exports.NDJSONRenderer, exports.CSVRenderer],
+    )
+    def export(self, request):
+        """
+        Streams every order with its items as NDJSON (default) or CSV
+        (?format=csv), filtered by `placed_at__gte`, `placed_at__lt` and
+        `payment_status`.
+        """
+
+        filterset = OrderFilter(request.query_params, queryset=Order.objects.all())
+        if not filterset.is_valid():
+            raise serializers.ValidationError(filterset.errors)
+
+        orders = exports.iter_orders(filterset.qs)
+        renderer = request.accepted_renderer
+        if renderer.format == exports.CSVRenderer.format:
+            content = exports.iter_csv(orders)
+        else:
+            content = exports.iter_ndjson(orders)
+
+        response = StreamingHttpResponse(
+            content, content_type=f"{renderer.media_type}; charset={renderer.charset}"
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="orders.{renderer.format}"'
+        return response
+
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(
             data=request.data, context={"user_id": self.request.user.id}
         )
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
-        serializer = OrderSerializer(order)
+        serializer = OrderSerializer(self.get_queryset().get(pk=order.pk))
         return Response(serializer.data)
 
     def get_serializer_class(self):
@@ -200,19 +415,19 @@ class OrderViewSet(ModelViewSet):
         who placed this order.
         """
 
+        queryset = Order.objects.with_items()
+
         user = self.request.user
         if user.is_staff:
-            return Order.objects.all()
-        customer_id = Customer.objects.only("id").get(user_id=user.id)
-
-        return Order.objects.filter(customer_id=customer_id)
+            return queryset.all()
+        return queryset.filter(customer__user_id=user.id)
 
 
 class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
 
     def get_serializer_context(self):
-        return {"product_id": self.kwargs["product_pk"]}
+        return {"product_id": self.kwargs["product_pk"], "request": self.request}
 
     def get_queryset(self):
         return ProductImage.objects.filter(product_id=self.kwargs["product_pk"])
@@ -0,0 +1,156 @@
+"""
+Non-blocking logging, see LOGGING in the settings.
+
+Records are handed to QueueHandler, which puts them on a bounded queue
+without waiting; a background thread (logging.handlers.QueueListener) writes
+them to the handlers that do I/O. When the queue is full, e.g. because the
+disk is slow, records are dropped and counted instead of stalling the
+request, and the count is logged once there is room again.
+
+SamplingFilter keeps a fraction of the INFO and lower records of chatty
+loggers, JSONFormatter writes one JSON object per record.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+
+
+# Attributes of every LogRecord, anything else was passed in `extra`
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room when stopping with a full queue, the thread drains it
+        self.queue.put(self._sentinel)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for `handlers`, which are started in a listener thread on
+    the first record. Forked processes (gunicorn and Celery workers) start
+    their own. In LOGGING, the handlers are given as "cfg://handlers.<name>"
+    and have to sort before the name of this one, dictConfig configures
+    handlers in that order.
+    """
+
+    def __init__(self, handlers, maxsize=10_000):
+        super().__init__(queue.Queue(maxsize))
+        # dictConfig converts the items of a list when they are indexed, not
+        # when it is iterated
+        self.targets = [handlers[i] for i in range(len(handlers))]
+        for handler in self.targets:
+            if not isinstance(handler, logging.Handler):
+                raise TypeError(f"{handler!r} is not a configured handler")
+        self.listener = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+        self.dropped = 0
+        self.reported = 0
+
+    def start(self):
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            # After a fork, the listener thread of the parent is gone
+            self.listener = QueueListener(
+                self.queue, *self.targets, respect_handler_level=True
+            )
+            self.listener.start()
+            self.pid = os.getpid()
+            # Writes what's still queued when the process exits
+            atexit.register(self.stop)
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = self.pid = None
+
+    def prepare(self, record):
+        # Like the base class, but the traceback stays out of the message so
+        # it can be formatted on its own
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Not exact across threads, only a hint of how much was lost
+            self.dropped += 1
+            return
+
+        if self.dropped > self.reported:
+            dropped, self.reported = self.dropped - self.reported, self.dropped
+            report = logging.makeLogRecord(
+                {
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "Dropped %s log records, the log queue was full",
+                    "args": (dropped,),
+                    "dropped": dropped,
+                }
+            )
+            try:
+                self.queue.put_nowait(self.prepare(report))
+            except queue.Full:
+                self.reported -= dropped
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records below WARNING of the loggers in `rates`
+    ({logger name: rate between 0 and 1}), children included.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def get_rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        return random.random() < self.get_rate(record.name)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+        return json.dumps(data, default=str)
@@ -46,9 +46,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "store.metrics.MetricsMiddleware",
+    "store.instrumentation.QueryInstrumentationMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "storefront.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -129,6 +131,13 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Reject oversized uploads while they stream in (see store.uploads)
+FILE_UPLOAD_HANDLERS = [
+    "store.uploads.MaxFileSizeUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -172,11 +181,23 @@ ADMINS = [
 
 CELERY_BROKER_URL = "redis://localhost:6379/1"
 CELERY_BEAT_SCHEDULE = {
-    "notify_customer": {
-        "task": "playground.tasks.notify_customers",
-        "schedule": 5,
-        "args": ["Hello World"],
-    }
+    "flush_carts": {
+        "task": "store.tasks.flush_carts",
+        "schedule": 60,
+    },
+    # Picks up outbox messages whose on-commit dispatch was missed or failed
+    "dispatch_outbox": {
+        "task": "store.tasks.dispatch_outbox",
+        "schedule": 10,
+    },
+    "flush_like_counts": {
+        "task": "likes.tasks.flush_like_counts",
+        "schedule": 60,
+    },
+    "reconcile_like_counts": {
+        "task": "likes.tasks.reconcile_like_counts",
+        "schedule": crontab(hour=4, minute=0),
+    },
 }
 
 CACHES = {
@@ -190,22 +211,83 @@ CACHES = {
     }
 }
 
+# Versioned cache for /store/products/ (see store.caching)
+CATALOGUE_CACHE_ENABLED = True
+
+# Serve product and collection reads from values() rows instead of
+# serializers (see store.listings)
+CATALOGUE_FAST_READS = False
+
+# Query counts, database time and N+1 patterns of a sample of the requests,
+# per endpoint (see store.instrumentation and the query_stats command)
+QUERY_INSTRUMENTATION = {
+    "SAMPLE_RATE": float(os.environ.get("QUERY_SAMPLE_RATE", 0.01)),
+    "DEFAULT_BUDGET": 20,
+    "BUDGETS": {
+        "ProductViewSet.list": 5,
+        "ProductViewSet.retrieve": 3,
+        "CollectionViewSet.list": 3,
+        "OrderViewSet.list": 4,
+        "OrderViewSet.retrieve": 3,
+    },
+    "REPEATED_QUERY_THRESHOLD": 5,
+}
+
+# Upstream called by playground's HelloView, see playground.httpbin
+HTTPBIN = {
+    "URL": os.environ.get("HTTPBIN_URL", "https://httpbin.org/delay/2"),
+    "TIMEOUT": 5,
+    "MAX_CONNECTIONS": 20,
+    "CACHE_TTL": 60,
+    "FAILURE_THRESHOLD": 5,
+    "RESET_TIMEOUT": 30,
+}
+
+# Lets Prometheus scrape /metrics with `Authorization: Bearer <token>`
+# (see store.metrics), staff users can always read it
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Redis connection holding the like counters (see likes.counters)
+LIKES_CACHE_ALIAS = "default"
+
+# Where live carts are kept (see store.carts)
+CART_STORE = {
+    "BACKEND": os.environ.get("CART_STORE_BACKEND", "store.carts.DatabaseCartStore"),
+    "OPTIONS": {},
+}
+
+# Handlers doing I/O run in a background thread fed by the "queue" handler,
+# see storefront.logs
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "filters": {
+        "sampling": {
+            "()": "storefront.logs.SamplingFilter",
+            # Share of the INFO records kept, per logger
+            "rates": {"playground.views": 0.1},
+        },
+    },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
+            "formatter": "verbose",
         },
         "file": {
             "class": "logging.FileHandler",
             "filename": "general.log",
-            "formatter": "verbose",
+            "formatter": "json",
+        },
+        "queue": {
+            "()": "storefront.logs.QueueHandler",
+            "handlers": ["cfg://handlers.console", "cfg://handlers.file"],
+            "maxsize": 10_000,
+            "filters": ["sampling"],
         },
     },
     "loggers": {
         "": {
-            "handlers": ["console", "file"],
+            "handlers": ["queue"],
             "level": os.environ.get("DJANGO_LOG_LEVEL", "INFO"),
         }
     },
@@ -213,6 +295,9 @@ LOGGING = {
         "verbose": {
             "format": "{asctime} ({levelname}) - {name} - {message}",
             "style": "{",
-        }
+        },
+        "json": {
+            "()": "storefront.logs.JSONFormatter",
+        },
     },
 }
@@ -21,6 +21,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from store.metrics import metrics_view
+
 admin.site.site_header = "Storefront Admin"
 admin.site.index_title = "Admin"
 
@@ -32,6 +34,7 @@ urlpatterns = [
     path("auth/", include("djoser.urls")),
     path("auth/", include("djoser.urls.jwt")),
     path("__debug__/", include(debug_toolbar.urls)),
+    path("metrics", metrics_view),
 ]
 
 if settings.DEBUG:
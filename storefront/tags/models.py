@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -13,9 +15,47 @@ class TaggedItemManager(models.Manager):
 
         return queryset
 
+    def get_tags_for_many(self, obj_type, obj_ids):
+        """
+        Returns {object id: [tags]} for the given objects with one query.
+        Objects without tags are left out.
+        """
+
+        # get_for_model caches the content types for the life of the process
+        content_type = ContentType.objects.get_for_model(obj_type)
+
+        queryset = (
+            TaggedItem.objects.select_related("tag")
+            .filter(content_type=content_type, object_id__in=obj_ids)
+            .order_by("tag__label", "tag_id")
+        )
+
+        tags = defaultdict(list)
+        for tagged_item in queryset:
+            tags[tagged_item.object_id].append(tagged_item.tag)
+        return dict(tags)
+
+    def get_object_ids_tagged(self, obj_type, labels):
+        """
+        Returns a queryset of the ids of the objects tagged with every one of
+        `labels`, to be used as a subquery.
+        """
+
+        content_type = ContentType.objects.get_for_model(obj_type)
+        labels = set(labels)
+
+        return (
+            TaggedItem.objects.filter(content_type=content_type, tag__label__in=labels)
+            .order_by()
+            .values("object_id")
+            .annotate(matched=models.Count("tag__label", distinct=True))
+            .filter(matched=len(labels))
+            .values("object_id")
+        )
+
 
 class Tag(models.Model):
-    label = models.CharField(max_length=255)
+    label = models.CharField(max_length=255, db_index=True)
 
     def __str__(self) -> str:
         return self.label
@@ -28,3 +68,11 @@ class TaggedItem(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            # Tags of given objects (get_tags_for, get_tags_for_many)
+            models.Index(fields=["content_type", "object_id"]),
+            # Objects carrying given tags (get_object_ids_tagged)
+            models.Index(fields=["tag", "content_type", "object_id"]),
+        ]